@@ -1,217 +1,435 @@
 import datetime
 import os
 import logging
-import time
+import threading
 from flask import Flask
-import requests
-import pandas as pd
-from apscheduler.schedulers.background import BackgroundScheduler
-import feature_pattern_creation
 import testclient_and_orders
-from binance.client import Client
-from binance.enums import *
-from dotenv import load_dotenv
+from market_data import fetch_data, now_ms
 
 app = Flask(__name__)
 
+DATA_DIR = os.getenv("TRADING_DATA_DIR", "C:\\Users\\Boris\\Desktop\\trading web app")
+
+
+def data_filename(symbol, interval):
+    return os.path.join(DATA_DIR, symbol, f"{symbol}_{interval}_data.csv")
+
 
 def setup_logging():
-    orders_dir = "orders"
-    if not os.path.exists(orders_dir):
-        os.makedirs(orders_dir)
-    logging.basicConfig(
-        filename=os.path.join(orders_dir, "order_logs.log"),
-        level=logging.INFO,
-        format="%(asctime)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
+    import trade_logging
+
+    return trade_logging.setup_logging()
+
+
+resamplers = {}
+
+
+_state_locks = {}
+_state_locks_guard = threading.Lock()
+
+
+def state_lock(key):
+    """
+    Lock of the streaming state kept under `key`, a (symbol, interval) pair,
+    or an interval for the state shared by all symbols (the comoments).
+    The job of an interval holds it while advancing that state, invalidate
+    while rewinding it, readers while reading it.
+    """
+    with _state_locks_guard:
+        return _state_locks.setdefault(key, threading.RLock())
+
+
+def get_resampler(symbol):
+    resampler = resamplers.get(symbol)
+    if resampler is None:
+        import resampling
+
+        resampler = resampling.CandleResampler(symbol)
+        # one-off history for the derived intervals, later bars come from the base candles
+        for derived_interval in resampler.intervals:
+            resampler.seed(derived_interval, fetch_data(symbol, derived_interval), now_ms())
+        resamplers[symbol] = resampler
+    return resampler
+
+
+def update_candles(symbol, interval):
+    import ingest
+
+    resampler = get_resampler(symbol)
+    limit = min(max(resampler.missing_bars(now_ms()) + 1, 2), 1000)
+    data = fetch_data(symbol, interval=resampler.base_interval, limit=limit)
+    after = resampler.last_open_time()
+    if after is not None:
+        # candles older than the history keeps are not worth a repair
+        oldest = now_ms() // resampler.base_ms * resampler.base_ms
+        after = max(after, oldest - resampler.max_base_bars * resampler.base_ms)
+    candles, resampler.gaps = ingest.ingest(
+        symbol, resampler.base_interval, data, after=after, gaps=resampler.gaps
     )
+    resampler.update(candles, now_ms())
+    repaired = resampler.repair(candles)
+    if len(repaired):
+        invalidate(symbol, int(repaired.min()))
+    return resampler.frame(interval)
 
 
-setup_logging()
-logging.basicConfig()
+def invalidate(symbol, since_ms):
+    """
+    Forget the streaming state of `symbol` built on candles from `since_ms`
+    on, in every interval whose bar holds that candle. Newer state of other
+    symbols and intervals is left alone.
+    """
+    import resampling
 
-load_dotenv("keyz.env")
+    for interval, interval_ms in resampling.INTERVAL_MS.items():
+        bucket_ms = since_ms // interval_ms * interval_ms
+        since = resampling.output_time(bucket_ms)
+        key = (symbol, interval)
+        with state_lock(key):
+            buffer = ring_buffers.get(key)
+            if buffer is not None and buffer.truncate(since):
+                logging.info("Rewinding %s %s features to %s.", symbol, interval, since)
+            # both replay the closed candles of the next frame when rebuilt
+            for states in (divergence_detectors, swing_indexes):
+                state = states.get(key)
+                if state is not None and state.last_time is not None and state.last_time >= since:
+                    del states[key]
+        # the sums cannot take a changed return back, rebuilt from the windows on the next push
+        with state_lock(interval):
+            moments = comoments.get(interval)
+            if moments is not None and moments.last_time is not None and moments.last_time >= since:
+                del comoments[interval]
+        # the repaired candles are added back by the next push_buffers
+        index = similarity_indexes.get(interval)
+        if index is not None and index.truncate(symbol, bucket_ms):
+            logging.info("Rewinding the %s similarity windows of %s to %s.", interval, symbol, since)
 
-api_key = os.getenv("BINANCE_TEST_API_KEY")
-secret_key = os.getenv("BINANCE_TEST_SECRET_KEY")
 
-client = Client(api_key, secret_key, testnet=True)
+divergence_detectors = {}
 
 
-def fetch_data(symbol, interval, limit=700):
-    url = "https://api.binance.com/api/v3/klines"
-    params = {
-        "symbol": symbol,
-        "interval": interval,
-        "limit": limit,
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    return data
-
-
-def scheduled_fetch(interval):
-    symbols = [
-        "BTCUSDT",
-        "ETHUSDT",
-        "BNBUSDT",
-        "SOLUSDT",
-        "XRPUSDT",
-        "DOGEUSDT",
-        "ADAUSDT",
-        "SHIBUSDT",
-        "AVAXUSDT",
-        "WBTCUSDT",
-        "TRXUSDT",
-        "LINKUSDT",
-    ]
+def get_divergence_detector(symbol, interval):
+    key = (symbol, interval)
+    if key not in divergence_detectors:
+        import divergence
+
+        divergence_detectors[key] = divergence.DivergenceDetector()
+    return divergence_detectors[key]
+
+
+ring_buffers = {}
+
+
+def get_ring_buffer(symbol, interval):
+    key = (symbol, interval)
+    if key not in ring_buffers:
+        import ringbuffer
+
+        ring_buffers[key] = ringbuffer.CandleRingBuffer()
+    return ring_buffers[key]
+
+
+def latest_features(symbol, interval, filename, n=2):
+    """Last `n` feature rows, straight from the ring buffer when the live loop filled it."""
+    import schema
+
+    with state_lock((symbol, interval)):
+        buffer = ring_buffers.get((symbol, interval))
+        if buffer is not None and len(buffer) >= n:
+            # a copy, the view is overwritten by the next push
+            return buffer.window(n).copy()
+    df = schema.read_features(filename + "_for_processing.csv")
+    return df.tail(n).to_records(index=False)
+
+
+_feature_store = None
+
+
+def get_feature_store():
+    global _feature_store
+    if _feature_store is None:
+        import feature_store
+
+        _feature_store = feature_store.FeatureStore()
+    return _feature_store
+
+
+_feature_reader = None
+
+
+def get_feature_reader():
+    global _feature_reader
+    if _feature_reader is None:
+        import feature_store
+
+        _feature_reader = feature_store.FeatureReader(get_feature_store())
+    return _feature_reader
+
+
+_feature_cache = None
+
+
+def get_feature_cache():
+    global _feature_cache
+    if _feature_cache is None:
+        import feature_cache
+
+        _feature_cache = feature_cache.FeatureCache()
+    return _feature_cache
+
+
+def scheduled_fetch(interval, symbols=None):
+    """Fetch, process and evaluate the rules for `symbols`, the default universe if None."""
+    import feature_pattern_creation
+    import schema
+    import universe
+
+    if symbols is None:
+        symbols = universe.DEFAULT_SYMBOLS
     for symbol in symbols:
         try:
-            logging.info(f"Running scheduled data fetch for {symbol}...")
-            data = fetch_data(symbol, interval="1h")
-
-            df = pd.DataFrame(
-                data,
-                columns=[
-                    "Open Time",
-                    "Open",
-                    "High",
-                    "Low",
-                    "Close",
-                    "Volume",
-                    "Close Time",
-                    "Quote Asset Volume",
-                    "Number of Trades",
-                    "Taker Buy Base Asset Volume",
-                    "Taker Buy Quote Asset Volume",
-                    "Ignore",
-                ],
-            )
+            logging.info("Running scheduled data fetch for %s...", symbol)
+            df = update_candles(symbol, interval)
 
-            df["Open Time"] = pd.to_datetime(df["Open Time"], unit="ms")
-            df["Open Time"] = df["Open Time"] + pd.Timedelta(hours=2)
-            dir = f"C:\\Users\\Boris\\Desktop\\trading web app\\{symbol}"
+            filename = data_filename(symbol, interval)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            schema.memory_report(df, filename)
+            df.to_csv(filename, index=False)
 
-            if not os.path.exists(dir):
-                os.makedirs(dir)
+            with state_lock((symbol, interval)):
+                features = feature_pattern_creation.process_data(
+                    filename,
+                    data=df,
+                    divergence_detector=get_divergence_detector(symbol, interval),
+                    cache=get_feature_cache(),
+                )
+                features = features.assign(High=df["High"].values, Low=df["Low"].values)
+                get_ring_buffer(symbol, interval).push_frame(features)
+            get_feature_store().publish(symbol, interval, features)
+            # the 1h job owns the 1h swing index, it advances on the features just written
+            if interval == "1h":
+                find_trend(symbol, interval)
 
-            filename = f"{dir}\\{symbol}_{interval}_data.csv"
-            df.to_csv(filename, index=False)
+        except Exception as e:
+            logging.exception("Error during the scheduled fetch for %s.", symbol)
+
+    buffers = {symbol: ring_buffers.get((symbol, interval)) for symbol in symbols}
+    windows = universe_windows(symbols, interval)
+    with state_lock(interval):
+        get_comoments(interval).push_windows(windows)
+    if interval in similarity_indexes:
+        similarity_indexes[interval].push_buffers(buffers)
+    run_rules(symbols, interval)
+    manage_exits(symbols, interval)
+
+
+def universe_windows(symbols, interval):
+    """
+    Feature windows of every symbol any worker published, so the comoments
+    of every shard cover the whole universe. The local `symbols` are read
+    from their ring buffers.
+    """
+    windows = {}
+    for symbol in get_feature_store().symbols(interval):
+        if symbol in symbols:
+            continue
+        try:
+            _, records = get_feature_reader().get(symbol, interval)
+        except RuntimeError:
+            continue
+        if records is not None:
+            windows[symbol] = records
+    for symbol in symbols:
+        with state_lock((symbol, interval)):
+            buffer = ring_buffers.get((symbol, interval))
+            if buffer is not None and len(buffer) >= 2:
+                windows[symbol] = buffer.window().copy()
+    return windows
 
-            find_trend(symbol, interval="1h")
-            feature_pattern_creation.process_data(filename)
 
-            check_divergences(symbol, interval)
-            check_rsi(symbol, interval)
+comoments = {}
+
+
+def get_comoments(interval):
+    if interval not in comoments:
+        import cross_asset
+
+        comoments[interval] = cross_asset.RollingComoments()
+    return comoments[interval]
 
-        except Exception as e:
-            logging.exception(f"Error during the scheduled fetch for {symbol}.")
+
+# the intervals the scheduler keeps a similarity index for
+SIMILARITY_INTERVALS = ("5m", "1h")
+similarity_indexes = {}
+similarity_lock = threading.Lock()
+
+
+def get_similarity_index(interval):
+    """
+    Pattern index over the stored history of `interval`, built once (callers
+    meanwhile wait for it) and kept current by scheduled_fetch.
+    """
+    with similarity_lock:
+        if interval not in similarity_indexes:
+            import similarity
+
+            similarity_indexes[interval] = similarity.build(interval)
+        return similarity_indexes[interval]
+
+
+def feature_matrix(symbols, interval):
+    """Last two feature rows of every symbol plus the SwingIndex flag inputs."""
+    import numpy as np
+    import rules
+
+    windows = {}
+    extra = {"in_consolidation": {}, "flag_reference": {}}
+    with state_lock(interval):
+        if interval in comoments:
+            extra["market_beta"] = comoments[interval].market_beta()
+            extra["market_correlation"] = comoments[interval].market_correlation()
+    for symbol in symbols:
+        try:
+            window = latest_features(symbol, interval, data_filename(symbol, interval))
+        except FileNotFoundError:
+            continue
+        if len(window) < 2:
+            continue
+        windows[symbol] = window
+        with state_lock((symbol, interval)):
+            index = swing_indexes.get((symbol, interval))
+            if index is None:
+                continue
+            forming_close = float(window[-1]["Close"])
+            reference = index.last_non_consolidated_close(forming_close)
+            extra["in_consolidation"][symbol] = float(index.is_consolidated(forming_close))
+        extra["flag_reference"][symbol] = np.nan if reference is None else reference
+    return rules.FeatureMatrix.from_windows(windows, extra), windows
+
+
+def run_rules(symbols, interval, rule_set=None):
+    """Evaluate the signal rules over the whole universe at once and place the orders."""
+    import cross_asset
+    import rules
+
+    actions = []
+    groups = rules.by_data_interval(rule_set or rules.DEFAULT_RULES, interval)
+    for data_interval, interval_rules in groups.items():
+        matrix, windows = feature_matrix(symbols, data_interval)
+        triggered = rules.evaluate(interval_rules, matrix)
+        with state_lock(data_interval):
+            if data_interval in comoments:
+                triggered = cross_asset.drop_correlated(triggered, comoments[data_interval])
+        for symbol, side, reason in triggered:
+            actions.append((symbol, side, reason))
+            last_row = windows[symbol][-1]
+            logging.info(
+                "Rule %s triggered a %s in %s %s at %s",
+                reason, side, symbol, data_interval, last_row["Close"],
+            )
+            try:
+                order = buy if side == "long" else sell
+                order(symbol, data_interval, last_row["Close"], last_row["ATR"], reason)
+            except Exception:
+                logging.exception("Error placing the %s for %s.", side, symbol)
+    return actions
+
+
+swing_indexes = {}
+
+
+def get_swing_index(symbol, interval):
+    key = (symbol, interval)
+    if key not in swing_indexes:
+        import swing
+
+        swing_indexes[key] = swing.SwingIndex()
+    return swing_indexes[key]
 
 
 def find_trend(symbol, interval):
-    dir = f"C:\\Users\\Boris\\Desktop\\trading web app\\{symbol}"
-    filename = f"{dir}\\{symbol}_{interval}_data.csv"
-    df = pd.read_csv(filename + "_for_processing.csv")
+    import schema
+    import trade_logging
+
+    filename = data_filename(symbol, interval)
+    df = schema.read_features(filename + "_for_processing.csv")
     if df.empty:
-        print(f"No data in {filename}.")
+        logging.warning("No data in %s.", filename)
         return
 
-    flag = None
-    prev_high_value = prev_low_value = 0
-    trend = None
-
     last_row = df.iloc[-1]
     current_price = last_row["Close"]
     previous_row = df.iloc[-2]
     previous_close = previous_row["Close"]
-    atr = last_row["ATR"]
-    non_consolidated_df = df[df["consolidated"] == 0]
-
-    if last_row["consolidated"] == 1:
-        if not non_consolidated_df.empty:
-            last_non_consolidated_row = non_consolidated_df.iloc[-1]
-            last_non_consolidated_price = last_non_consolidated_row["Close"]
-        else:
-            logging.info(
-                f"No non-consolidated rows found in {filename}. Unable to determine flag."
-            )
 
-        if (
-            last_non_consolidated_price is not None
-            and previous_close > last_non_consolidated_price
-        ):
-            flag = "bull_flag"
-        elif (
-            last_non_consolidated_price is not None
-            and previous_close < last_non_consolidated_price
-        ):
-            flag = "bear_flag"
-
-    for index, row in df.iterrows():
-        row_close = row["Close"]
-
-        if row["extrema"] == "high":
-            prev_high_value = row_close
-        if row["extrema"] == "low":
-            prev_low_value = row_close
-
-    if previous_close > prev_high_value:
-        trend = "uptrend"
-    elif previous_close < prev_high_value and previous_close > prev_low_value:
-        trend = "equilibrium?"
-
-    if previous_close < prev_low_value:
-        trend = "downtrend"
-    elif previous_close > prev_low_value and previous_close < prev_high_value:
-        trend = "equilibrium?"
-
-    if flag == "bull_flag":
-        buy(symbol, interval, current_price, atr, reason=flag)
-
-    elif flag == "bear_flag":
-        sell(symbol, interval, current_price, atr, reason=flag)
+    with state_lock((symbol, interval)):
+        # only candles that closed since the last call are added to the index
+        index = get_swing_index(symbol, interval).apply(df)
+        flag = index.flag(previous_close, forming_close=current_price)
+        trend, prev_high_value, prev_low_value = index.trend(
+            previous_close, forming_close=current_price
+        )
+        consolidated = index.is_consolidated(current_price) and (
+            index.last_non_consolidated_close(current_price) is None
+        )
+        structure = index.structure()
+    if consolidated:
+        logging.info(
+            "No non-consolidated rows found in %s. Unable to determine flag.", filename
+        )
 
-    logging.info(
-        f"At {row['Open Time']} {interval} {symbol} trend is {trend}  Flag: {flag}, price: {current_price}, prev high value: {prev_high_value}, prev low value: {prev_low_value} "
+    # trading on the flag is left to the bull_flag/bear_flag rules in run_rules
+    trade_logging.log_event(
+        "trend",
+        symbol=symbol,
+        interval=interval,
+        time=last_row["Open Time"],
+        trend=trend,
+        flag=flag,
+        price=current_price,
+        prev_high=prev_high_value,
+        prev_low=prev_low_value,
+        structure=structure,
     )
 
     return df, trend
 
 
 def sell(symbol, interval, current_price, atr, reason):
-    stop_loss_price = current_price + (1.8 * atr)
+    client = testclient_and_orders.get_client()
+    position_size = sizing(symbol, current_price, interval)
     logging.info(
-        f"Reason for short: {reason}, price at {current_price}, stop at: {stop_loss_price}, interval: {interval}. "
+        "Reason for short: %s, price at %s, interval: %s.", reason, current_price, interval
     )
-    position_size = sizing(symbol, current_price)
     testclient_and_orders.log_trade_action(
         symbol, "short", position_size, current_price, reason
     )
     status = testclient_and_orders.check_margin_short_position(client, symbol)
-    logging.info(f"SHORT Status for {symbol}: {status}")
+    logging.info("SHORT Status for %s: %s", symbol, status)
     if status == (
         False,
         0.0,
     ) and testclient_and_orders.check_margin_level_and_allow_trading(client):
 
-        stop = testclient_and_orders.adjust_price_to_filter(
-            client, symbol, stop_loss_price
-        )
-
-        if interval == "5m":
-            target_profit_price = current_price - (atr * 1.5)  
-
-        target = testclient_and_orders.adjust_price_to_filter(
-            client, symbol, target_profit_price
-        )
+        try:
+            exit_order = preview_exit(symbol, interval, "short", current_price, atr, position_size)
+        except Exception:
+            logging.exception("Could not compute the exits of the short in %s.", symbol)
+            return
+        logging.info("%s stop at: %s, target at: %s", symbol, exit_order.stop, exit_order.target)
+        # placement stays off, nothing reaches the exit engine until it is on
+        entry = None
+    #   entry = testclient_and_orders.place_margin_short_with_oco(client, symbol, position_size, exit_order.stop, exit_order.target)
+        if entry is not None:
+            open_exit(symbol, interval, "short", current_price, atr, position_size, entry)
 
 
 def buy(symbol, interval, current_price, atr, reason):
-    stop_loss_price = current_price - (1.8 * atr)
+    client = testclient_and_orders.get_client()
+    position_size = sizing(symbol, current_price, interval)
     logging.info(
-        f"Reason for long: {reason}, price at {current_price}, stop at: {stop_loss_price}, interval: {interval}."
+        "Reason for long: %s, price at %s, interval: %s.", reason, current_price, interval
     )
-    position_size = sizing(symbol, current_price)
     testclient_and_orders.log_trade_action(
         symbol, "buy", position_size, current_price, reason
     )
@@ -220,22 +438,118 @@ def buy(symbol, interval, current_price, atr, reason):
         client
     ):
 
-        stop = testclient_and_orders.adjust_price_to_filter(
-            client, symbol, stop_loss_price
-        )
+        try:
+            exit_order = preview_exit(symbol, interval, "long", current_price, atr, position_size)
+        except Exception:
+            logging.exception("Could not compute the exits of the long in %s.", symbol)
+            return
+        logging.info("%s stop at: %s, target at: %s", symbol, exit_order.stop, exit_order.target)
+        # placement stays off, nothing reaches the exit engine until it is on
+        entry = None
+    #   entry = testclient_and_orders.place_long_with_stop_loss(client, symbol, position_size, exit_order.stop)
+        if entry is not None:
+            open_exit(symbol, interval, "long", current_price, atr, position_size, entry)
+
+
+exit_engines = {}
+
+
+def get_exit_engine(interval):
+    if interval not in exit_engines:
+        import exits
+
+        exit_engines[interval] = exits.ExitEngine()
+    return exit_engines[interval]
+
+
+def exit_candle(symbol, interval):
+    """Last closed candle in the ring buffer with the strong levels of the whole window."""
+    import exits
+
+    with state_lock((symbol, interval)):
+        buffer = ring_buffers.get((symbol, interval))
+        if buffer is None or len(buffer) < 2:
+            return None
+        rows = buffer.window()[:-1].copy()
+    last = rows[-1]
+    close = float(last["Close"])
+    return dict(
+        time=int(last["Open Time"]),
+        high=float(last["High"]),
+        low=float(last["Low"]),
+        close=close,
+        atr=float(last["ATR"]),
+        levels=exits.strong_levels(rows["High"], rows["Low"], exits.LEVEL_BIN * close),
+    )
 
-        if interval == "5m":
-            target_profit_price = current_price + (atr * 2)
 
-        target = testclient_and_orders.adjust_price_to_filter(
-            client, symbol, target_profit_price
-        )
+def preview_exit(symbol, interval, side, current_price, atr, quantity):
+    """First stop and target (an exits.ExitOrder) of a position about to be entered."""
+    client = testclient_and_orders.get_client()
+    candle = exit_candle(symbol, interval) or {}
+    return get_exit_engine(interval).preview(
+        symbol,
+        side,
+        current_price,
+        atr,
+        quantity,
+        testclient_and_orders.get_tick_size(client, symbol),
+        levels=candle.get("levels"),
+    )
+
+
+def open_exit(symbol, interval, side, current_price, atr, quantity, entry):
+    """
+    Hand a position whose entry was placed to the exit engine, `entry` is the
+    placement response of its first stop or OCO. Returns its first exit order.
+    """
+    import trade_logging
+
+    client = testclient_and_orders.get_client()
+    candle = exit_candle(symbol, interval) or {}
+    exit_order = get_exit_engine(interval).open(
+        symbol,
+        side,
+        current_price,
+        atr,
+        quantity,
+        testclient_and_orders.get_tick_size(client, symbol),
+        levels=candle.get("levels"),
+        time=candle.get("time"),
+    )
+    testclient_and_orders.track_exit(exit_order.position, entry)
+    trade_logging.log_event("exit", interval=interval, **exit_order._asdict())
+    return exit_order
 
-    #   testclient_and_orders.place_long_with_stop_loss(client, symbol, position_size, stop, target)
 
+def manage_exits(symbols, interval):
+    """Move the stops and targets of every open position by the candle that just closed."""
+    import trade_logging
 
-def sizing(symbol, current_price):
+    engine = exit_engines.get(interval)
+    if engine is None or len(engine) == 0:
+        return []
+    candles = {}
+    for symbol in symbols:
+        if symbol in engine.index:
+            candle = exit_candle(symbol, interval)
+            if candle is not None:
+                candles[symbol] = candle
+    exit_orders = engine.update(candles)
+    for exit_order in exit_orders:
+        trade_logging.log_event("exit", interval=interval, **exit_order._asdict())
+        # testclient_and_orders.send_exit_order(testclient_and_orders.get_client(), exit_order)
+    return exit_orders
+
+
+def sizing(symbol, current_price, interval=None):
+    client = testclient_and_orders.get_client()
     percentage = 0.05
+    # the same capital share in a coin moving 2x the market is 2x the risk
+    with state_lock(interval):
+        beta = comoments[interval].market_beta().get(symbol) if interval in comoments else None
+    if beta is not None and beta > 1:
+        percentage /= beta
     capital = testclient_and_orders.check_usdt_balance(client, asset="USDT")
     if symbol in ["SHIBUSDT", "PEPEUSDT", "BONKUSDT", "FLOKIUSDT"]:
         formatted_price = "{:.8f}".format(current_price)
@@ -245,119 +559,40 @@ def sizing(symbol, current_price):
     position_size = testclient_and_orders.adjust_quantity_to_minimum(
         client, symbol, qty
     )
-    print(f"qty: {qty} , price: {current_price}, final size: {position_size}")
-    logging.info(f"qty: {qty} , price: {current_price}, final size: {position_size}")
+    logging.info("qty: %s , price: %s, final size: %s", qty, current_price, position_size)
 
     return position_size
 
 
-def check_divergences(symbol, interval):
-    dir = f"C:\\Users\\Boris\\Desktop\\trading web app\\{symbol}"
-    filename = f"{dir}\\{symbol}_{interval}_data.csv"
-    try:
-        df = pd.read_csv(filename + "_for_processing.csv")
-        if df.empty:
-            print(f"No data in {filename}.")
-            return
-        last_row = df.iloc[-1]
-        current_price = last_row["Close"]
-        before_last_row = df.iloc[-2]
-        rsi = float(last_row["RSI"])
-        atr = last_row["ATR"]
-
-        print(f"Checking  {filename} for {interval} divergences.")
-
-        if (
-            before_last_row["bullish_divergence"] == 1
-            or before_last_row["bearish_divergence"] == 1
-        ):
-            if interval == "15m":
-                if rsi > 75 or rsi < 25:
-                    if rsi > 75:
-                        logging.info(
-                            f"Opening short because of divergence in {symbol} {interval} at {current_price}"
-                        )
-                        sell(symbol, interval, current_price, atr, "bearish divergence")
-                    else:
-                        logging.info(
-                            f"Opening long because of divergence in {symbol} {interval} at {current_price}"
-                        )
-                        buy(symbol, interval, current_price, atr, "bullish divergence")
-            else:
-                if rsi > 70:
-                    logging.info(
-                        f"Opening short because of divergence in {symbol} {interval} at {current_price}"
-                    )
-                    sell(symbol, interval, current_price, atr, "bearish divergence")
-                elif rsi < 30:
-                    logging.info(
-                        f"Opening long because of divergence in {symbol} {interval} at {current_price}"
-                    )
-                    buy(symbol, interval, current_price, atr, "bearish divergence")
-    except FileNotFoundError:
-        print(f"File {filename} not found")
-    except Exception as e:
-        print(f"Error processing file {filename}: {e}")
-
-
-def check_rsi(symbol, interval):
-    dir = f"C:\\Users\\Boris\\Desktop\\trading web app\\{symbol}"
-
-    filename = f"{dir}\\{symbol}_{interval}_data.csv"
-    try:
-        df = pd.read_csv(filename + "_for_processing.csv")
-        if df.empty:
-            print(f"No data in {filename}.")
-            return
-        if symbol != "BTCUSDT" and symbol != "WBTCUSDT":
-            last_row = df.iloc[-1]
-            rsi = float(last_row["RSI"])
-            current_price = last_row["Close"]
-            open_time = last_row["Open Time"]
-            atr = last_row["ATR"]
-
-            if rsi > 85:
-                sell(symbol, interval, current_price, atr, rsi)
-                print(f" In {filename} at {open_time}. ")
-
-            if rsi < 15:
-                buy(symbol, interval, current_price, atr, rsi)
-    except FileNotFoundError:
-        print(f"File {filename} not found")
-    except Exception as e:
-        print(f"Error processing file {filename}: {e}")
-
-
-scheduler = BackgroundScheduler()
-scheduler.add_job(
-    func=lambda: scheduled_fetch("5m"),
-    trigger="interval",
-    minutes=5,
-    max_instances=2,
-    next_run_time=datetime.datetime.now(),
-),
-scheduler.add_job(
-    func=lambda: scheduled_fetch("1h"),
-    trigger="interval",
-    minutes=31,
-    max_instances=2,
-    next_run_time=datetime.datetime.now() + datetime.timedelta(minutes=2),
-)
-""" scheduler.add_job(
-    func=lambda: scheduled_fetch("4h"),
-    trigger="interval",
-    minutes=120,
-    max_instances=2,
-    next_run_time=datetime.datetime.now() + datetime.timedelta(minutes=7),
-) """
-scheduler.start()
-
-try:
-    while True:
-        time.sleep(10)
-except KeyboardInterrupt:
-    print("Stopping scheduler...")
-    scheduler.shutdown()
+def start_scheduler():
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        func=lambda: scheduled_fetch("5m"),
+        trigger="interval",
+        minutes=5,
+        max_instances=1,
+        next_run_time=datetime.datetime.now(),
+    )
+    scheduler.add_job(
+        func=lambda: scheduled_fetch("1h"),
+        trigger="interval",
+        minutes=31,
+        max_instances=1,
+        next_run_time=datetime.datetime.now() + datetime.timedelta(minutes=2),
+    )
+    """ scheduler.add_job(
+        func=lambda: scheduled_fetch("4h"),
+        trigger="interval",
+        minutes=120,
+        max_instances=1,
+        next_run_time=datetime.datetime.now() + datetime.timedelta(minutes=7),
+    ) """
+    # built once at startup, so no /similar request pays for the build
+    scheduler.add_job(func=lambda: [get_similarity_index(interval) for interval in SIMILARITY_INTERVALS])
+    scheduler.start()
+    return scheduler
 
 
 @app.route("/")
@@ -365,5 +600,53 @@ def home():
     return "Data fetching and processing service is running."
 
 
+@app.route("/features/<symbol>/<interval>")
+def features(symbol, interval):
+    version, records = get_feature_store().read(symbol, interval)
+    if records is None or len(records) == 0:
+        return {"version": version, "rows": 0}, 404
+    last = records[-1]
+    return {
+        "version": version,
+        "rows": len(records),
+        "last": {
+            name: (str(last[name]) if name == "Open Time" else last[name].item())
+            for name in records.dtype.names
+        },
+    }
+
+
+@app.route("/similar/<symbol>/<interval>")
+def similar(symbol, interval):
+    if interval not in SIMILARITY_INTERVALS:
+        return {"matches": []}, 404
+    # built by the startup job, never inside a request
+    index = similarity_indexes.get(interval)
+    if index is None:
+        return {"matches": [], "building": True}, 503
+    if symbol not in index.index:
+        return {"matches": []}, 404
+    matches = []
+    for match in index.query_latest(symbol):
+        match = match._asdict()
+        # not known yet for the most recent matches
+        if match["forward_return"] != match["forward_return"]:
+            match["forward_return"] = None
+        matches.append(match)
+    return {"horizon": index.horizon, "matches": matches}
+
+
+def main():
+    setup_logging()
+    scheduler = start_scheduler()
+    try:
+        app.run(use_reloader=False)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info("Stopping scheduler...")
+        scheduler.shutdown()
+
+
 if __name__ == "__main__":
-    app.run(use_reloader=False)
+    main()
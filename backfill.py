@@ -0,0 +1,161 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import governor
+import market_data
+import resampling
+import schema
+from candle_store import STORE_DIR, CandleStore
+
+PAGE_SIZE = 1000
+
+
+def plan_pages(start_ms, end_ms, interval, page_size=PAGE_SIZE):
+    """Split [start_ms, end_ms) into aligned startTime/endTime pages of `page_size` candles."""
+    interval_ms = resampling.INTERVAL_MS[interval]
+    span = interval_ms * page_size
+    first = start_ms // interval_ms * interval_ms
+    return [(page, min(page + span, end_ms) - 1) for page in range(first, end_ms, span)]
+
+
+def first_open_time(symbol, interval, start_ms, end_ms, base_url=market_data.BASE_URL):
+    """Open time of the first candle in [start_ms, end_ms), None when the range has none."""
+    data = market_data.fetch_range(symbol, interval, start_ms, end_ms - 1, 1, base_url=base_url)
+    return int(data[0][0]) if data else None
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as file:
+                self.done = set(json.load(file)["done"])
+
+    def mark(self, page_start):
+        with self.lock:
+            self.done.add(page_start)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump({"done": sorted(self.done)}, file)
+            os.replace(tmp_path, self.path)
+
+
+def backfill_symbol(
+    symbol,
+    interval,
+    start_ms,
+    end_ms,
+    store,
+    executor,
+    base_url=market_data.BASE_URL,
+):
+    series_dir = store.series_dir(symbol, interval)
+    os.makedirs(series_dir, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(series_dir, "_checkpoint.json"))
+    # pages before the listing are empty for good, the ones after it only by accident
+    first = first_open_time(symbol, interval, start_ms, end_ms, base_url)
+    if first is None:
+        logging.warning("No %s %s candles between %s and %s.", symbol, interval, start_ms, end_ms)
+        return []
+    pages = [
+        page
+        for page in plan_pages(start_ms, end_ms, interval)
+        if page[1] >= first and page[0] not in checkpoint.done
+    ]
+    logging.info("Backfill %s %s: %s pages left.", symbol, interval, len(pages))
+
+    def run(page):
+        page_start, page_end = page
+        data = market_data.fetch_range(
+            symbol, interval, page_start, page_end, PAGE_SIZE, base_url=base_url
+        )
+        if data:
+            store.write_chunk(symbol, interval, page_start, schema.candles_from_klines(data))
+        else:
+            logging.warning("Empty page %s of %s %s, left for the next run.", page_start, symbol, interval)
+        # a page reaching into the still-forming candle is fetched again next run,
+        # an empty one too unless it is the end of the range (a delisted symbol)
+        closed = page_end < time.time() * 1000 - resampling.INTERVAL_MS[interval]
+        if closed and (data or page_end >= end_ms - 1):
+            checkpoint.mark(page_start)
+        return len(data)
+
+    return [executor.submit(run, page) for page in pages]
+
+
+def backfill(
+    symbols,
+    interval,
+    start_ms,
+    end_ms,
+    store=None,
+    workers=8,
+    weight_per_minute=1200,
+    base_url=market_data.BASE_URL,
+):
+    store = store or CandleStore()
+    # pages are market data: they only get the share of the budget orders do not need
+    governor.get_governor().limit_per_minute = weight_per_minute
+    candles = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for symbol in symbols:
+            # the listing lookup fails like a page, the other symbols still run
+            try:
+                futures += backfill_symbol(
+                    symbol, interval, start_ms, end_ms, store, executor, base_url
+                )
+            except Exception as e:
+                failed += 1
+                logging.error("Backfill of %s failed: %s", symbol, e)
+        for future in as_completed(futures):
+            try:
+                candles += future.result()
+            except Exception as e:
+                failed += 1
+                logging.error("Backfill page failed: %s", e)
+    logging.info("Backfilled %s candles, %s pages or symbols failed.", candles, failed)
+    if failed:
+        logging.warning("Run the same command again to resume from the checkpoint.")
+    return candles, failed
+
+
+def to_ms(day):
+    moment = datetime.datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill klines into the candle store.")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--interval", default=resampling.BASE_INTERVAL)
+    parser.add_argument("--start", required=True, help="YYYY-MM-DD (UTC)")
+    parser.add_argument("--end", default=None, help="YYYY-MM-DD (UTC), default now")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--weight-per-minute", type=int, default=1200)
+    parser.add_argument("--base-url", default=market_data.BASE_URL)
+    parser.add_argument("--store", default=STORE_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    end_ms = to_ms(args.end) if args.end else int(time.time() * 1000)
+    _, failed = backfill(
+        args.symbols,
+        args.interval,
+        to_ms(args.start),
+        end_ms,
+        store=CandleStore(args.store),
+        workers=args.workers,
+        weight_per_minute=args.weight_per_minute,
+        base_url=args.base_url,
+    )
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,70 @@
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import schema
+
+STORE_DIR = os.getenv("CANDLE_STORE_DIR", "candle_store")
+
+
+class CandleStore:
+    """
+    Columnar on-disk candle history: one directory per written chunk and one
+    .npy file per column inside it, so readers can memory-map single columns.
+
+        <root>/<symbol>/<interval>/<chunk start ms>/<column>.npy
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def series_dir(self, symbol, interval):
+        return os.path.join(self.root, symbol, interval)
+
+    def write_chunk(self, symbol, interval, start_ms, frame):
+        frame = schema.apply_candle_schema(frame)
+        series_dir = self.series_dir(symbol, interval)
+        os.makedirs(series_dir, exist_ok=True)
+        # build the chunk next to its final place and rename it in one step,
+        # an interrupted write never leaves a half written chunk behind
+        tmp_dir = os.path.join(series_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        for column in schema.CANDLE_COLUMNS:
+            np.save(os.path.join(tmp_dir, f"{column}.npy"), frame[column].values)
+        chunk_dir = os.path.join(series_dir, str(int(start_ms)))
+        if os.path.exists(chunk_dir):
+            shutil.rmtree(chunk_dir)
+        os.replace(tmp_dir, chunk_dir)
+        return chunk_dir
+
+    def chunks(self, symbol, interval):
+        series_dir = self.series_dir(symbol, interval)
+        if not os.path.isdir(series_dir):
+            return []
+        names = [name for name in os.listdir(series_dir) if name.isdigit()]
+        return [os.path.join(series_dir, name) for name in sorted(names, key=int)]
+
+    def load(self, symbol, interval, columns=None, start_ms=None, end_ms=None):
+        columns = columns or schema.CANDLE_COLUMNS
+        read = list(dict.fromkeys(["Open Time"] + list(columns)))
+        parts = {column: [] for column in read}
+        for chunk_dir in self.chunks(symbol, interval):
+            for column in read:
+                parts[column].append(
+                    np.load(os.path.join(chunk_dir, f"{column}.npy"), mmap_mode="r")
+                )
+        if not parts["Open Time"]:
+            return pd.DataFrame({column: [] for column in columns}).astype(
+                {c: schema.CANDLE_DTYPES[c] for c in columns}
+            )
+
+        frame = pd.DataFrame({column: np.concatenate(parts[column]) for column in read})
+        frame = frame.sort_values("Open Time").drop_duplicates("Open Time", keep="last")
+        if start_ms is not None:
+            frame = frame[frame["Open Time"] >= start_ms]
+        if end_ms is not None:
+            frame = frame[frame["Open Time"] <= end_ms]
+        return frame[list(columns)].reset_index(drop=True)
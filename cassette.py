@@ -0,0 +1,273 @@
+import argparse
+import collections
+import cProfile
+import importlib
+import json
+import pstats
+import struct
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+import requests
+
+import governor
+import market_data
+import testclient_and_orders
+
+MAGIC = b"CST1"
+# kind, recorded time, key length, body length
+FRAME_HEADER = struct.Struct("<BdHI")
+HTTP = 0
+CALL = 1
+ERROR = 2
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+class ReplayedAPIException(Exception):
+    """A Client call that raised while recording, raised again with the same code and message."""
+
+    def __init__(self, code, message):
+        super().__init__(f"APIError(code={code}): {message}")
+        self.code = code
+        self.message = message
+
+
+class ReplayedResponse:
+    """Just enough of requests.Response for the klines callers."""
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        # the same exception a live response raises, so callers take the same path
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"Recorded HTTP {self.status_code}.", response=self)
+
+
+def http_key(url, params):
+    # the klines limit depends on how late the call runs, the data asked for does not
+    params = sorted((k, v) for k, v in (params or {}).items() if k != "limit")
+    return f"{url}?{urlencode(params)}"
+
+
+def call_key(name, args, kwargs):
+    return name + json.dumps([args, kwargs], sort_keys=True, default=str)
+
+
+class Cassette:
+    """
+    Exchange traffic on disk: a zlib stream of length-prefixed frames, one
+    per klines response or Client call, each with the wall time it happened.
+
+    When replaying, frames are served per key in recorded order. With a
+    `speed` the replay waits so the recorded gaps pass `speed` times faster.
+    Without one it does not wait at all. `now` is the recorded time of the
+    last frame served, so candles close exactly as they did live.
+    """
+
+    def __init__(self, path, mode="replay", speed=None):
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.lock = threading.Lock()
+        if mode == "record":
+            self.file = open(path, "wb")
+            self.file.write(MAGIC)
+            self.compressor = zlib.compressobj(9)
+        elif mode == "replay":
+            self.frames = collections.defaultdict(collections.deque)
+            self.start = None
+            self.recorded_now = None
+            self._load()
+            self.replay_start = time.time()
+        else:
+            raise ValueError(f"Unknown cassette mode {mode!r}.")
+
+    def _load(self):
+        with open(self.path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a cassette.")
+            data = zlib.decompressobj().decompress(file.read())
+        offset = 0
+        while offset + FRAME_HEADER.size <= len(data):
+            kind, at, key_length, body_length = FRAME_HEADER.unpack_from(data, offset)
+            offset += FRAME_HEADER.size
+            key = data[offset : offset + key_length].decode()
+            offset += key_length
+            body = data[offset : offset + body_length]
+            offset += body_length
+            if len(body) < body_length:
+                # cut off mid frame by a crash while recording
+                break
+            self.frames[key].append((kind, at, body))
+            if self.start is None or at < self.start:
+                self.start = at
+        self.recorded_now = self.start
+
+    def write(self, kind, key, body):
+        key = key.encode()
+        frame = FRAME_HEADER.pack(kind, time.time(), len(key), len(body)) + key + body
+        with self.lock:
+            self.file.write(self.compressor.compress(frame))
+            # every frame is readable even if the run is killed later
+            self.file.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def read(self, key):
+        with self.lock:
+            frames = self.frames.get(key)
+            if not frames:
+                raise CassetteMiss(key)
+            kind, at, body = frames.popleft()
+        if self.speed:
+            wait = self.replay_start + (at - self.start) / self.speed - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        with self.lock:
+            self.recorded_now = max(self.recorded_now, at)
+        return kind, body
+
+    def now(self):
+        return self.recorded_now
+
+    def close(self):
+        if self.mode == "record":
+            with self.lock:
+                self.file.write(self.compressor.flush())
+                self.file.close()
+
+    # klines through the governor
+    def http_get(self, url, params=None, timeout=None):
+        key = http_key(url, params)
+        if self.mode == "record":
+            response = requests.get(url, params=params, timeout=timeout)
+            self.write(HTTP, key, struct.pack("<H", response.status_code) + response.content)
+            return response
+        _, body = self.read(key)
+        return ReplayedResponse(struct.unpack_from("<H", body)[0], body[2:])
+
+
+class RecordingClient:
+    """Passes every call to the real client and writes down what came back."""
+
+    def __init__(self, client, cassette):
+        self._client = client
+        self._cassette = cassette
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            key = call_key(name, args, kwargs)
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception as e:
+                error = {"code": getattr(e, "code", None), "message": str(getattr(e, "message", e))}
+                self._cassette.write(ERROR, key, json.dumps(error).encode())
+                raise
+            self._cassette.write(CALL, key, json.dumps(result).encode())
+            return result
+
+        return call
+
+
+class ReplayClient:
+    """Answers Client calls from the cassette, no network and no binance import."""
+
+    def __init__(self, cassette):
+        self._cassette = cassette
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            kind, body = self._cassette.read(call_key(name, args, kwargs))
+            result = json.loads(body)
+            if kind == ERROR:
+                raise ReplayedAPIException(result["code"], result["message"])
+            return result
+
+        return call
+
+
+_installed = None
+
+
+def install(path, mode="replay", speed=None):
+    """Record or replay all exchange traffic of this process through `path`."""
+    global _installed
+    uninstall()
+    cassette = Cassette(path, mode, speed)
+    weight_governor = governor.get_governor()
+    saved = (
+        weight_governor.http_get,
+        weight_governor.limit_per_minute,
+        market_data.clock,
+        testclient_and_orders._client,
+    )
+    weight_governor.http_get = cassette.http_get
+    if mode == "record":
+        testclient_and_orders._client = RecordingClient(testclient_and_orders.get_client(), cassette)
+    else:
+        # the exchange's limits were already respected while recording
+        weight_governor.limit_per_minute = float("inf")
+        market_data.clock = cassette.now
+        testclient_and_orders._client = ReplayClient(cassette)
+    _installed = cassette, saved
+    return cassette
+
+
+def uninstall():
+    global _installed
+    if _installed is None:
+        return
+    cassette, saved = _installed
+    weight_governor = governor.get_governor()
+    (
+        weight_governor.http_get,
+        weight_governor.limit_per_minute,
+        market_data.clock,
+        testclient_and_orders._client,
+    ) = saved
+    cassette.close()
+    _installed = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record scheduled_fetch runs or replay them offline.")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("path")
+    parser.add_argument("--interval", default="5m")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--every", type=float, default=300, help="seconds between recorded runs")
+    parser.add_argument("--speed", type=float, default=None, help="replay speed-up, as fast as possible if omitted")
+    parser.add_argument("--profile", action="store_true")
+    args = parser.parse_args()
+
+    chart = importlib.import_module("4hchart")
+    install(args.path, args.mode, args.speed)
+    profiler = cProfile.Profile() if args.profile else None
+    started = time.perf_counter()
+    try:
+        for run in range(args.runs):
+            if profiler:
+                profiler.enable()
+            chart.scheduled_fetch(args.interval)
+            if profiler:
+                profiler.disable()
+            if args.mode == "record" and run < args.runs - 1:
+                time.sleep(args.every)
+    finally:
+        uninstall()
+    print(f"{args.runs} {args.interval} runs {args.mode}ed in {time.perf_counter() - started:.2f}s")
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
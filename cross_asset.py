@@ -0,0 +1,197 @@
+import numpy as np
+
+MARKET = "BTCUSDT"
+# the last day of 5m candles
+WINDOW = 288
+# same-side signals more correlated than this with one already taken are dropped
+MAX_SIGNAL_CORRELATION = 0.9
+# candles a symbol may trail the newest one before the others stop waiting for it
+MAX_LAG = 1
+
+
+class RollingComoments:
+    """
+    Rolling correlation and beta between every pair of symbols over the last
+    `window` returns.
+
+    Only running sums are kept, pairwise over the candles both symbols have:
+    count, sum x, sum x^2 and sum x*y as S x S matrices. A closing candle adds
+    one rank-one update and the candle leaving the window subtracts one, so
+    a candle costs O(S^2) whatever the window length. The sums are rebuilt
+    from the stored returns once per window to stop rounding drift.
+    """
+
+    def __init__(self, symbols=(), window=WINDOW, max_lag=MAX_LAG):
+        self.window = window
+        self.max_lag = max_lag
+        self.symbols = []
+        self.index = {}
+        self.returns = np.zeros((window, 0))
+        self.masks = np.zeros((window, 0))
+        self.slot = 0
+        self.size = 0
+        self.updates = 0
+        self.last_time = None
+        self.last_close = np.zeros(0)
+        self._rebuild()
+        self.add_symbols(symbols)
+
+    def add_symbols(self, symbols):
+        new = [symbol for symbol in symbols if symbol not in self.index]
+        if not new:
+            return
+        for symbol in new:
+            self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        extra = len(new)
+        self.returns = np.pad(self.returns, ((0, 0), (0, extra)))
+        self.masks = np.pad(self.masks, ((0, 0), (0, extra)))
+        self.last_close = np.concatenate([self.last_close, np.full(extra, np.nan)])
+        self._rebuild()
+
+    def _rebuild(self):
+        x, m = self.returns[: self.size], self.masks[: self.size]
+        self.count = m.T @ m
+        self.sum = (x * m).T @ m
+        self.sum_sq = (x * x * m).T @ m
+        self.sum_xy = x.T @ x
+
+    def _add(self, x, m, sign):
+        xm = x * m
+        self.count += sign * np.outer(m, m)
+        self.sum += sign * np.outer(xm, m)
+        self.sum_sq += sign * np.outer(xm * x, m)
+        self.sum_xy += sign * np.outer(xm, xm)
+
+    def update(self, time, closes):
+        """Add the candle closing at `time`, `closes` in symbol order with NaN for missing ones."""
+        closes = np.asarray(closes, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = np.log(closes / self.last_close)
+        valid = np.isfinite(returns)
+        x = np.where(valid, returns, 0.0)
+        m = valid.astype(float)
+        if self.size == self.window:
+            self._add(self.returns[self.slot], self.masks[self.slot], -1)
+        self.returns[self.slot] = x
+        self.masks[self.slot] = m
+        self._add(x, m, 1)
+        self.slot = (self.slot + 1) % self.window
+        self.size = min(self.size + 1, self.window)
+        # a missing candle costs the return on both sides of it, never a two-candle return
+        self.last_close = closes
+        self.last_time = time
+        self.updates += 1
+        if self.updates % self.window == 0:
+            self._rebuild()
+
+    def push_buffers(self, buffers):
+        """
+        Feed every candle that closed since the last call from the ring
+        buffers of the symbols (the last record is still forming).
+        """
+        return self.push_windows(
+            {
+                symbol: buffer.window()
+                for symbol, buffer in buffers.items()
+                if buffer is not None and len(buffer) >= 2
+            }
+        )
+
+    def push_windows(self, windows):
+        """
+        Feed every candle that closed since the last call from record arrays
+        shaped like ring buffer windows, such as feature store snapshots.
+
+        Candles are added in time order and cannot be added later, so a symbol
+        up to `max_lag` candles behind the newest one (another worker has not
+        published it yet) holds the newer candles back until it catches up.
+        A symbol further behind is left out of them.
+        """
+        self.add_symbols(windows)
+        closed = {symbol: rows[:-1] for symbol, rows in windows.items() if len(rows) >= 2}
+        if not closed:
+            return 0
+        lasts = [rows["Open Time"][-1] for rows in closed.values()]
+        seen = np.unique(np.concatenate([rows["Open Time"] for rows in closed.values()]))
+        oldest_waited = seen[-min(self.max_lag + 1, len(seen))]
+        upto = min(last for last in lasts if last >= oldest_waited)
+        for symbol, rows in closed.items():
+            times = rows["Open Time"]
+            if self.last_time is None:
+                rows = rows[times <= upto][-(self.window + 1) :]
+            else:
+                rows = rows[(times > self.last_time) & (times <= upto)]
+            closed[symbol] = rows
+        times = np.unique(np.concatenate([rows["Open Time"] for rows in closed.values()]))
+        if len(times) == 0:
+            return 0
+        closes = np.full((len(times), len(self.symbols)), np.nan)
+        for symbol, rows in closed.items():
+            closes[np.searchsorted(times, rows["Open Time"]), self.index[symbol]] = rows["Close"]
+        for time, row in zip(times, closes):
+            self.update(time, row)
+        return len(times)
+
+    def _moments(self):
+        n = self.count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covariance = n * self.sum_xy - self.sum * self.sum.T
+            variance = n * self.sum_sq - self.sum**2
+        return covariance, variance
+
+    def correlation(self):
+        """S x S correlation matrix, NaN where a pair has fewer than 3 common returns."""
+        covariance, variance = self._moments()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = covariance / np.sqrt(variance * variance.T)
+        correlation[self.count < 3] = np.nan
+        return np.clip(correlation, -1, 1)
+
+    def beta(self):
+        """beta[i, j]: slope of symbol i's returns on symbol j's."""
+        covariance, variance = self._moments()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            beta = covariance / variance.T
+        beta[self.count < 3] = np.nan
+        return beta
+
+    def correlation_of(self, symbol, other):
+        i, j = self.index.get(symbol), self.index.get(other)
+        if i is None or j is None:
+            return np.nan
+        return self.correlation()[i, j]
+
+    def market_beta(self, market=MARKET):
+        """{symbol: beta to `market`}, empty while the market is not tracked."""
+        if market not in self.index:
+            return {}
+        column = self.beta()[:, self.index[market]]
+        return dict(zip(self.symbols, column))
+
+    def market_correlation(self, market=MARKET):
+        if market not in self.index:
+            return {}
+        column = self.correlation()[:, self.index[market]]
+        return dict(zip(self.symbols, column))
+
+
+def drop_correlated(actions, comoments, max_correlation=MAX_SIGNAL_CORRELATION):
+    """
+    Keep the first of any group of same-side actions whose symbols move
+    together, so one market move does not open the same risk several times.
+    """
+    correlation = comoments.correlation()
+    kept = []
+    for symbol, side, reason in actions:
+        i = comoments.index.get(symbol)
+        duplicate = any(
+            kept_side == side
+            and i is not None
+            and kept_symbol in comoments.index
+            and correlation[i, comoments.index[kept_symbol]] > max_correlation
+            for kept_symbol, kept_side, _ in kept
+        )
+        if not duplicate:
+            kept.append((symbol, side, reason))
+    return kept
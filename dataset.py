@@ -0,0 +1,232 @@
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from candle_store import STORE_DIR, CandleStore
+from sweep import SymbolCache
+
+DATASET_DIR = os.getenv("DATASET_DIR", "datasets")
+# price-like features are taken relative to the close so windows of different symbols compare
+FEATURES = [
+    "return",
+    "rsi",
+    "atr",
+    "mean_atr",
+    "ma_22",
+    "ma_50",
+    "volume",
+    "consolidation",
+    "bullish_divergence",
+    "bearish_divergence",
+    "bull_flag",
+    "bear_flag",
+]
+# candles dropped at the start of every history, until MA_50 is defined
+WARMUP = 50
+# the live rules' divergence and consolidation parameters
+DIVERGENCE_ORDER = 9
+DIVERGENCE_WINDOWS = (15, 30)
+STD_DEV_THRESHOLD = 0.003
+
+
+def history_features(symbol, frame):
+    """
+    (candles, FEATURES) float32 matrix of everything the live loop can see
+    at each candle's close, nothing from later candles.
+    """
+    cache = SymbolCache(symbol, frame)
+    close = pd.Series(cache.close)
+    atr = pd.Series(cache.atr)
+    volume = frame["Volume"].to_numpy(np.float64)
+    bullish, bearish = cache.divergence(DIVERGENCE_ORDER, DIVERGENCE_WINDOWS)
+    bull_flag, bear_flag = cache.flags(STD_DEV_THRESHOLD)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns = {
+            "return": np.log(close / close.shift(1)),
+            "rsi": cache.rsi / 100,
+            "atr": atr / close,
+            "mean_atr": atr.rolling(12).mean() / close,
+            "ma_22": close.rolling(22).mean() / close - 1,
+            "ma_50": close.rolling(50).mean() / close - 1,
+            "volume": volume / pd.Series(volume).rolling(50).mean(),
+            "consolidation": np.minimum(cache.consolidation_ratio(), 1.0),
+            "bullish_divergence": bullish,
+            "bearish_divergence": bearish,
+            "bull_flag": bull_flag,
+            "bear_flag": bear_flag,
+        }
+    matrix = np.empty((len(close), len(FEATURES)), dtype=np.float32)
+    for i, name in enumerate(FEATURES):
+        matrix[:, i] = np.asarray(columns[name], dtype=np.float64)
+    return matrix
+
+
+def series_dir(symbol, interval, root=DATASET_DIR):
+    return os.path.join(root, f"{symbol}_{interval}")
+
+
+def build(symbol, interval, store_dir=STORE_DIR, root=DATASET_DIR):
+    """
+    Compute the feature matrix of a symbol's whole stored history once and
+    save it next to its closes and open times, as .npy files a dataset
+    memory-maps. Returns the number of candles written.
+    """
+    frame = CandleStore(store_dir).load(
+        symbol, interval, columns=["Open Time", "High", "Low", "Close", "Volume"]
+    )
+    if len(frame) <= WARMUP:
+        logging.info("Not enough history for %s %s, skipped.", symbol, interval)
+        return 0
+    features = history_features(symbol, frame)[WARMUP:]
+    path = series_dir(symbol, interval, root)
+    os.makedirs(path, exist_ok=True)
+    arrays = {
+        "features": features,
+        "close": frame["Close"].to_numpy(np.float64)[WARMUP:],
+        "time": frame["Open Time"].to_numpy(np.int64)[WARMUP:],
+    }
+    for name, values in arrays.items():
+        tmp_path = os.path.join(path, f"{name}.tmp.npy")
+        np.save(tmp_path, values)
+        os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+    return len(features)
+
+
+def walk_forward(n_samples, train_size, test_size, step=None, gap=0, expanding=False):
+    """
+    (train, test) ranges of sample indices moving forward in time by `step`
+    (`test_size` by default). `gap` samples between them are left out, so
+    no training label looks into the test period. With `expanding` every
+    train range starts at 0.
+    """
+    step = step or test_size
+    splits = []
+    start = 0
+    while start + train_size + gap + test_size <= n_samples:
+        train_end = start + train_size
+        test_start = train_end + gap
+        splits.append(
+            (range(0 if expanding else start, train_end), range(test_start, test_start + test_size))
+        )
+        start += step
+    return splits
+
+
+class WindowDataset:
+    """
+    Samples of `window` consecutive feature rows labelled with the log return
+    from the last row's close to the close `horizon` candles later.
+
+    The samples are strided views over the (memory-mapped) feature matrix:
+    sample i is rows i .. i + window - 1, nothing is copied until a batch is
+    gathered out of order, so histories larger than memory stream from disk.
+    """
+
+    def __init__(self, features, close, window, horizon, times=None):
+        if horizon < 1:
+            raise ValueError("The label horizon must be at least one candle.")
+        if len(features) < window + horizon:
+            raise ValueError(f"{len(features)} candles are too few for {window} + {horizon}.")
+        self.features = features
+        self.window = window
+        self.horizon = horizon
+        self.times = times
+        # (samples, window, features), a view
+        self.windows = np.lib.stride_tricks.sliding_window_view(features, window, axis=0).swapaxes(1, 2)
+        close = np.asarray(close)
+        end = close[window - 1 :]
+        self.labels = np.log(end[horizon:] / end[:-horizon]).astype(np.float32)
+
+    @classmethod
+    def load(cls, symbol, interval, window, horizon, root=DATASET_DIR):
+        path = series_dir(symbol, interval, root)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ("features", "close", "time")
+        }
+        return cls(arrays["features"], arrays["close"], window, horizon, arrays["time"])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        return self.windows[i], self.labels[i]
+
+    def end_times(self, indices):
+        """Open time of the last candle of each sample."""
+        return np.asarray(self.times)[np.asarray(indices) + self.window - 1]
+
+    def splits(self, train_size, test_size, step=None, expanding=False):
+        return walk_forward(len(self), train_size, test_size, step, gap=self.horizon, expanding=expanding)
+
+    def batches(self, batch_size, indices=None, shuffle=False, seed=None):
+        """
+        (X, y) batches over `indices` (a range or an index array, all samples
+        by default). In order over a range, X is a view; shuffled batches are
+        gathered, one batch in memory at a time.
+        """
+        indices = range(len(self)) if indices is None else indices
+        if not shuffle and isinstance(indices, range) and indices.step == 1:
+            for start in range(indices.start, indices.stop, batch_size):
+                stop = min(start + batch_size, indices.stop)
+                yield self.windows[start:stop], self.labels[start:stop]
+            return
+        order = np.asarray(indices)
+        if shuffle:
+            order = np.random.default_rng(seed).permutation(order)
+        for start in range(0, len(order), batch_size):
+            batch = order[start : start + batch_size]
+            # sorted reads are sequential on a memory map
+            batch = np.sort(batch) if shuffle else batch
+            yield self.windows[batch], self.labels[batch]
+
+
+def load_datasets(symbols, interval, window, horizon, root=DATASET_DIR):
+    """{symbol: WindowDataset} for the symbols that have a built history."""
+    datasets = {}
+    for symbol in symbols:
+        try:
+            datasets[symbol] = WindowDataset.load(symbol, interval, window, horizon, root)
+        except (FileNotFoundError, ValueError) as e:
+            logging.info("No dataset for %s %s: %s", symbol, interval, e)
+    return datasets
+
+
+def stream(datasets, batch_size, fold=None, part="train", **split_args):
+    """
+    Batches over every symbol in turn. With `fold`, only that walk-forward
+    fold's `part` ("train" or "test") of each symbol, split on its own
+    timeline by `split_args` (train_size, test_size, step, expanding).
+    """
+    for symbol, dataset in datasets.items():
+        indices = None
+        if fold is not None:
+            splits = dataset.splits(**split_args)
+            if fold >= len(splits):
+                continue
+            indices = splits[fold][0 if part == "train" else 1]
+        for features, labels in dataset.batches(batch_size, indices):
+            yield symbol, features, labels
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build windowed training data from the candle store.")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--interval", default="1h")
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--root", default=DATASET_DIR)
+    parser.add_argument("--window", type=int, default=64)
+    parser.add_argument("--horizon", type=int, default=12)
+    parser.add_argument("--train", type=int, default=5000)
+    parser.add_argument("--test", type=int, default=1000)
+    args = parser.parse_args()
+
+    for symbol in args.symbols:
+        build(symbol, args.interval, args.store, args.root)
+    datasets = load_datasets(args.symbols, args.interval, args.window, args.horizon, args.root)
+    for symbol, dataset in datasets.items():
+        folds = dataset.splits(args.train, args.test)
+        print(f"{symbol}: {len(dataset)} samples of {dataset.windows.shape[1:]}, {len(folds)} walk-forward folds")
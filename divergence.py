@@ -0,0 +1,119 @@
+from collections import deque
+
+import extrema
+
+
+def divergence_at(closes, rsis, i, window_sizes, kind):
+    """Batch rule of detect_divergences for one extremum at position i."""
+    for window_size in window_sizes:
+        start = max(i - window_size, 0)
+        price_slope = extrema.slope(closes[start : i + 1])
+        rsi_slope = extrema.slope(rsis[start : i + 1])
+        if kind == "bearish" and price_slope > 0 and rsi_slope < 0:
+            return True
+        if kind == "bullish" and price_slope < 0 and rsi_slope > 0:
+            return True
+    return False
+
+
+def classify(closes, rsis, i, order, window_sizes):
+    if extrema.is_maximum(closes, i, order):
+        return "high", divergence_at(closes, rsis, i, window_sizes, "bearish")
+    if extrema.is_minimum(closes, i, order):
+        return "low", divergence_at(closes, rsis, i, window_sizes, "bullish")
+    return None, False
+
+
+class DivergenceDetector:
+    """
+    Streaming version of feature_pattern_creation.detect_divergences for one
+    symbol/interval.
+
+    Closed candles are fed one at a time. A candle becomes a confirmed swing
+    point once `order` candles closed after it, and only then are its slopes
+    evaluated, so each update costs the same no matter how long the history is.
+    Swing points that are still inside the last `order` candles are pending
+    and re-evaluated on demand from the tail.
+    """
+
+    def __init__(self, order=9, window_sizes=(15, 30), max_events=1000):
+        self.order = order
+        self.window_sizes = list(window_sizes)
+        self.span = max(self.window_sizes) + order + 1
+        self.times = deque(maxlen=self.span)
+        self.closes = deque(maxlen=self.span)
+        self.rsis = deque(maxlen=self.span)
+        self.count = 0
+        self.last_time = None
+        # confirmed swing points and the divergences found on them
+        self.swings = deque(maxlen=max_events)
+        self.events = deque(maxlen=max_events)
+
+    def update(self, time, close, rsi):
+        """Add one closed candle, return the divergence events it confirms."""
+        self.times.append(time)
+        self.closes.append(float(close))
+        self.rsis.append(float(rsi))
+        self.count += 1
+        self.last_time = time
+
+        position = len(self.closes) - 1 - self.order
+        if position < 1:
+            return []
+        closes = list(self.closes)
+        kind, divergence = classify(
+            closes, list(self.rsis), position, self.order, self.window_sizes
+        )
+        if kind is None:
+            return []
+
+        swing_time = self.times[position]
+        self.swings.append((swing_time, kind, closes[position]))
+        if not divergence:
+            return []
+        event = (swing_time, "bearish" if kind == "high" else "bullish")
+        self.events.append(event)
+        return [event]
+
+    def pending(self, closes, rsis):
+        """
+        Swing points among the last candles of `closes` that may still change,
+        as (position, kind, divergence) tuples.
+        """
+        n = len(closes)
+        found = []
+        for i in range(max(1, n - 1 - self.order), n - 1):
+            kind, divergence = classify(closes, rsis, i, self.order, self.window_sizes)
+            if kind is not None:
+                found.append((i, kind, divergence))
+        return found
+
+    def apply(self, data):
+        """
+        Feed the closed candles of `data` not seen yet and write the
+        bullish/bearish_divergence columns the batch function would produce.
+        The last row is treated as the still-forming candle.
+        """
+        closed = data.iloc[:-1]
+        if self.last_time is not None:
+            closed = closed[closed["Open Time"] > self.last_time]
+        for time, close, rsi in zip(closed["Open Time"], closed["Close"], closed["RSI"]):
+            self.update(time, close, rsi)
+
+        data["bullish_divergence"] = 0
+        data["bearish_divergence"] = 0
+        bullish = [time for time, kind in self.events if kind == "bullish"]
+        bearish = [time for time, kind in self.events if kind == "bearish"]
+        data.loc[data["Open Time"].isin(bullish), "bullish_divergence"] = 1
+        data.loc[data["Open Time"].isin(bearish), "bearish_divergence"] = 1
+
+        tail_length = min(len(data), self.span + self.order)
+        tail = data.iloc[-tail_length:]
+        offset = len(data) - tail_length
+        for i, kind, divergence in self.pending(
+            tail["Close"].tolist(), tail["RSI"].tolist()
+        ):
+            if divergence:
+                column = "bearish_divergence" if kind == "high" else "bullish_divergence"
+                data.iloc[offset + i, data.columns.get_loc(column)] = 1
+        return data
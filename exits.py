@@ -0,0 +1,247 @@
+import collections
+
+import numpy as np
+
+STOP_ATR = 1.8
+# ATR-multiple targets buy/sell used for 5m, the fallback when no strong level is in reach
+TARGET_ATR = {1: 2.0, -1: 1.5}
+# a strong level closer than this many ATRs is not worth a target
+MIN_TARGET_ATR = 1.0
+# positions still open after this many candles are closed at market
+TIME_STOP_BARS = 48
+# latest_fetch_exit_calculations.py: a level visited by 95 of the candles
+STRONG_LEVEL_TOUCHES = 95
+# level bins as a share of the price, 100 USD on BTC at 100k
+LEVEL_BIN = 0.001
+
+POSITION_DTYPE = np.dtype(
+    [
+        ("id", "i8"),
+        ("symbol", "i4"),
+        ("side", "i1"),
+        ("quantity", "f8"),
+        ("entry", "f8"),
+        ("extreme", "f8"),
+        ("stop", "f8"),
+        ("target", "f8"),
+        ("sent_stop", "f8"),
+        ("sent_target", "f8"),
+        ("tick", "f8"),
+        ("bars", "i4"),
+    ]
+)
+
+# kind: "place" for a new position, "replace" when its levels moved, "close" at the time stop
+ExitOrder = collections.namedtuple(
+    "ExitOrder", ["position", "symbol", "side", "kind", "quantity", "stop", "target"]
+)
+
+
+def strong_levels(high, low, bin_size, min_touches=STRONG_LEVEL_TOUCHES):
+    """Centers of the price bins that at least `min_touches` candle ranges cover."""
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    if len(high) == 0:
+        return np.array([])
+    origin = np.floor(low.min() / bin_size)
+    first = (np.floor(low / bin_size) - origin).astype(int)
+    last = (np.floor(high / bin_size) - origin).astype(int)
+    # +1 where a range starts, -1 after it ends, the running sum counts the ranges per bin
+    changes = np.zeros(last.max() + 2, dtype=int)
+    np.add.at(changes, first, 1)
+    np.add.at(changes, last + 1, -1)
+    touches = np.cumsum(changes)[:-1]
+    return (np.flatnonzero(touches >= min_touches) + origin + 0.5) * bin_size
+
+
+def level_grid(levels):
+    """Per-symbol level arrays (or None) as one NaN-padded 2-D array."""
+    width = max((len(level) for level in levels if level is not None), default=0)
+    grid = np.full((len(levels), width), np.nan)
+    for row, level in enumerate(levels):
+        if level is not None:
+            grid[row, : len(level)] = level
+    return grid
+
+
+def round_to_tick(price, tick, side):
+    """Stops are rounded away from the market, targets toward it: never tighter than computed."""
+    ticks = np.where(side > 0, np.floor(price / tick), np.ceil(price / tick))
+    # ticks are at least 1e-8, rounding drops the float error of the product
+    return np.round(ticks * tick, 10)
+
+
+class ExitEngine:
+    """
+    Every open position as one row of a record array. `update` moves all of
+    them forward by one candle at once: the ATR-trailing stop ratchets behind
+    the best price since entry, the target snaps to the nearest strong level
+    beyond the price, the time stop counts candles. Only positions whose
+    levels moved by at least one tick produce an order.
+    """
+
+    def __init__(self, stop_atr=STOP_ATR, time_stop_bars=TIME_STOP_BARS):
+        self.stop_atr = stop_atr
+        self.time_stop_bars = time_stop_bars
+        self.positions = np.zeros(0, dtype=POSITION_DTYPE)
+        self.symbols = []
+        self.index = {}
+        self.last_times = {}
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _symbol(self, symbol):
+        if symbol not in self.index:
+            self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.index[symbol]
+
+    def _new_position(self, side, entry, atr, quantity, tick, levels):
+        side = 1 if side in (1, "long") else -1
+        position = np.zeros(1, dtype=POSITION_DTYPE)
+        position["side"] = side
+        position["quantity"] = quantity
+        position["entry"] = position["extreme"] = entry
+        position["tick"] = tick
+        position["stop"] = entry - side * self.stop_atr * atr
+        position["target"] = self._targets(
+            position,
+            np.array([entry]),
+            np.array([atr]),
+            level_grid([levels]),
+            entry + side * TARGET_ATR[side] * atr,
+        )
+        position["sent_stop"] = round_to_tick(position["stop"], tick, side)
+        position["sent_target"] = round_to_tick(position["target"], tick, side)
+        return position
+
+    def preview(self, symbol, side, entry, atr, quantity, tick, levels=None):
+        """The first exit order `open` would return, without tracking the position."""
+        p = self._new_position(side, entry, atr, quantity, tick, levels)[0]
+        return ExitOrder(
+            0,
+            symbol,
+            "long" if p["side"] > 0 else "short",
+            "place",
+            float(p["quantity"]),
+            float(p["sent_stop"]),
+            float(p["sent_target"]),
+        )
+
+    def open(self, symbol, side, entry, atr, quantity, tick, levels=None, time=None):
+        """
+        Track a new position (side 1 long, -1 short), returns its first exit
+        order. `time` is the last candle closed before the entry, so `update`
+        never moves the position by it.
+        """
+        if time is not None:
+            self.last_times[symbol] = max(time, self.last_times.get(symbol, time))
+        position = self._new_position(side, entry, atr, quantity, tick, levels)
+        position["id"] = self.next_id
+        position["symbol"] = self._symbol(symbol)
+        self.next_id += 1
+        self.positions = np.concatenate([self.positions, position])
+        return self._orders(position, "place")[0]
+
+    def close(self, position_id):
+        self.positions = self.positions[self.positions["id"] != position_id]
+
+    def update(self, candles):
+        """
+        Advance every position by the candle that just closed. `candles`
+        maps symbol -> dict(high=, low=, close=, atr=, levels=, time=); a
+        candle with a `time` already seen for its symbol is skipped. Positions
+        whose stop or target the candle touched are dropped as filled.
+        Returns the exit orders to send.
+        """
+        positions = self.positions
+        if len(positions) == 0:
+            return []
+        columns = {name: np.full(len(self.symbols), np.nan) for name in ("high", "low", "close", "atr")}
+        levels = [None] * len(self.symbols)
+        for symbol, candle in candles.items():
+            time = candle.get("time")
+            if time is not None:
+                if time <= self.last_times.get(symbol, time - 1):
+                    continue
+                self.last_times[symbol] = time
+            if symbol in self.index:
+                i = self.index[symbol]
+                for name in columns:
+                    columns[name][i] = candle[name]
+                levels[i] = candle.get("levels")
+        grid = level_grid(levels)
+        rows = positions["symbol"]
+        seen = ~np.isnan(columns["close"][rows])
+        side = positions["side"]
+        high, low = columns["high"][rows], columns["low"][rows]
+        close, atr = columns["close"][rows], columns["atr"][rows]
+
+        # filled on the exchange by this candle
+        stopped = seen & np.where(side > 0, low <= positions["stop"], high >= positions["stop"])
+        taken = seen & np.where(side > 0, high >= positions["target"], low <= positions["target"])
+        filled = stopped | taken
+
+        positions["bars"] += seen
+        extreme = np.where(side > 0, np.fmax(positions["extreme"], high), np.fmin(positions["extreme"], low))
+        positions["extreme"] = np.where(seen, extreme, positions["extreme"])
+        trailing = positions["extreme"] - side * self.stop_atr * atr
+        # a stop only ever moves in the position's favour
+        stop = np.where(side > 0, np.fmax(positions["stop"], trailing), np.fmin(positions["stop"], trailing))
+        positions["stop"] = np.where(seen, stop, positions["stop"])
+        # without a strong level in reach the target stays where it was
+        targets = self._targets(positions, close, atr, grid[rows], positions["target"])
+        positions["target"] = np.where(seen, targets, positions["target"])
+
+        expired = seen & ~filled & (positions["bars"] >= self.time_stop_bars)
+        new_stop = round_to_tick(positions["stop"], positions["tick"], side)
+        new_target = round_to_tick(positions["target"], positions["tick"], side)
+        half_tick = positions["tick"] / 2
+        moved = (
+            seen
+            & ~filled
+            & ~expired
+            & (
+                (np.abs(new_stop - positions["sent_stop"]) > half_tick)
+                | (np.abs(new_target - positions["sent_target"]) > half_tick)
+            )
+        )
+        positions["sent_stop"] = np.where(moved, new_stop, positions["sent_stop"])
+        positions["sent_target"] = np.where(moved, new_target, positions["sent_target"])
+
+        orders = self._orders(positions[moved], "replace") + self._orders(positions[expired], "close")
+        self.positions = positions[~(filled | expired)]
+        return orders
+
+    def _targets(self, positions, close, atr, grid, fallback):
+        """
+        Nearest strong level at least MIN_TARGET_ATR beyond the close,
+        `fallback` where there is none. `grid` holds each position's levels,
+        NaN padded.
+        """
+        if grid.shape[1] == 0:
+            return fallback
+        side = positions["side"].astype(float)
+        # distance past the minimum, in the position's direction
+        distance = (grid - close[:, None]) * side[:, None] - MIN_TARGET_ATR * atr[:, None]
+        distance[~(distance >= 0)] = np.inf
+        nearest = distance.argmin(axis=1)
+        rows = np.arange(len(positions))
+        found = np.isfinite(distance[rows, nearest])
+        return np.where(found, grid[rows, nearest], fallback)
+
+    def _orders(self, positions, kind):
+        return [
+            ExitOrder(
+                int(p["id"]),
+                self.symbols[p["symbol"]],
+                "long" if p["side"] > 0 else "short",
+                kind,
+                float(p["quantity"]),
+                float(p["sent_stop"]),
+                float(p["sent_target"]),
+            )
+            for p in positions
+        ]
@@ -0,0 +1,44 @@
+import operator
+
+# Point-wise versions of argrelextrema(..., order=order) with its default
+# mode="clip": the first and last candle never qualify and the neighbourhood
+# is cut at the ends of the series.
+
+
+def is_extremum(values, i, order, comparator):
+    n = len(values)
+    if i <= 0 or i >= n - 1:
+        return False
+    value = values[i]
+    for j in range(max(0, i - order), min(n - 1, i + order) + 1):
+        if j != i and not comparator(value, values[j]):
+            return False
+    return True
+
+
+def is_maximum(values, i, order):
+    return is_extremum(values, i, order, operator.gt)
+
+
+def is_minimum(values, i, order):
+    return is_extremum(values, i, order, operator.lt)
+
+
+def is_confirmed(i, n, order):
+    """An extremum at i cannot change any more once all `order` right neighbours exist."""
+    return i + order <= n - 1
+
+
+def slope(values):
+    """Least squares slope against 0..n-1, what LinearRegression().fit(...).coef_ gives."""
+    n = len(values)
+    if n < 2:
+        return 0
+    x_mean = (n - 1) / 2
+    y_mean = sum(values) / n
+    numerator = 0.0
+    denominator = 0.0
+    for x, y in enumerate(values):
+        numerator += (x - x_mean) * (y - y_mean)
+        denominator += (x - x_mean) ** 2
+    return numerator / denominator
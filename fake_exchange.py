@@ -0,0 +1,289 @@
+import http.server
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+
+
+class FakeAPIException(Exception):
+    """Shaped like binance.exceptions.BinanceAPIException: a `code` and a `message`."""
+
+    def __init__(self, code, message):
+        super().__init__(f"APIError(code={code}): {message}")
+        self.code = code
+        self.message = message
+
+
+class FakeExchange:
+    """
+    In-memory stand-in for the order calls of a python-binance Client, spot
+    and cross margin kept apart like on the exchange. Every call sleeps
+    `latency` seconds and is logged in `calls`, so code that takes a client
+    can be checked for what it sends and how long it takes.
+    """
+
+    def __init__(self, latency=0.0, bulk=True):
+        self.latency = latency
+        self.bulk = bulk
+        self.books = {"spot": {}, "margin": {}}
+        self.lists = {"spot": {}, "margin": {}}
+        self.calls = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def _call(self, name, **params):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls.append((name, params))
+
+    def _order(self, account, symbol, side, type, quantity, price=None, stopPrice=None, list_id=-1):
+        order = {
+            "symbol": symbol,
+            "orderId": next(self.ids),
+            "orderListId": list_id,
+            "side": side,
+            "type": type,
+            "origQty": str(quantity),
+            "price": str(price or 0),
+            "stopPrice": str(stopPrice or 0),
+            "status": "FILLED" if type == "MARKET" else "NEW",
+        }
+        if type != "MARKET":
+            self.books[account][order["orderId"]] = order
+        return order
+
+    def _oco(self, account, symbol, side, quantity, price, stopPrice, **params):
+        list_id = next(self.ids)
+        legs = [
+            self._order(account, symbol, side, "STOP_LOSS_LIMIT", quantity, price, stopPrice, list_id),
+            self._order(account, symbol, side, "LIMIT_MAKER", quantity, price, None, list_id),
+        ]
+        order_list = {
+            "orderListId": list_id,
+            "contingencyType": "OCO",
+            "listOrderStatus": "EXECUTING",
+            "symbol": symbol,
+            "orders": [{"symbol": symbol, "orderId": leg["orderId"]} for leg in legs],
+        }
+        self.lists[account][list_id] = order_list
+        return dict(order_list, orderReports=[dict(leg) for leg in legs])
+
+    def _cancel(self, account, symbol, orderId):
+        with self.lock:
+            order = self.books[account].get(orderId)
+            if order is None or order["symbol"] != symbol:
+                raise FakeAPIException(-2011, "Unknown order sent.")
+            cancelled = []
+            list_id = order["orderListId"]
+            if list_id != -1:
+                for leg in self.lists[account].pop(list_id)["orders"]:
+                    cancelled.append(self.books[account].pop(leg["orderId"]))
+            else:
+                cancelled.append(self.books[account].pop(orderId))
+        return [dict(order, status="CANCELED") for order in cancelled]
+
+    def _cancel_all(self, account, symbol):
+        if not self.bulk:
+            raise FakeAPIException(-1000, "Cancel all is not supported.")
+        with self.lock:
+            ids = [k for k, v in self.books[account].items() if v["symbol"] == symbol]
+            if not ids:
+                raise FakeAPIException(-2011, "Unknown order sent.")
+            for list_id in [k for k, v in self.lists[account].items() if v["symbol"] == symbol]:
+                del self.lists[account][list_id]
+            return [dict(self.books[account].pop(i), status="CANCELED") for i in ids]
+
+    def _open(self, account, symbol=None):
+        with self.lock:
+            return [dict(o) for o in self.books[account].values() if symbol in (None, o["symbol"])]
+
+    # spot
+    def create_order(self, symbol, side, type, quantity, price=None, stopPrice=None, **params):
+        self._call("create_order", symbol=symbol, side=side, type=type)
+        return self._order("spot", symbol, side, type, quantity, price, stopPrice)
+
+    def create_oco_order(self, symbol, side, quantity, price, stopPrice, **params):
+        self._call("create_oco_order", symbol=symbol, side=side)
+        return self._oco("spot", symbol, side, quantity, price, stopPrice)
+
+    def get_open_orders(self, symbol=None, **params):
+        self._call("get_open_orders", symbol=symbol)
+        return self._open("spot", symbol)
+
+    def get_open_oco_orders(self, **params):
+        self._call("get_open_oco_orders")
+        return [dict(order_list) for order_list in self.lists["spot"].values()]
+
+    def cancel_order(self, symbol, orderId, **params):
+        self._call("cancel_order", symbol=symbol, orderId=orderId)
+        return self._cancel("spot", symbol, orderId)[0]
+
+    def cancel_all_open_orders(self, symbol, **params):
+        self._call("cancel_all_open_orders", symbol=symbol)
+        return self._cancel_all("spot", symbol)
+
+    # cross margin
+    def create_margin_order(self, symbol, side, type, quantity, price=None, stopPrice=None, **params):
+        self._call("create_margin_order", symbol=symbol, side=side, type=type)
+        return self._order("margin", symbol, side, type, quantity, price, stopPrice)
+
+    def create_margin_oco_order(self, symbol, side, quantity, price, stopPrice, **params):
+        self._call("create_margin_oco_order", symbol=symbol, side=side)
+        return self._oco("margin", symbol, side, quantity, price, stopPrice)
+
+    def get_open_margin_orders(self, symbol=None, **params):
+        self._call("get_open_margin_orders", symbol=symbol)
+        return self._open("margin", symbol)
+
+    def get_open_margin_oco_orders(self, **params):
+        self._call("get_open_margin_oco_orders")
+        return [dict(order_list) for order_list in self.lists["margin"].values()]
+
+    def cancel_margin_order(self, symbol, orderId, **params):
+        self._call("cancel_margin_order", symbol=symbol, orderId=orderId)
+        return self._cancel("margin", symbol, orderId)[0]
+
+    def cancel_margin_oco_order(self, symbol, orderListId, **params):
+        self._call("cancel_margin_oco_order", symbol=symbol, orderListId=orderListId)
+        order_list = self.lists["margin"].get(orderListId)
+        if order_list is None or order_list["symbol"] != symbol:
+            raise FakeAPIException(-2011, "Unknown order sent.")
+        legs = self._cancel("margin", symbol, order_list["orders"][0]["orderId"])
+        return dict(order_list, listOrderStatus="ALL_DONE", orderReports=legs)
+
+    def cancel_all_open_margin_orders(self, symbol, **params):
+        self._call("cancel_all_open_margin_orders", symbol=symbol)
+        return self._cancel_all("margin", symbol)
+
+
+class StubKlinesServer:
+    """
+    Local HTTP server answering /api/v3/klines from generated candles that
+    open every `interval_ms` from `listing_ms` on. A page whose startTime is
+    in `empty_once` comes back empty the first time it is asked for, like a
+    flaky exchange. `requests` logs the (startTime, endTime) of every call.
+    Use `base_url` wherever a base URL is taken.
+    """
+
+    def __init__(self, listing_ms, interval_ms, empty_once=()):
+        self.listing_ms = listing_ms
+        self.interval_ms = interval_ms
+        self.empty_once = set(empty_once)
+        self.requests = []
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                body = json.dumps(stub.klines(*(int(query[k][0]) for k in ("startTime", "endTime", "limit"))))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def klines(self, start, end, limit):
+        self.requests.append((start, end))
+        if start in self.empty_once:
+            self.empty_once.discard(start)
+            return []
+        first = max(start, self.listing_ms)
+        first += -(first - self.listing_ms) % self.interval_ms
+        opens = range(first, end + 1, self.interval_ms)[:limit]
+        return [
+            [t, "1.0", "1.1", "0.9", "1.0", "10", t + self.interval_ms - 1, "10", 5, "5", "5", "0"]
+            for t in opens
+        ]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def check_backfill_resume():
+    """
+    A page that comes back empty once is not checkpointed: the next run
+    fetches exactly that page and the history is complete, the run after it
+    fetches nothing. Pages before the listing are never asked for.
+    """
+    import tempfile
+
+    import backfill
+    from candle_store import CandleStore
+
+    interval_ms = 5 * 60_000
+    span = backfill.PAGE_SIZE * interval_ms
+    start = 1_600_000_000_000 // span * span
+    listing = start + 2 * span + 7 * interval_ms
+    end = start + 6 * span
+    flaky = start + 4 * span
+    stub = StubKlinesServer(listing, interval_ms, empty_once=[flaky])
+    ok = True
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            store = CandleStore(root)
+            runs = []
+            for _ in range(3):
+                stub.requests.clear()
+                backfill.backfill(["BTCUSDT"], "5m", start, end, store=store, workers=2, base_url=stub.base_url)
+                pages = sorted(begin for begin, _ in stub.requests if begin != start)
+                candles = len(store.load("BTCUSDT", "5m", columns=["Open Time"]))
+                runs.append((pages, candles))
+    finally:
+        stub.close()
+    expected = [
+        ([start + 2 * span, start + 3 * span, flaky, start + 5 * span], (end - listing) // interval_ms - backfill.PAGE_SIZE),
+        ([flaky], (end - listing) // interval_ms),
+        ([], (end - listing) // interval_ms),
+    ]
+    for run, (got, want) in enumerate(zip(runs, expected), 1):
+        within = got == want
+        ok = ok and within
+        print(
+            f"backfill run {run}: pages fetched {[(p - start) // span for p in got[0]]}, "
+            f"{got[1]} candles stored -> {'ok' if within else 'FAILED'}"
+        )
+    return ok
+
+
+def check_flatten():
+    """
+    Orders placed on the exchange by an earlier process are cancelled by
+    flattening from a fresh, empty book, with and without cancel-all, and
+    the other symbols keep theirs.
+    """
+    import order_book
+
+    ok = True
+    for bulk in (True, False):
+        exchange = FakeExchange(bulk=bulk)
+        for symbol in ("BTCUSDT", "ETHUSDT"):
+            exchange.create_margin_oco_order(symbol, "SELL", 1, price=110, stopPrice=90)
+            exchange.create_margin_order(symbol, "SELL", "LIMIT", 1, price=120)
+        # a restart: nothing in the local book
+        book = order_book.OpenOrderBook(exchange, margin=True)
+        book.flatten("BTCUSDT")
+        left = {order["symbol"] for order in exchange.get_open_margin_orders()}
+        empty = book.flatten("BTCUSDT") == []
+        within = left == {"ETHUSDT"} and empty
+        ok = ok and within
+        print(
+            f"flatten after restart, cancel-all {'on' if bulk else 'off'}: "
+            f"open orders left on {sorted(left)} -> {'ok' if within else 'FAILED'}"
+        )
+    return ok
+
+
+if __name__ == "__main__":
+    import sys
+
+    checks = [check_flatten(), check_backfill_resume()]
+    sys.exit(0 if all(checks) else 1)
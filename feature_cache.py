@@ -0,0 +1,157 @@
+import collections
+import glob
+import hashlib
+import os
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import schema
+
+FEATURE_CACHE_DIR = os.getenv("FEATURE_CACHE_DIR", "feature_cache")
+# part of every fingerprint, bump it when process_data computes something different
+FEATURES_VERSION = b"features-1"
+FINGERPRINT_COLUMNS = ["Open Time", "Open", "High", "Low", "Close", "Volume"]
+
+
+def fingerprint(candles):
+    """Digest of the candle columns process_data reads, the same for the same candles."""
+    digest = hashlib.blake2b(FEATURES_VERSION, digest_size=16)
+    for column in FINGERPRINT_COLUMNS:
+        values = candles[column].values
+        if column == "Open Time":
+            # datetimes from the resampler, strings when read back from a CSV
+            values = pd.to_datetime(candles[column]).values.astype("M8[ns]").view(np.int64)
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    Processed feature frames keyed by (name, fingerprint of the closed
+    candles they came from), so a run over candles already processed skips
+    the pipeline.
+
+    The newest entries are kept in memory, at most `max_entries` and
+    `max_bytes`. Every entry is also written to `root` as its own .npy
+    file, and the least recently used files are removed beyond
+    `max_disk_bytes`, so a restart starts warm.
+    """
+
+    def __init__(
+        self,
+        root=FEATURE_CACHE_DIR,
+        max_entries=64,
+        max_bytes=64 * 2**20,
+        max_disk_bytes=512 * 2**20,
+    ):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # path -> (fingerprint, first tail row, its byte offset, size, mtime) of the CSVs written
+        self.files = {}
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name, digest):
+        return os.path.join(self.root, f"{name}.{digest}.npy")
+
+    def get(self, name, digest):
+        key = (name, digest)
+        with self.lock:
+            frame = self.entries.get(key)
+            if frame is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return frame
+        path = self._path(name, digest)
+        try:
+            records = np.load(path)
+        except (FileNotFoundError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        os.utime(path)
+        frame = schema.apply_feature_schema(pd.DataFrame.from_records(records))
+        with self.lock:
+            self.hits += 1
+            self._remember(key, frame)
+        return frame
+
+    def put(self, name, digest, frame):
+        key = (name, digest)
+        with self.lock:
+            self._remember(key, frame)
+        path = self._path(name, digest)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.save(file, frame.to_records(index=False))
+        os.replace(tmp_path, path)
+        self._evict_disk()
+
+    def _remember(self, key, frame):
+        if key in self.entries:
+            self.bytes -= self._size(self.entries.pop(key))
+        self.entries[key] = frame
+        self.bytes += self._size(frame)
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, old = self.entries.popitem(last=False)
+            self.bytes -= self._size(old)
+
+    @staticmethod
+    def _size(frame):
+        return int(frame.memory_usage(index=False).sum())
+
+    def _evict_disk(self):
+        files = []
+        for path in glob.glob(os.path.join(self.root, "*.npy")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # another process removed or still holds it
+                continue
+            total -= size
+
+    def write_csv(self, frame, path, digest, tail_start):
+        """
+        Write `frame` to `path`. When the file is still the one written last
+        time from the same closed candles, only the rows from `tail_start`
+        on are rewritten.
+        """
+        known = self.files.get(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        if (
+            known is not None
+            and stat is not None
+            and known[:2] == (digest, tail_start)
+            and known[3:] == (stat.st_size, stat.st_mtime_ns)
+        ):
+            offset = known[2]
+            with open(path, "r+b") as file:
+                file.truncate(offset)
+            frame.iloc[tail_start:].to_csv(path, mode="a", header=False, index=False)
+        else:
+            frame.iloc[:tail_start].to_csv(path, index=False)
+            offset = os.path.getsize(path)
+            frame.iloc[tail_start:].to_csv(path, mode="a", header=False, index=False)
+        stat = os.stat(path)
+        self.files[path] = (digest, tail_start, offset, stat.st_size, stat.st_mtime_ns)
@@ -1,20 +1,23 @@
+import os
+
 import pandas as pd
 import numpy as np
-import ta
-from scipy.signal import argrelextrema
-from sklearn.linear_model import LinearRegression
+
+import schema
 
 
 def read_data(file_path):
-    return pd.read_csv(file_path)
+    return schema.read_candles(file_path)
 
 def add_technical_indicators(data):
+    import indicators
+
     data["Open Time"] = pd.to_datetime(data["Open Time"])
-    data["RSI"] = ta.momentum.rsi(data["Close"], window=14, fillna=True)
+    data["RSI"] = indicators.rsi(data["Close"].values, window=14)
     data["MA_22"] = data["Close"].rolling(window=22).mean()
     data["MA_50"] = data["Close"].rolling(window=50).mean()
-    data["ATR"] = ta.volatility.average_true_range(
-        data["High"], data["Low"], data["Close"], window=14, fillna=True
+    data["ATR"] = indicators.atr(
+        data["High"].values, data["Low"].values, data["Close"].values, window=14
     )
     data["Mean ATR"] = data["ATR"].rolling(window=12).mean()
    # data['Volume SMA'] = data['Volume'].rolling(window=12).mean() 
@@ -48,12 +51,16 @@ def detect_divergences(data, window_sizes=[15, 30]):
     return data
 
 def find_extrema(series, window=9): 
+    from scipy.signal import argrelextrema
+
     max_idx = argrelextrema(series.values, np.greater, order=window)[0]
     min_idx = argrelextrema(series.values, np.less, order=window)[0]
     return max_idx, min_idx
 
 
 def calculate_slope(y_values):
+    from sklearn.linear_model import LinearRegression
+
     if len(y_values) < 2:
         return 0 
     x_values = np.arange(len(y_values)).reshape(-1, 1)
@@ -100,67 +107,124 @@ def round_number(data):
 
 
 def mark_extrema(data):
+    from scipy.signal import argrelextrema
+
     order = 5
     maxima_indices = argrelextrema(data["Close"].values, np.greater, order=order)[0]
     minima_indices = argrelextrema(data["Close"].values, np.less, order=order)[0]
-    data["extrema"] = 0
-    data.loc[maxima_indices, "extrema"] = "high"
-    data.loc[minima_indices, "extrema"] = "low"
+    data["extrema"] = np.int8(schema.EXTREMA_NONE)
+    data.loc[maxima_indices, "extrema"] = schema.EXTREMA_HIGH
+    data.loc[minima_indices, "extrema"] = schema.EXTREMA_LOW
     return data
 
 
 def mark_medium_extrema(data):
+    from scipy.signal import argrelextrema
+
     order = 30
     maxima_indices = argrelextrema(data["Close"].values, np.greater, order=order)[0]
     minima_indices = argrelextrema(data["Close"].values, np.less, order=order)[0]
-    data["medium_extrema"] = 0
-    data.loc[maxima_indices, "medium_extrema"] = "medium_high"
-    data.loc[minima_indices, "medium_extrema"] = "medium_low"
+    data["medium_extrema"] = np.int8(schema.EXTREMA_NONE)
+    data.loc[maxima_indices, "medium_extrema"] = schema.EXTREMA_HIGH
+    data.loc[minima_indices, "medium_extrema"] = schema.EXTREMA_LOW
     return data
 
 
 def mark_big_extrema(data):
+    from scipy.signal import argrelextrema
+
     order = 50
     maxima_indices = argrelextrema(data["Close"].values, np.greater, order=order)[0]
     minima_indices = argrelextrema(data["Close"].values, np.less, order=order)[0]
-    data["big_extrema"] = 0
-    data.loc[maxima_indices, "big_extrema"] = "big_high"
-    data.loc[minima_indices, "big_extrema"] = "big_low"
+    data["big_extrema"] = np.int8(schema.EXTREMA_NONE)
+    data.loc[maxima_indices, "big_extrema"] = schema.EXTREMA_HIGH
+    data.loc[minima_indices, "big_extrema"] = schema.EXTREMA_LOW
     return data
 
 
-def process_data(file_path):
-    data = read_data(file_path)
-    data = add_technical_indicators(data)
-    data = detect_divergences(data)
+# the forming candle can move the marks of this many rows at the end: the widest extrema order and itself
+FORMING_REACH = 51
+# rows recomputed on a cache hit, enough for every row in reach to see its whole left context
+TAIL_ROWS = 2 * FORMING_REACH + 20
+# the same for the consolidation marks, whose windows are 12 candles
+CONSOLIDATION_REACH = 12
+CONSOLIDATION_TAIL_ROWS = 2 * CONSOLIDATION_REACH
+
+
+def mark_divergences(data, divergence_detector=None):
+    if divergence_detector is None:
+        return detect_divergences(data)
+    # only the candles that closed since the last run are evaluated
+    return divergence_detector.apply(data)
+
+
+def mark_swings(data):
     # data = round_number(data)
     data = mark_extrema(data)
     data = mark_big_extrema(data)
     data = mark_medium_extrema(data)
-    data = detect_consolidation(data)
-
-    feature_columns = [
-        "Open Time",
-        "Volume",
-        "Open",
-        #  "High",
-        # "Low",
-        "Close",
-        "ATR",
-        "RSI",
-        "MA_22",
-        "MA_50",
-        #  "round_number",
-        "bullish_divergence",
-        "bearish_divergence",
-        "extrema",
-        "big_extrema",
-        "medium_extrema",
-        "Mean ATR",
-        #     "Volume SMA",
-        "consolidated",
-    ]
-    data[feature_columns].to_csv(file_path + "_for_processing.csv", index=False)
+    return detect_consolidation(data)
+
+
+def process_forming(data, cached, divergence_detector=None):
+    """
+    Features for `data` from the cached features of the same closed candles:
+    the indicators are recomputed whole (they are vectorized), the marks
+    only over a short tail, and the rows the forming candle can reach
+    replace the cached ones.
+    """
+    data = add_technical_indicators(data)
+    if divergence_detector is not None:
+        # nothing new to feed, this only resolves the pending tail
+        data = divergence_detector.apply(data)
+    tail = data.iloc[len(data) - TAIL_ROWS :].reset_index(drop=True)
+    if divergence_detector is None:
+        tail = detect_divergences(tail)
+    tail = mark_medium_extrema(mark_big_extrema(mark_extrema(tail)))
+    # the python loop of detect_consolidation over the few rows it can still change
+    consolidation = detect_consolidation(
+        data.iloc[len(data) - CONSOLIDATION_TAIL_ROWS :].reset_index(drop=True)
+    )
+    consolidated = cached["consolidated"].values[-TAIL_ROWS:].copy()
+    consolidated[-CONSOLIDATION_REACH:] = consolidation["consolidated"].values[-CONSOLIDATION_REACH:]
+    tail["consolidated"] = consolidated
+
+    start = len(cached) - FORMING_REACH
+    tail = schema.apply_feature_schema(tail.iloc[-FORMING_REACH:])
+    return pd.concat([cached.iloc[:start], tail], ignore_index=True)
+
+
+def process_data(file_path, data=None, divergence_detector=None, cache=None):
+    if data is None:
+        data = read_data(file_path)
+    else:
+        data = data.copy()
+
+    digest = None
+    output = file_path + "_for_processing.csv"
+    name = os.path.basename(file_path)
+    if cache is not None and len(data) > TAIL_ROWS:
+        import feature_cache
+
+        digest = feature_cache.fingerprint(data.iloc[:-1])
+        cached = cache.get(name, digest)
+        if cached is not None and len(cached) == len(data):
+            features = process_forming(data, cached, divergence_detector)
+            cache.write_csv(features, output, digest, len(features) - FORMING_REACH)
+            return features
+
+    data = add_technical_indicators(data)
+    data = mark_divergences(data, divergence_detector)
+    data = mark_swings(data)
+
+    features = schema.apply_feature_schema(data)
+    schema.memory_report(features, output)
+    if digest is None:
+        features.to_csv(output, index=False)
+    else:
+        cache.put(name, digest, features)
+        cache.write_csv(features, output, digest, len(features) - FORMING_REACH)
+    return features
 
 if __name__ == "__main__":
     process_data("BTCUSDT_4h_data.csv")
@@ -0,0 +1,121 @@
+import glob
+import json
+import os
+import uuid
+
+import numpy as np
+
+import ringbuffer
+
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "feature_store")
+
+
+class FeatureStore:
+    """
+    Versioned per-symbol feature snapshots that any number of processes can
+    memory-map.
+
+    A snapshot is written once to its own file and never modified, then the
+    small manifest next to it is swapped with os.replace. Readers only open
+    files named by a manifest, so they see either the old or the new snapshot
+    and never a half written one. Old snapshots a reader still has mapped stay
+    valid after they are unlinked.
+    """
+
+    def __init__(self, root=FEATURE_STORE_DIR, keep=3):
+        self.root = root
+        self.keep = keep
+        os.makedirs(root, exist_ok=True)
+
+    def _base(self, symbol, interval):
+        return os.path.join(self.root, f"{symbol}_{interval}")
+
+    def manifest(self, symbol, interval):
+        try:
+            with open(self._base(symbol, interval) + ".json") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def version(self, symbol, interval):
+        manifest = self.manifest(symbol, interval)
+        return manifest["version"] if manifest else 0
+
+    def symbols(self, interval):
+        """Every symbol with a snapshot of `interval`, whichever process published it."""
+        suffix = f"_{interval}.json"
+        return sorted(
+            name[: -len(suffix)] for name in os.listdir(self.root) if name.endswith(suffix)
+        )
+
+    def publish(self, symbol, interval, frame):
+        """Write `frame` as the next snapshot (single writer per symbol/interval)."""
+        records = np.zeros(len(frame), dtype=ringbuffer.RING_DTYPE)
+        for column in records.dtype.names:
+            if column in frame:
+                records[column] = frame[column].values
+
+        base = self._base(symbol, interval)
+        version = self.version(symbol, interval) + 1
+        path = f"{base}.v{version}.npy"
+        tmp_path = f"{base}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.save(file, records)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+        manifest = {"version": version, "file": os.path.basename(path), "rows": len(records)}
+        tmp_manifest = f"{base}.{uuid.uuid4().hex}.json.tmp"
+        with open(tmp_manifest, "w") as file:
+            json.dump(manifest, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_manifest, base + ".json")
+
+        self._cleanup(base, version)
+        return version
+
+    def read(self, symbol, interval, retries=3):
+        """(version, read-only memory-mapped record array) of the latest snapshot."""
+        for _ in range(retries):
+            manifest = self.manifest(symbol, interval)
+            if manifest is None:
+                return 0, None
+            try:
+                records = np.load(os.path.join(self.root, manifest["file"]), mmap_mode="r")
+                return manifest["version"], records
+            except FileNotFoundError:
+                # cleaned up between reading the manifest and opening it
+                continue
+        raise RuntimeError(f"No stable snapshot for {symbol} {interval}.")
+
+    def _cleanup(self, base, version):
+        for path in glob.glob(f"{base}.v*.npy"):
+            old = int(path[len(base) + 2 : -4])
+            if old <= version - self.keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # still mapped by a reader on Windows, retried next publish
+                    pass
+
+
+class FeatureReader:
+    """Keeps snapshots mapped in a reader process and remaps only when a new version is out."""
+
+    def __init__(self, store=None):
+        self.store = store or FeatureStore()
+        self.snapshots = {}
+
+    def get(self, symbol, interval):
+        key = (symbol, interval)
+        version = self.store.version(symbol, interval)
+        cached = self.snapshots.get(key)
+        if cached is None or cached[0] != version:
+            cached = self.store.read(symbol, interval)
+            self.snapshots[key] = cached
+        return cached
+
+    def updated(self, symbol, interval, since_version):
+        return self.store.version(symbol, interval) > since_version
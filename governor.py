@@ -0,0 +1,214 @@
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+
+# order traffic is served before bulk market data
+ORDERS = 0
+DATA = 1
+
+WEIGHT_HEADERS = ("X-MBX-USED-WEIGHT-1M", "X-SAPI-USED-IP-WEIGHT-1M")
+# the exchange rejected the request without executing it
+RATE_LIMIT_STATUS = (418, 429)
+
+# every host keeps its own counters, testnet orders do not spend the klines budget
+MAINNET_HOST = "api.binance.com"
+
+# documented request weights of the endpoints the client calls, 1 otherwise
+ENDPOINT_WEIGHTS = {
+    ("GET", "/api/v3/exchangeInfo"): 20,
+    ("GET", "/api/v3/account"): 20,
+    ("GET", "/api/v3/ticker/price"): 2,
+    ("GET", "/api/v3/openOrders"): 6,
+    ("GET", "/api/v3/openOrderList"): 6,
+    ("GET", "/sapi/v1/margin/account"): 10,
+    ("GET", "/sapi/v1/margin/maxBorrowable"): 50,
+    ("GET", "/sapi/v1/margin/openOrders"): 10,
+    ("GET", "/sapi/v1/margin/openOrderList"): 10,
+    ("POST", "/sapi/v1/margin/order"): 6,
+    ("POST", "/sapi/v1/margin/order/oco"): 6,
+    ("DELETE", "/sapi/v1/margin/order"): 10,
+}
+# the same endpoints without a symbol cover every symbol and weigh more
+ALL_SYMBOLS_WEIGHTS = {
+    ("GET", "/api/v3/ticker/price"): 4,
+    ("GET", "/api/v3/openOrders"): 80,
+    ("GET", "/sapi/v1/margin/openOrders"): 40,
+}
+
+
+def endpoint_weight(method, uri, params=None):
+    """Request weight of a python-binance call to `uri` with `params`."""
+    key = (method.upper(), urllib.parse.urlsplit(uri).path)
+    if not (params or {}).get("symbol") and key in ALL_SYMBOLS_WEIGHTS:
+        return ALL_SYMBOLS_WEIGHTS[key]
+    return ENDPOINT_WEIGHTS.get(key, 1)
+
+
+class WeightGovernor:
+    """
+    One per-minute request-weight budget shared by every HTTP caller in the
+    process that talks to one host: raw klines requests and the
+    python-binance client.
+
+    Weight is reserved before a request and corrected from the exchange's
+    used-weight headers afterwards. Market data may only use the part of the
+    budget not reserved for orders and always yields to waiting order calls.
+    """
+
+    def __init__(
+        self,
+        limit_per_minute=1200,
+        order_reserve=0.25,
+        max_retries=5,
+        base_delay=0.5,
+        max_delay=30,
+    ):
+        self.limit_per_minute = limit_per_minute
+        self.order_reserve = order_reserve
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        self.minute = None
+        self.used = 0
+        self.orders_waiting = 0
+        self.paused_until = 0.0
+        # swapped out by cassette.py to record or replay the responses
+        self.http_get = requests.get
+
+    def _roll(self, now):
+        # the exchange resets its counters on minute boundaries
+        minute = int(now // 60)
+        if minute != self.minute:
+            self.minute = minute
+            self.used = 0
+
+    def acquire(self, weight, priority=DATA):
+        with self.condition:
+            if priority == ORDERS:
+                self.orders_waiting += 1
+            try:
+                while True:
+                    now = time.time()
+                    self._roll(now)
+                    wait = self.paused_until - now
+                    if wait <= 0:
+                        cap = self.limit_per_minute
+                        if priority != ORDERS:
+                            cap *= 1 - self.order_reserve
+                        blocked = priority != ORDERS and self.orders_waiting > 0
+                        if not blocked and self.used + weight <= cap:
+                            self.used += weight
+                            return
+                        wait = 60 - now % 60
+                    self.condition.wait(timeout=wait)
+            finally:
+                if priority == ORDERS:
+                    self.orders_waiting -= 1
+                    self.condition.notify_all()
+
+    def observe(self, headers):
+        for name in WEIGHT_HEADERS:
+            value = headers.get(name)
+            if value is None:
+                continue
+            with self.condition:
+                self._roll(time.time())
+                self.used = max(self.used, int(value))
+
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+        logging.warning("Request weight exhausted, pausing all requests for %ss.", seconds)
+
+    def backoff(self, attempt):
+        # full jitter so concurrent callers do not retry in lockstep
+        time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt)))
+
+    def _rate_limited(self, status, headers):
+        if status not in RATE_LIMIT_STATUS:
+            return False
+        retry_after = headers.get("Retry-After")
+        self.pause(float(retry_after) if retry_after else 60 - time.time() % 60)
+        return True
+
+    def get(self, url, params=None, weight=1, priority=DATA, timeout=30):
+        """requests.get through the budget, retried on rate limits, 5xx and connection errors."""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(weight, priority)
+            try:
+                response = self.http_get(url, params=params, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning("GET %s failed (%s), retrying.", url, e)
+                self.backoff(attempt)
+                continue
+            self.observe(response.headers)
+            if self._rate_limited(response.status_code, response.headers):
+                continue
+            if response.status_code >= 500 and attempt < self.max_retries:
+                self.backoff(attempt)
+                continue
+            return response
+        return response
+
+    def client_request(self, client, send, method, uri, signed, force_params, priority, **kwargs):
+        """One python-binance request through the budget, `send` is the client's own _request."""
+        weight = endpoint_weight(method, uri, kwargs.get("data"))
+        # placing or cancelling is not repeated unless the exchange rejected it outright
+        idempotent = method.lower() == "get"
+        for attempt in range(self.max_retries + 1):
+            self.acquire(weight, priority)
+            client.response = None
+            try:
+                return send(method, uri, signed, force_params, **kwargs)
+            except Exception as e:
+                response = client.response
+                status = getattr(response, "status_code", None)
+                if response is not None:
+                    self.observe(response.headers)
+                if attempt == self.max_retries:
+                    raise
+                if response is not None and self._rate_limited(status, response.headers):
+                    continue
+                transient = response is None or status >= 500
+                if not (idempotent and transient):
+                    raise
+                logging.warning("%s %s failed (%s), retrying.", method.upper(), uri, e)
+                self.backoff(attempt)
+            finally:
+                if client.response is not None:
+                    self.observe(client.response.headers)
+
+
+def wrap_client(client, priority=ORDERS):
+    """
+    Route every request of a python-binance Client through the budget of the
+    host it goes to, at the documented weight of its endpoint.
+    """
+    send = client._request
+
+    def governed_request(method, uri, signed, force_params=False, **kwargs):
+        host = urllib.parse.urlsplit(uri).netloc
+        return get_governor(host).client_request(
+            client, send, method, uri, signed, force_params, priority, **kwargs
+        )
+
+    client._request = governed_request
+    return client
+
+
+_governors = {}
+_governor_lock = threading.Lock()
+
+
+def get_governor(host=MAINNET_HOST):
+    with _governor_lock:
+        if host not in _governors:
+            _governors[host] = WeightGovernor()
+        return _governors[host]
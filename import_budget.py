@@ -0,0 +1,57 @@
+import argparse
+import subprocess
+import sys
+
+# cumulative import time allowed per entry path, in milliseconds
+BUDGETS = {
+    "fetch": ("market_data", 250),
+    "orders": ("testclient_and_orders", 50),
+}
+
+# nothing on these paths should drag in the analytics stack or the exchange client
+HEAVY_MODULES = ["pandas", "numpy", "scipy", "sklearn", "ta", "binance", "apscheduler"]
+
+
+def measure_import(module):
+    """Import `module` in a fresh interpreter and return (milliseconds, heavy modules loaded)."""
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = (time.perf_counter() - start) * 1000\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(elapsed, ','.join(heavy))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.split()
+    heavy = output[1].split(",") if len(output) > 1 else []
+    return float(output[0]), heavy
+
+
+def check_budgets(paths=None, repeat=3):
+    ok = True
+    for path in paths or BUDGETS:
+        module, budget = BUDGETS[path]
+        runs = [measure_import(module) for _ in range(repeat)]
+        elapsed = min(run[0] for run in runs)
+        heavy = runs[0][1]
+        within = elapsed <= budget and not heavy
+        ok = ok and within
+        print(
+            f"{path}: import {module} took {elapsed:.1f} ms (budget {budget} ms)"
+            f"{', heavy modules loaded: ' + ', '.join(heavy) if heavy else ''}"
+            f" -> {'ok' if within else 'over budget'}"
+        )
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check startup import-time budgets.")
+    parser.add_argument("paths", nargs="*", help=f"any of {', '.join(BUDGETS)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    unknown = [path for path in args.paths if path not in BUDGETS]
+    if unknown:
+        parser.error(f"unknown paths: {', '.join(unknown)}")
+    sys.exit(0 if check_budgets(args.paths or None, args.repeat) else 1)
@@ -0,0 +1,84 @@
+import numpy as np
+from scipy.signal import lfilter
+
+# Wilder smoothing as a first order recursive filter:
+#   y[t] = y[t - 1] + (x[t] - y[t - 1]) / window
+# All kernels take raw float arrays with time on the last axis, so a
+# (symbols, candles) matrix is smoothed in one call.
+
+
+def wilder_smooth(values, window, initial=None):
+    values = np.asarray(values, dtype=np.float64)
+    alpha = 1.0 / window
+    if initial is None:
+        # pandas ewm(adjust=False) starts from the first observation
+        initial = np.take(values, [0], axis=-1)
+    else:
+        initial = np.asarray(initial, dtype=np.float64)[..., np.newaxis]
+    smoothed, _ = lfilter(
+        [alpha], [1.0, alpha - 1.0], values, axis=-1, zi=(1.0 - alpha) * initial
+    )
+    return smoothed
+
+
+def rsi(close, window=14):
+    """Same values as ta.momentum.rsi(close, window, fillna=True)."""
+    close = np.asarray(close, dtype=np.float64)
+    if close.shape[-1] == 0:
+        return close.copy()
+    diff = np.diff(close, axis=-1, prepend=np.take(close, [0], axis=-1))
+    up = np.where(diff > 0, diff, 0.0)
+    down = np.where(diff < 0, -diff, 0.0)
+    ema_up = wilder_smooth(up, window)
+    ema_down = wilder_smooth(down, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = 100.0 - 100.0 / (1.0 + ema_up / ema_down)
+    values = np.where(ema_down == 0, 100.0, values)
+    return np.where(np.isnan(values), 50.0, values)
+
+
+def true_range(high, low, close):
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    prev_close = np.empty_like(close)
+    prev_close[..., 0] = np.nan
+    prev_close[..., 1:] = close[..., :-1]
+    # fmax skips the missing previous close on the first candle, like ta does
+    return np.fmax(
+        np.fmax(high - low, np.abs(high - prev_close)), np.abs(low - prev_close)
+    )
+
+
+def atr(high, low, close, window=14):
+    """Same values as ta.volatility.average_true_range(..., window, fillna=True)."""
+    tr = true_range(high, low, close)
+    values = np.zeros_like(tr)
+    if tr.shape[-1] < window:
+        return values
+    seed = tr[..., :window].mean(axis=-1)
+    values[..., window - 1] = seed
+    if tr.shape[-1] > window:
+        values[..., window:] = wilder_smooth(tr[..., window:], window, initial=seed)
+    return np.nan_to_num(values, nan=0.0)
+
+
+def rolling_slope(values, window):
+    """
+    Least squares slope of values[max(i - window, 0) : i + 1] for every i,
+    the window detect_divergences fits, for all candles at once.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    slopes = np.zeros(n)
+    # the first candles only have a clipped window
+    for i in range(min(window, n)):
+        m = i + 1
+        if m > 1:
+            x = np.arange(m) - (m - 1) / 2
+            slopes[i] = x @ values[:m] / (x @ x)
+    if n > window:
+        x = np.arange(window + 1) - window / 2
+        windows = np.lib.stride_tricks.sliding_window_view(values, window + 1)
+        slopes[window:] = windows @ x / (x @ x)
+    return slopes
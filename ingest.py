@@ -0,0 +1,123 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+import market_data
+import resampling
+import schema
+import trade_logging
+
+# candles per klines request
+PAGE_SIZE = 1000
+# a gap the exchange still has not filled after this many runs is a real hole in its data
+MAX_REPAIR_TRIES = 3
+
+# positions in the batch as received, gaps as [first missing, last missing] open times
+Inspection = collections.namedtuple("Inspection", ["duplicates", "out_of_order", "gaps"])
+
+
+def gap_runs(missing, interval_ms):
+    """Sorted missing open times as an (n, 2) array of [first, last] runs."""
+    missing = np.asarray(missing, dtype=np.int64)
+    if len(missing) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(missing) != interval_ms) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks - 1, [len(missing) - 1]])
+    return np.stack([missing[starts], missing[ends]], axis=1)
+
+
+def inspect(open_times, interval_ms, after=None):
+    """
+    Check the spacing of a batch of open times with array diffs: a step
+    below zero is an out-of-order row, a repeated time a duplicate and a
+    step over one interval a gap. `after` is the last candle already held,
+    a batch starting later than the next one opens with a gap.
+    """
+    times = np.asarray(open_times, dtype=np.int64)
+    out_of_order = np.flatnonzero(np.diff(times) < 0) + 1
+    order = np.argsort(times, kind="stable")
+    ordered = times[order]
+    duplicates = np.sort(order[1:][np.diff(ordered) == 0])
+    unique = np.unique(ordered)
+    if after is not None:
+        unique = np.concatenate([[after], unique[unique > after]])
+    steps = np.diff(unique)
+    at = np.flatnonzero(steps > interval_ms)
+    gaps = np.stack([unique[at] + interval_ms, unique[at + 1] - interval_ms], axis=1)
+    return Inspection(duplicates, out_of_order, gaps.reshape(-1, 2))
+
+
+def clean(candles):
+    """Sorted by open time, the last copy of a duplicated candle kept."""
+    candles = candles.sort_values("Open Time", kind="stable")
+    candles = candles.drop_duplicates("Open Time", keep="last")
+    return candles.reset_index(drop=True)
+
+
+def fill_gaps(symbol, interval, gaps, fetch=None):
+    """
+    Fetch exactly the missing ranges, a page per PAGE_SIZE candles. Returns
+    the candles found and the runs the exchange did not have.
+    """
+    fetch = fetch or market_data.fetch_range
+    interval_ms = resampling.INTERVAL_MS[interval]
+    frames = []
+    missing = []
+    for first, last in gaps:
+        for start in range(int(first), int(last) + 1, PAGE_SIZE * interval_ms):
+            end = min(start + (PAGE_SIZE - 1) * interval_ms, int(last))
+            found = schema.candles_from_klines(fetch(symbol, interval, start, end, PAGE_SIZE))
+            found = found[found["Open Time"].between(start, end)]
+            frames.append(found)
+            expected = np.arange(start, end + 1, interval_ms)
+            missing.append(np.setdiff1d(expected, found["Open Time"].values))
+    found = pd.concat(frames, ignore_index=True) if frames else schema.candles_from_klines([])
+    return found, gap_runs(np.concatenate(missing) if missing else [], interval_ms)
+
+
+def ingest(symbol, interval, klines, after=None, gaps=None, fetch=None):
+    """
+    Validate a klines batch before it reaches the resampler. Duplicates and
+    out-of-order rows are dropped and sorted away. Gaps in the batch, between
+    `after` and the batch, and the ones still open from earlier runs (`gaps`,
+    {(first, last): tries}) are fetched as targeted ranges.
+
+    Returns the clean candles, which may include repaired candles older than
+    `after`, and the gaps still open.
+    """
+    interval_ms = resampling.INTERVAL_MS[interval]
+    candles = schema.candles_from_klines(klines)
+    inspection = inspect(candles["Open Time"].values, interval_ms, after)
+    if len(inspection.duplicates) or len(inspection.out_of_order) or len(inspection.gaps):
+        trade_logging.log_event(
+            "ingest",
+            symbol=symbol,
+            interval=interval,
+            duplicates=len(inspection.duplicates),
+            out_of_order=len(inspection.out_of_order),
+            gaps=inspection.gaps.tolist(),
+        )
+
+    tries = dict(gaps or {})
+    for first, last in inspection.gaps:
+        tries.setdefault((int(first), int(last)), 0)
+    if not tries:
+        return clean(candles), {}
+
+    found, missing = fill_gaps(symbol, interval, list(tries), fetch)
+    still_open = {}
+    for first, last in missing:
+        # a run left over from a wider gap keeps that gap's count
+        count = max(n for (a, b), n in tries.items() if a <= first and last <= b) + 1
+        if count < MAX_REPAIR_TRIES:
+            still_open[(int(first), int(last))] = count
+    trade_logging.log_event(
+        "repair",
+        symbol=symbol,
+        interval=interval,
+        fetched=len(found),
+        missing=[list(gap) for gap in still_open],
+    )
+    return clean(pd.concat([candles, found], ignore_index=True)), still_open
@@ -1,15 +1,19 @@
 import pandas as pd
 import numpy as np
 import requests
-import ta
+import indicators
+from feature_store import FeatureStore
 from scipy.signal import argrelextrema
 from sklearn.linear_model import LinearRegression
 
+# an interval the scheduler publishes, the 4h job is off
+INTERVAL = '1h'
+
 def fetch_latest_candle():
     url = "https://api.binance.com/api/v3/klines"
     params = {
         'symbol': 'BTCUSDT',
-        'interval': '4h',
+        'interval': INTERVAL,
         'limit': 1
     }
     response = requests.get(url, params=params)
@@ -25,18 +29,24 @@ def fetch_latest_candle():
     data['Volume'] = pd.to_numeric(data['Volume'])
     return data
 
-data = pd.read_csv('data_for_model.csv')
+# latest snapshot the scheduler published, the old CSV export otherwise
+version, records = FeatureStore().read('BTCUSDT', INTERVAL)
+if records is not None:
+    # its last row is the forming candle, fetched again below
+    data = pd.DataFrame(records[:-1])
+else:
+    data = pd.read_csv('data_for_model.csv')
 
 new_candle = fetch_latest_candle()
 new_data = pd.DataFrame(new_candle)
 
 # Only calculate new metrics for the new data
-new_data['RSI'] = ta.momentum.rsi(pd.concat([data['Close'].iloc[-15:], new_data['Close']]), window=14, fillna=True).iloc[-1]
+new_data['RSI'] = indicators.rsi(pd.concat([data['Close'].iloc[-15:], new_data['Close']]).values, window=14)[-1]
 new_data['MA_22'] = data['Close'].rolling(window=22).mean().iloc[-1]
 new_data['MA_50'] = data['Close'].rolling(window=50).mean().iloc[-1]
-new_data['ATR'] = ta.volatility.average_true_range(pd.concat([data['High'].iloc[-15:], new_data['High']]),
-                                                   pd.concat([data['Low'].iloc[-15:], new_data['Low']]),
-                                                   pd.concat([data['Close'].iloc[-15:], new_data['Close']]), window=14, fillna=True).iloc[-1]
+new_data['ATR'] = indicators.atr(pd.concat([data['High'].iloc[-15:], new_data['High']]).values,
+                                 pd.concat([data['Low'].iloc[-15:], new_data['Low']]).values,
+                                 pd.concat([data['Close'].iloc[-15:], new_data['Close']]).values, window=14)[-1]
 
 
 all_price_levels = pd.concat([data['Low'], data['High'], new_data['Low'], new_data['High']]).apply(lambda x: np.arange(np.floor(x), np.ceil(x) + 1))
@@ -0,0 +1,41 @@
+import time
+
+import governor
+
+BASE_URL = "https://api.binance.com"
+KLINES_URL = BASE_URL + "/api/v3/klines"
+# /api/v3/klines request weight
+KLINES_WEIGHT = 2
+
+# what "now" is for deciding which candles closed, a cassette replay moves it to the recorded time
+clock = time.time
+
+
+def now_ms():
+    return int(clock() * 1000)
+
+
+def fetch_data(symbol, interval, limit=700):
+    params = {
+        "symbol": symbol,
+        "interval": interval,
+        "limit": limit,
+    }
+    response = governor.get_governor().get(KLINES_URL, params=params, weight=KLINES_WEIGHT)
+    data = response.json()
+    return data
+
+
+def fetch_range(symbol, interval, start_ms, end_ms, limit=1000, base_url=BASE_URL):
+    params = {
+        "symbol": symbol,
+        "interval": interval,
+        "startTime": int(start_ms),
+        "endTime": int(end_ms),
+        "limit": limit,
+    }
+    response = governor.get_governor().get(
+        base_url + "/api/v3/klines", params=params, weight=KLINES_WEIGHT
+    )
+    response.raise_for_status()
+    return response.json()
@@ -0,0 +1,193 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# orderListId of orders that are not part of an OCO
+NO_LIST = -1
+# exchange error for an order that is already filled or cancelled
+UNKNOWN_ORDER = -2011
+DONE_STATUSES = ("FILLED", "CANCELED", "EXPIRED", "REJECTED")
+
+
+class OpenOrderBook:
+    """
+    Open orders and OCO lists per symbol, kept locally so flattening a symbol
+    does not start by listing its orders one REST call at a time.
+
+    `sync` loads what is open on the exchange, `record` adds what was just
+    placed and `forget` drops what filled or was cancelled elsewhere.
+    """
+
+    def __init__(self, client, margin=True, workers=8):
+        self.client = client
+        self.margin = margin
+        self.workers = workers
+        # orderId -> order, orderListId -> {"symbol": ..., "orderIds": [...]}
+        self.orders = {}
+        self.lists = {}
+        self.lock = threading.Lock()
+
+    def sync(self, symbol=None):
+        if self.margin:
+            orders = self.client.get_open_margin_orders(**_symbol_param(symbol))
+            # cross margin only lists OCOs for every symbol at once
+            lists = self.client.get_open_margin_oco_orders()
+        else:
+            orders = self.client.get_open_orders(**_symbol_param(symbol))
+            lists = self.client.get_open_oco_orders()
+        with self.lock:
+            self._drop(symbol)
+            for order_list in lists:
+                if symbol is None or order_list["symbol"] == symbol:
+                    self._add_list(order_list)
+            for order in orders:
+                self.orders[order["orderId"]] = order
+        return self
+
+    def record(self, response):
+        """Track an order or OCO placement response."""
+        if response is None:
+            return
+        with self.lock:
+            if response.get("orderListId", NO_LIST) != NO_LIST and "orders" in response:
+                self._add_list(response)
+                for report in response.get("orderReports", response["orders"]):
+                    if report.get("status") not in DONE_STATUSES:
+                        self.orders[report["orderId"]] = dict(
+                            report, orderListId=response["orderListId"]
+                        )
+            elif response.get("status") not in DONE_STATUSES:
+                self.orders[response["orderId"]] = response
+
+    def forget(self, order_id=None, order_list_id=None):
+        with self.lock:
+            order = self.orders.pop(order_id, None)
+            if order_list_id is None and order is not None:
+                order_list_id = order.get("orderListId", NO_LIST)
+            # a fill or cancel of one leg ends the whole list
+            order_list = self.lists.pop(order_list_id, None)
+            for leg in order_list["orderIds"] if order_list else []:
+                self.orders.pop(leg, None)
+
+    def open_orders(self, symbol):
+        with self.lock:
+            return [order for order in self.orders.values() if order["symbol"] == symbol]
+
+    def oco_lists(self, symbol):
+        with self.lock:
+            return {
+                list_id: order_list
+                for list_id, order_list in self.lists.items()
+                if order_list["symbol"] == symbol
+            }
+
+    def cancel(self, symbol, order_id=None, order_list_id=None):
+        """
+        Cancel one OCO list, or one standalone order when no list is given,
+        leaving the rest of the symbol's orders alone. Returns the cancel
+        response, None when it was already gone or failed.
+        """
+        if order_list_id is not None and order_list_id != NO_LIST:
+            with self.lock:
+                order_list = self.lists.get(order_list_id)
+            legs = order_list["orderIds"] if order_list else [order_id]
+            return self._cancel_list(symbol, order_list_id, legs)
+        return self._cancel_order(symbol, order_id)
+
+    def flatten(self, symbol, bulk=True):
+        """
+        Cancel everything open on `symbol`: one cancel-all request when the
+        client has it, otherwise one request per OCO list and per standalone
+        order, sent concurrently. Returns the cancel responses.
+
+        The cancel-all request is sent even when the local book is empty, it
+        also catches orders placed before a restart. When it fails the book
+        is synced first, so the one-by-one cancels see those orders too.
+        """
+        cancel_all = getattr(
+            self.client,
+            "cancel_all_open_margin_orders" if self.margin else "cancel_all_open_orders",
+            None,
+        )
+        if bulk and cancel_all is not None:
+            try:
+                cancelled = cancel_all(symbol=symbol)
+                with self.lock:
+                    self._drop(symbol)
+                logging.info("Cancelled %s open orders on %s at once.", len(cancelled), symbol)
+                return cancelled
+            except Exception as e:
+                if getattr(e, "code", None) == UNKNOWN_ORDER:
+                    # nothing open on the symbol
+                    with self.lock:
+                        self._drop(symbol)
+                    return []
+                logging.warning("Cancel-all failed on %s (%s), cancelling one by one.", symbol, e)
+                try:
+                    self.sync(symbol)
+                except Exception as e:
+                    logging.warning("Could not sync the open orders on %s: %s", symbol, e)
+
+        lists = self.oco_lists(symbol)
+        standalone = [
+            order
+            for order in self.open_orders(symbol)
+            if order.get("orderListId", NO_LIST) not in lists
+        ]
+        if not lists and not standalone:
+            return []
+
+        tasks = [
+            (self._cancel_list, symbol, list_id, order_list["orderIds"])
+            for list_id, order_list in lists.items()
+        ]
+        tasks += [(self._cancel_order, symbol, order["orderId"]) for order in standalone]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(tasks))) as executor:
+            futures = [executor.submit(*task) for task in tasks]
+            results = [future.result() for future in futures]
+        cancelled = [result for result in results if result is not None]
+        logging.info("Cancelled %s of %s orders and OCO lists on %s.", len(cancelled), len(tasks), symbol)
+        return cancelled
+
+    def _cancel_list(self, symbol, list_id, legs):
+        try:
+            if self.margin:
+                response = self.client.cancel_margin_oco_order(symbol=symbol, orderListId=list_id)
+            else:
+                # cancelling one leg cancels the whole list
+                response = self.client.cancel_order(symbol=symbol, orderId=legs[0])
+        except Exception as e:
+            if getattr(e, "code", None) != UNKNOWN_ORDER:
+                logging.error("Failed to cancel OCO list %s on %s: %s", list_id, symbol, e)
+                return None
+            response = None
+        self.forget(order_list_id=list_id)
+        return response
+
+    def _cancel_order(self, symbol, order_id):
+        cancel = self.client.cancel_margin_order if self.margin else self.client.cancel_order
+        try:
+            response = cancel(symbol=symbol, orderId=order_id)
+        except Exception as e:
+            if getattr(e, "code", None) != UNKNOWN_ORDER:
+                logging.error("Failed to cancel order %s on %s: %s", order_id, symbol, e)
+                return None
+            response = None
+        self.forget(order_id=order_id)
+        return response
+
+    def _add_list(self, order_list):
+        self.lists[order_list["orderListId"]] = {
+            "symbol": order_list["symbol"],
+            "orderIds": [leg["orderId"] for leg in order_list["orders"]],
+        }
+
+    def _drop(self, symbol):
+        for list_id in [k for k, v in self.lists.items() if symbol in (None, v["symbol"])]:
+            del self.lists[list_id]
+        for order_id in [k for k, v in self.orders.items() if symbol in (None, v["symbol"])]:
+            del self.orders[order_id]
+
+
+def _symbol_param(symbol):
+    return {} if symbol is None else {"symbol": symbol}
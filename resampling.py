@@ -0,0 +1,232 @@
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import schema
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "3m": 3 * 60_000,
+    "5m": 5 * 60_000,
+    "15m": 15 * 60_000,
+    "30m": 30 * 60_000,
+    "1h": 60 * 60_000,
+    "2h": 2 * 60 * 60_000,
+    "4h": 4 * 60 * 60_000,
+    "1d": 24 * 60 * 60_000,
+}
+
+BASE_INTERVAL = "5m"
+DERIVED_INTERVALS = ["15m", "1h", "4h"]
+
+# volume-like columns are summed when base candles are folded into a bar
+SUM_COLUMNS = ["Volume", "Quote Asset Volume", "Number of Trades"]
+
+
+def klines_to_frame(data):
+    if isinstance(data, pd.DataFrame):
+        # already parsed, e.g. by ingest
+        return data
+    return schema.candles_from_klines(data)
+
+
+# same shape the scheduler always wrote: local (UTC+2) datetime open times
+OUTPUT_OFFSET = pd.Timedelta(hours=2)
+
+
+def output_time(open_ms):
+    return pd.to_datetime(open_ms, unit="ms") + OUTPUT_OFFSET
+
+
+def open_ms(output_times):
+    """The exchange's open times in ms back from output_time values."""
+    times = np.asarray(output_times, dtype="M8[ns]") - OUTPUT_OFFSET.to_timedelta64()
+    return times.astype("M8[ms]").astype(np.int64)
+
+
+def to_output_frame(df):
+    out = schema.apply_candle_schema(df)
+    out["Open Time"] = output_time(out["Open Time"])
+    return out.reset_index(drop=True)
+
+
+def aggregate_bucket(rows, bucket_start, interval_ms):
+    bar = {
+        "Open Time": bucket_start,
+        "Open": rows["Open"].iloc[0],
+        "High": rows["High"].max(),
+        "Low": rows["Low"].min(),
+        "Close": rows["Close"].iloc[-1],
+        "Close Time": bucket_start + interval_ms - 1,
+    }
+    for column in SUM_COLUMNS:
+        bar[column] = rows[column].sum()
+    return bar
+
+
+class CandleResampler:
+    """
+    Keeps the base interval candles of one symbol and derives the higher
+    intervals from them, touching only the buckets that received new candles.
+    """
+
+    def __init__(
+        self,
+        symbol,
+        base_interval=BASE_INTERVAL,
+        intervals=DERIVED_INTERVALS,
+        max_bars=1000,
+    ):
+        self.symbol = symbol
+        self.base_interval = base_interval
+        self.base_ms = INTERVAL_MS[base_interval]
+        self.intervals = list(intervals)
+        self.max_bars = max_bars
+        # enough base candles to rebuild the widest derived bucket
+        widest = max([INTERVAL_MS[i] for i in self.intervals] + [self.base_ms])
+        self.max_base_bars = max(max_bars, 2 * widest // self.base_ms)
+
+        self.base = klines_to_frame([])
+        self.forming = None
+        self.derived = {interval: klines_to_frame([]) for interval in self.intervals}
+        # base candles the exchange did not return yet, {(first, last): tries}
+        self.gaps = {}
+        self.lock = threading.Lock()
+
+    def seed(self, interval, klines, now_ms=None):
+        """Load history for a derived interval that predates the base candles."""
+        closed, _ = self._split_closed(klines_to_frame(klines), now_ms)
+        with self.lock:
+            self.derived[interval] = closed.tail(self.max_bars).reset_index(drop=True)
+
+    def last_open_time(self):
+        if self.base.empty:
+            return None
+        return int(self.base["Open Time"].iloc[-1])
+
+    def missing_bars(self, now_ms=None):
+        """How many base candles have to be fetched to catch up."""
+        now_ms = now_ms or int(time.time() * 1000)
+        last = self.last_open_time()
+        if last is None:
+            return self.max_base_bars
+        return int((now_ms - last) // self.base_ms) + 1
+
+    def update(self, klines, now_ms=None):
+        frame, forming = self._split_closed(klines_to_frame(klines), now_ms)
+        with self.lock:
+            last = self.last_open_time()
+            new = frame if last is None else frame[frame["Open Time"] > last]
+            if forming is not None:
+                self.forming = forming
+            if new.empty:
+                return new
+
+            self.base = pd.concat([self.base, new], ignore_index=True)
+            self.base = self.base.tail(self.max_base_bars).reset_index(drop=True)
+            first = self.base["Open Time"].iloc[0]
+            self.gaps = {gap: tries for gap, tries in self.gaps.items() if gap[1] >= first}
+            if self.forming is not None and (
+                self.forming["Open Time"].iloc[0] <= self.base["Open Time"].iloc[-1]
+            ):
+                self.forming = None
+
+            for interval in self.intervals:
+                self._update_interval(interval, new["Open Time"].values)
+            return new
+
+    def repair(self, candles):
+        """
+        Insert the closed base candles of `candles` that are missing inside
+        the history and rebuild the derived bars they belong to. Returns
+        the open times inserted.
+        """
+        with self.lock:
+            if self.base.empty:
+                return np.array([], dtype=np.int64)
+            times = candles["Open Time"]
+            known = self.base["Open Time"]
+            rows = candles[
+                (times > known.iloc[0]) & (times < known.iloc[-1]) & ~times.isin(known.values)
+            ]
+            if rows.empty:
+                return np.array([], dtype=np.int64)
+            self.base = pd.concat([self.base, rows], ignore_index=True)
+            self.base = self.base.sort_values("Open Time", kind="stable").reset_index(drop=True)
+            for interval in self.intervals:
+                self._update_interval(interval, rows["Open Time"].values)
+            return rows["Open Time"].values
+
+    def frame(self, interval):
+        """Closed bars for the interval plus the still-forming one, like the exchange returns."""
+        with self.lock:
+            if interval == self.base_interval:
+                rows = self.base
+                if self.forming is not None:
+                    rows = pd.concat([rows, self.forming], ignore_index=True)
+                return to_output_frame(rows)
+
+            closed = self.derived[interval]
+            forming = self._forming_bar(interval)
+            if forming is not None:
+                closed = pd.concat([closed, pd.DataFrame([forming])], ignore_index=True)
+            return to_output_frame(closed)
+
+    def _split_closed(self, frame, now_ms=None):
+        now_ms = now_ms or int(time.time() * 1000)
+        is_closed = frame["Close Time"] < now_ms
+        forming = frame[~is_closed].tail(1)
+        forming = forming if not forming.empty else None
+        return frame[is_closed].reset_index(drop=True), forming
+
+    def _update_interval(self, interval, new_open_times):
+        interval_ms = INTERVAL_MS[interval]
+        per_bucket = interval_ms // self.base_ms
+        derived = self.derived[interval]
+        opens = self.base["Open Time"].values
+        last_close = int(self.base["Close Time"].iloc[-1])
+
+        bars = []
+        for bucket in sorted(set(int(t) // interval_ms * interval_ms for t in new_open_times)):
+            if bucket + interval_ms - 1 > last_close:
+                # still forming, built on demand in frame()
+                continue
+            start, end = opens.searchsorted([bucket, bucket + interval_ms])
+            rows = self.base.iloc[start:end]
+            if rows.empty:
+                # already trimmed off the history
+                continue
+            already_known = not derived.empty and bucket <= derived["Open Time"].iloc[-1]
+            if len(rows) < per_bucket:
+                if already_known:
+                    continue
+                logging.info(
+                    "%s %s bar at %s built from %s/%s base candles.",
+                    self.symbol, interval, bucket, len(rows), per_bucket,
+                )
+            if already_known:
+                derived = derived[derived["Open Time"] != bucket]
+            bars.append(aggregate_bucket(rows, bucket, interval_ms))
+
+        if bars:
+            derived = pd.concat([derived, pd.DataFrame(bars)], ignore_index=True)
+            derived = derived.sort_values("Open Time").tail(self.max_bars)
+            self.derived[interval] = derived.reset_index(drop=True)
+
+    def _forming_bar(self, interval):
+        interval_ms = INTERVAL_MS[interval]
+        rows = self.base
+        if self.forming is not None:
+            rows = pd.concat([rows, self.forming], ignore_index=True)
+        if rows.empty:
+            return None
+        bucket = int(rows["Open Time"].iloc[-1]) // interval_ms * interval_ms
+        if not self.derived[interval].empty and (
+            bucket <= self.derived[interval]["Open Time"].iloc[-1]
+        ):
+            return None
+        rows = rows[rows["Open Time"] >= bucket]
+        return aggregate_bucket(rows, bucket, interval_ms)
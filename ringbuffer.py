@@ -0,0 +1,90 @@
+import numpy as np
+
+import schema
+
+
+def ring_dtype():
+    # OHLCV plus every feature column, one fixed-size record per candle
+    fields = [("Open Time", "M8[ns]")]
+    for column in ["Open", "High", "Low", "Close", "Volume"]:
+        fields.append((column, schema.CANDLE_DTYPES[column]))
+    for column, dtype in schema.FEATURE_DTYPES.items():
+        if column not in dict(fields):
+            fields.append((column, dtype))
+    return np.dtype(fields)
+
+
+RING_DTYPE = ring_dtype()
+
+
+class CandleRingBuffer:
+    """
+    Fixed-capacity record buffer for one symbol/interval.
+
+    Every slot is written twice, at `i` and `i + capacity`, so the last `n`
+    records are always one contiguous slice and window() can hand out views
+    instead of copies. Memory is allocated once and never grows.
+    """
+
+    def __init__(self, capacity=1000, dtype=RING_DTYPE):
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=dtype)
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def last_time(self):
+        if self.size == 0:
+            return None
+        return self.data[self.head - 1 + self.capacity]["Open Time"]
+
+    def append(self, records):
+        records = np.atleast_1d(records)[-self.capacity :]
+        slots = (self.head + np.arange(len(records))) % self.capacity
+        self.data[slots] = records
+        self.data[slots + self.capacity] = records
+        self.head = (self.head + len(records)) % self.capacity
+        self.size = min(self.size + len(records), self.capacity)
+
+    def replace_last(self, record):
+        slot = (self.head - 1) % self.capacity
+        self.data[slot] = record
+        self.data[slot + self.capacity] = record
+
+    def window(self, n=None):
+        """The last `n` records (all of them by default) as a view, oldest first."""
+        n = self.size if n is None else min(n, self.size)
+        start = (self.head - n) % self.capacity
+        return self.data[start : start + n]
+
+    def truncate(self, time):
+        """Drop the records from `time` on, the next push_frame writes them again."""
+        window = self.window()
+        keep = int(np.searchsorted(window["Open Time"], np.datetime64(time, "ns")))
+        dropped = self.size - keep
+        self.head = (self.head - dropped) % self.capacity
+        self.size = keep
+        return dropped
+
+    def push_frame(self, frame):
+        """
+        Store the rows of `frame` from the last known candle on: the candle
+        that was still forming last time is overwritten, newer ones appended.
+        """
+        times = frame["Open Time"].values.astype("M8[ns]")
+        last = self.last_time()
+        start = 0 if last is None else int(np.searchsorted(times, last))
+        if start >= len(times):
+            return 0
+        records = np.zeros(len(times) - start, dtype=self.data.dtype)
+        for column in self.data.dtype.names:
+            if column in frame:
+                records[column] = frame[column].values[start:]
+        if last is not None and times[start] == last:
+            self.replace_last(records[0])
+            records = records[1:]
+        if len(records):
+            self.append(records)
+        return len(records)
@@ -0,0 +1,166 @@
+import numpy as np
+
+
+class Expr:
+    """A boolean or numeric column over the symbols of a FeatureMatrix, built lazily."""
+
+    def __init__(self, evaluate, label):
+        self.evaluate = evaluate
+        self.label = label
+
+    def _combine(self, other, op, label):
+        other = other if isinstance(other, Expr) else constant(other)
+        return Expr(
+            lambda matrix: op(self.evaluate(matrix), other.evaluate(matrix)),
+            f"({self.label} {label} {other.label})",
+        )
+
+    def __and__(self, other):
+        return self._combine(other, np.logical_and, "and")
+
+    def __or__(self, other):
+        return self._combine(other, np.logical_or, "or")
+
+    def __invert__(self):
+        return Expr(lambda matrix: ~self.evaluate(matrix).astype(bool), f"not {self.label}")
+
+    def __gt__(self, other):
+        return self._combine(other, np.greater, ">")
+
+    def __ge__(self, other):
+        return self._combine(other, np.greater_equal, ">=")
+
+    def __lt__(self, other):
+        return self._combine(other, np.less, "<")
+
+    def __le__(self, other):
+        return self._combine(other, np.less_equal, "<=")
+
+    def __eq__(self, other):
+        return self._combine(other, np.equal, "==")
+
+    def __ne__(self, other):
+        return self._combine(other, np.not_equal, "!=")
+
+    __hash__ = None
+
+    def __repr__(self):
+        return self.label
+
+
+def constant(value):
+    return Expr(lambda matrix: np.full(len(matrix.symbols), value), repr(value))
+
+
+def feature(name):
+    """Value of `name` on the last (still forming) candle."""
+    return Expr(lambda matrix: matrix.column(name), name)
+
+
+def prev(name):
+    """Value of `name` on the candle before the last one."""
+    return Expr(lambda matrix: matrix.column("prev " + name), f"prev {name}")
+
+
+def symbol_in(*symbols):
+    return Expr(lambda matrix: np.isin(matrix.symbols, symbols), f"symbol in {symbols}")
+
+
+class Rule:
+    def __init__(self, reason, side, condition, intervals=None, data_interval=None):
+        self.reason = reason
+        self.side = side
+        self.condition = condition
+        # jobs the rule runs in (None: all of them)
+        self.intervals = intervals
+        # the interval whose candles the rule reads, the job's own by default
+        self.data_interval = data_interval
+
+    def applies_to(self, interval):
+        return self.intervals is None or interval in self.intervals
+
+    def __repr__(self):
+        return f"Rule({self.side} {self.reason}: {self.condition})"
+
+
+class FeatureMatrix:
+    """
+    symbols x features for one interval: the last and the previous candle of
+    every symbol as aligned columns, plus any extra per-symbol columns.
+    """
+
+    def __init__(self, symbols, columns):
+        self.symbols = np.asarray(symbols)
+        self.columns = columns
+
+    @classmethod
+    def from_windows(cls, windows, extra=None):
+        """`windows` maps symbol -> its last two candle records (oldest first)."""
+        symbols = [symbol for symbol, window in windows.items() if len(window) >= 2]
+        columns = {}
+        if symbols:
+            # ring buffer windows and csv fallbacks carry different dtypes, keep the shared columns
+            names = set.intersection(*(set(windows[symbol].dtype.names) for symbol in symbols))
+            for name in names:
+                pairs = np.array([windows[symbol][-2:][name] for symbol in symbols])
+                columns[name] = pairs[:, 1]
+                columns["prev " + name] = pairs[:, 0]
+        for name, values in (extra or {}).items():
+            columns[name] = np.array([values.get(symbol, np.nan) for symbol in symbols], dtype=float)
+        return cls(symbols, columns)
+
+    def column(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+def by_data_interval(rules, interval):
+    """Rules that run in the `interval` job, grouped by the interval they read."""
+    groups = {}
+    for rule in rules:
+        if rule.applies_to(interval):
+            groups.setdefault(rule.data_interval or interval, []).append(rule)
+    return groups
+
+
+def evaluate(rules, matrix, interval=None):
+    """All triggered (symbol, side, reason) actions, rules in order."""
+    actions = []
+    if len(matrix) == 0:
+        return actions
+    for rule in rules:
+        if interval is not None and not rule.applies_to(interval):
+            continue
+        triggered = np.asarray(rule.condition.evaluate(matrix), dtype=bool)
+        actions += [(symbol, rule.side, rule.reason) for symbol in matrix.symbols[triggered]]
+    return actions
+
+
+PRIOR_DIVERGENCE = (prev("bullish_divergence") == 1) | (prev("bearish_divergence") == 1)
+NOT_BTC = ~symbol_in("BTCUSDT", "WBTCUSDT")
+NOT_15M = ("5m", "1h", "4h")
+
+# the divergence and rsi-extreme signals and the flags in find_trend
+DEFAULT_RULES = [
+    Rule("bearish divergence", "short", PRIOR_DIVERGENCE & (feature("RSI") > 75), intervals=("15m",)),
+    Rule("bullish divergence", "long", PRIOR_DIVERGENCE & (feature("RSI") < 25), intervals=("15m",)),
+    Rule("bearish divergence", "short", PRIOR_DIVERGENCE & (feature("RSI") > 70), intervals=NOT_15M),
+    Rule("bullish divergence", "long", PRIOR_DIVERGENCE & (feature("RSI") < 30), intervals=NOT_15M),
+    Rule("rsi above 85", "short", (feature("RSI") > 85) & NOT_BTC),
+    Rule("rsi below 15", "long", (feature("RSI") < 15) & NOT_BTC),
+    # in_consolidation and flag_reference come from the SwingIndex, see SwingIndex.flag
+    Rule(
+        "bull_flag",
+        "long",
+        (feature("in_consolidation") == 1) & (prev("Close") > feature("flag_reference")),
+        data_interval="1h",
+    ),
+    Rule(
+        "bear_flag",
+        "short",
+        (feature("in_consolidation") == 1) & (prev("Close") < feature("flag_reference")),
+        data_interval="1h",
+    ),
+]
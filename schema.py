@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+import trade_logging
+
+# Column order of the /api/v3/klines payload
+KLINE_COLUMNS = [
+    "Open Time",
+    "Open",
+    "High",
+    "Low",
+    "Close",
+    "Volume",
+    "Close Time",
+    "Quote Asset Volume",
+    "Number of Trades",
+    "Taker Buy Base Asset Volume",
+    "Taker Buy Quote Asset Volume",
+    "Ignore",
+]
+
+# Prices stay float64: float32 only keeps ~7 significant digits, which is
+# below the tick size of the large caps (BTC at 60000.01) and would round
+# stops and targets. Volumes and derived features are fine in float32.
+CANDLE_DTYPES = {
+    "Open Time": "int64",
+    "Open": "float64",
+    "High": "float64",
+    "Low": "float64",
+    "Close": "float64",
+    "Volume": "float32",
+    "Close Time": "int64",
+    "Quote Asset Volume": "float32",
+    "Number of Trades": "int32",
+}
+CANDLE_COLUMNS = list(CANDLE_DTYPES)
+
+# extrema, medium_extrema and big_extrema share these codes, the column says
+# which scale: EXTREMA_HIGH in big_extrema is the old "big_high" string
+EXTREMA_NONE = 0
+EXTREMA_HIGH = 1
+EXTREMA_LOW = -1
+EXTREMA_LABELS = {EXTREMA_NONE: None, EXTREMA_HIGH: "high", EXTREMA_LOW: "low"}
+# label prefix of each extrema column in the string-valued CSVs
+EXTREMA_SCALES = {"extrema": "", "medium_extrema": "medium_", "big_extrema": "big_"}
+
+
+def extrema_label(column, code):
+    """The string an extrema column held before the int8 codes, None for no extremum."""
+    label = EXTREMA_LABELS[int(code)]
+    return None if label is None else EXTREMA_SCALES[column] + label
+
+
+FEATURE_DTYPES = {
+    "Volume": "float32",
+    "Open": "float64",
+    "Close": "float64",
+    "ATR": "float32",
+    "RSI": "float32",
+    "MA_22": "float32",
+    "MA_50": "float32",
+    "bullish_divergence": "int8",
+    "bearish_divergence": "int8",
+    "extrema": "int8",
+    "big_extrema": "int8",
+    "medium_extrema": "int8",
+    "Mean ATR": "float32",
+    "consolidated": "int8",
+}
+FEATURE_COLUMNS = ["Open Time"] + list(FEATURE_DTYPES)
+
+
+def candles_from_klines(data):
+    """Parse the klines payload once into typed columns, dropping the unused ones."""
+    frame = pd.DataFrame(data, columns=KLINE_COLUMNS)
+    return frame[CANDLE_COLUMNS].astype(CANDLE_DTYPES)
+
+
+def apply_candle_schema(frame):
+    dtypes = dict(CANDLE_DTYPES)
+    if not np.issubdtype(frame["Open Time"].dtype, np.integer):
+        # already converted to datetimes for output
+        del dtypes["Open Time"]
+    return frame[CANDLE_COLUMNS].astype(dtypes)
+
+
+def apply_feature_schema(frame):
+    frame = frame[FEATURE_COLUMNS]
+    return frame.astype(FEATURE_DTYPES)
+
+
+def read_candles(file_path):
+    dtypes = {k: v for k, v in CANDLE_DTYPES.items() if k != "Open Time"}
+    return pd.read_csv(file_path, usecols=CANDLE_COLUMNS, dtype=dtypes)
+
+
+def read_features(file_path):
+    return pd.read_csv(
+        file_path,
+        usecols=FEATURE_COLUMNS,
+        dtype=FEATURE_DTYPES,
+        parse_dates=["Open Time"],
+    )
+
+
+def memory_report(frame, name, sample_every=12):
+    """Frame size per column, logged for one in `sample_every` calls per frame name."""
+    usage = frame.memory_usage(deep=True, index=False)
+    total = int(usage.sum())
+    trade_logging.log_event(
+        "memory",
+        sample_every=sample_every,
+        sample_key=name,
+        frame=name,
+        rows=len(frame),
+        kib=round(total / 1024, 1),
+        columns=usage.to_dict(),
+    )
+    return total
@@ -0,0 +1,450 @@
+import argparse
+import collections
+import functools
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+import indicators
+import resampling
+from candle_store import STORE_DIR, CandleStore
+
+# candles per pattern
+WINDOW = 50
+CHANNELS = ["Close", "RSI", "ATR"]
+# piecewise means per channel in a sketch
+SEGMENTS = 10
+CELLS = 256
+PROBES = 8
+# candles after a match its forward return is measured over
+HORIZON = 12
+# windows sketched per step, bounds the memory of a full history build
+CHUNK = 16384
+
+Match = collections.namedtuple("Match", ["symbol", "time", "distance", "forward_return"])
+
+
+class Growable:
+    """Append-only array that doubles its capacity, `view` is the filled part."""
+
+    def __init__(self, shape=(), dtype=np.float64, capacity=1024):
+        self.data = np.empty((capacity,) + tuple(shape), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        needed = self.size + len(values)
+        if needed > len(self.data):
+            grown = np.empty((max(needed, 2 * len(self.data)),) + self.data.shape[1:], self.data.dtype)
+            grown[: self.size] = self.data[: self.size]
+            self.data = grown
+        self.data[self.size : needed] = values
+        self.size = needed
+
+    def view(self):
+        return self.data[: self.size]
+
+    def keep(self, mask):
+        """Drop the elements where `mask` is False, in place."""
+        kept = self.view()[mask]
+        self.data[: len(kept)] = kept
+        self.size = len(kept)
+
+
+class Cell:
+    """The windows filed under one k-means centroid: ids, sketches and squared sketch norms side by side."""
+
+    def __init__(self, dimensions):
+        self.ids = Growable((), np.int64)
+        self.sketches = Growable((dimensions,), np.float32)
+        self.norms = Growable((), np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, ids, sketches):
+        self.ids.extend(ids)
+        self.sketches.extend(sketches)
+        self.norms.extend((sketches.astype(np.float64) ** 2).sum(axis=1))
+
+    def keep(self, mask):
+        for values in (self.ids, self.sketches, self.norms):
+            values.keep(mask)
+
+
+def locked(method):
+    """Run an index method holding the index's lock."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def znormalize(windows):
+    """(windows, window, channels) z-normalized per window and channel, flat channels left at 0."""
+    windows = np.asarray(windows, dtype=np.float64)
+    mean = windows.mean(axis=1, keepdims=True)
+    std = windows.std(axis=1, keepdims=True)
+    return (windows - mean) / np.where(std > 0, std, 1.0)
+
+
+def sketch(normalized, segments=SEGMENTS):
+    """
+    Piecewise aggregate approximation: the mean of each of `segments` equal
+    parts of a z-normalized window, per channel. Scaled so sketch distances
+    never exceed the full ones.
+    """
+    count, window, channels = normalized.shape
+    parts = normalized[:, : window - window % segments].reshape(count, segments, -1, channels)
+    scale = np.sqrt(window // segments)
+    return (parts.mean(axis=2) * scale).reshape(count, -1).astype(np.float32)
+
+
+def channels(high, low, close):
+    """(candles, CHANNELS) series the patterns are matched on."""
+    return np.column_stack(
+        [close, indicators.rsi(close), indicators.atr(high, low, close)]
+    ).astype(np.float32)
+
+
+class SimilarityIndex:
+    """
+    Every `window`-candle stretch of every symbol's history, searchable for
+    the ones shaped most like a query.
+
+    Windows are z-normalized per channel, so a match is about shape, not
+    price level. Each is reduced to a small PAA sketch, and the sketches are
+    filed into `cells` k-means cells once there are enough of them, each
+    cell's sketches stored contiguously. A query scans the sketches of its
+    `probes` nearest cells only, one matrix-vector product each, then
+    reranks the closest few hundred on their full z-normalized distance.
+    Candles added later are sketched and filed into their cell on arrival,
+    without touching the rest.
+
+    Updates and queries hold `lock`, so the live loop can add candles while
+    another thread queries.
+
+    With `interval_ms`, a symbol's candles are split into runs wherever a
+    candle does not open one interval after the previous one. No window and
+    no forward return spans two runs.
+    """
+
+    def __init__(
+        self,
+        window=WINDOW,
+        segments=SEGMENTS,
+        cells=CELLS,
+        probes=PROBES,
+        horizon=HORIZON,
+        interval_ms=None,
+    ):
+        self.window = window
+        self.segments = segments
+        self.cells = cells
+        self.probes = probes
+        self.horizon = horizon
+        self.interval_ms = interval_ms
+        self.lock = threading.RLock()
+        self.symbols = []
+        self.index = {}
+        self.values = []
+        self.times = []
+        # per symbol, the position of the first candle of every run
+        self.runs = []
+        self.dimensions = segments * len(CHANNELS)
+        # the symbol and the position of the last candle of every window
+        self.owners = Growable((), np.int32)
+        self.positions = Growable((), np.int64)
+        self.centroids = None
+        # a single cell holds everything until train()
+        self.members = [Cell(self.dimensions)]
+
+    def __len__(self):
+        return len(self.owners)
+
+    def _symbol(self, symbol):
+        if symbol not in self.index:
+            self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            self.values.append(Growable((len(CHANNELS),), np.float32))
+            self.times.append(Growable((), np.int64))
+            self.runs.append(np.zeros(1, dtype=np.int64))
+        return self.index[symbol]
+
+    @locked
+    def last_time(self, symbol):
+        i = self.index.get(symbol)
+        if i is None or len(self.times[i]) == 0:
+            return None
+        return int(self.times[i].view()[-1])
+
+    @locked
+    def extend(self, symbol, times, values):
+        """Append closed candles (open times in ms, CHANNELS values) of a symbol, returns the windows added."""
+        i = self._symbol(symbol)
+        series = self.values[i]
+        old = len(series)
+        times = np.asarray(times, dtype=np.int64)
+        if self.interval_ms is not None and len(times):
+            previous = self.times[i].view()[-1:]
+            steps = np.diff(np.concatenate([previous, times]))
+            breaks = np.flatnonzero(steps != self.interval_ms) + old + (1 - len(previous))
+            if len(breaks):
+                logging.info("%s breaks in the candles of %s, no window spans them.", len(breaks), symbol)
+                self.runs[i] = np.concatenate([self.runs[i], breaks])
+        series.extend(values)
+        self.times[i].extend(times)
+        # every position a window can end at: window - 1 candles into its run
+        ends = np.arange(old, len(series))
+        run_starts = self.runs[i][np.searchsorted(self.runs[i], ends, side="right") - 1]
+        ends = ends[ends - run_starts >= self.window - 1]
+        if len(ends) == 0:
+            return 0
+        views = np.lib.stride_tricks.sliding_window_view(series.view(), self.window, axis=0).swapaxes(1, 2)
+        for start in range(0, len(ends), CHUNK):
+            chunk = ends[start : start + CHUNK]
+            sketches = sketch(znormalize(views[chunk - self.window + 1]), self.segments)
+            ids = np.arange(len(self), len(self) + len(sketches))
+            self.owners.extend(np.full(len(sketches), i))
+            self.positions.extend(chunk)
+            self._file(ids, sketches)
+        return len(ends)
+
+    @locked
+    def truncate(self, symbol, since):
+        """
+        Forget the candles of `symbol` opening at `since` (ms) or later and
+        every window holding one, so they can be added again once repaired.
+        Returns the candles dropped.
+        """
+        i = self.index.get(symbol)
+        if i is None:
+            return 0
+        cut = int(np.searchsorted(self.times[i].view(), since))
+        dropped = len(self.times[i]) - cut
+        if dropped == 0:
+            return 0
+        owners, positions = self.owners.view(), self.positions.view()
+        for cell in self.members:
+            ids = cell.ids.view()
+            stale = (owners[ids] == i) & (positions[ids] >= cut)
+            if stale.any():
+                cell.keep(~stale)
+        # the ids of the dropped windows stay unused in owners and positions
+        self.values[i].keep(np.arange(len(self.values[i])) < cut)
+        self.times[i].keep(np.arange(len(self.times[i])) < cut)
+        runs = self.runs[i]
+        self.runs[i] = np.concatenate([runs[:1], runs[1:][runs[1:] < cut]])
+        return dropped
+
+    @locked
+    def push_buffers(self, buffers):
+        """Add the candles that closed since the last call from the ring buffers (the last record is forming)."""
+        added = 0
+        for symbol, buffer in buffers.items():
+            if buffer is None or len(buffer) < 2:
+                continue
+            rows = buffer.window()[:-1]
+            times = resampling.open_ms(rows["Open Time"])
+            last = self.last_time(symbol)
+            if last is not None:
+                # a first new candle later than last + interval starts a new run in extend
+                new = times > last
+                rows, times = rows[new], times[new]
+            if len(rows):
+                values = np.column_stack([rows["Close"], rows["RSI"], rows["ATR"]])
+                added += self.extend(symbol, times, values)
+        if self.centroids is None and len(self) >= 40 * self.cells:
+            self.train()
+        return added
+
+    @locked
+    def train(self, iterations=10, sample=50_000, seed=0):
+        """k-means cells over a sample of the sketches, then every window filed into its cell."""
+        rng = np.random.default_rng(seed)
+        ids = np.concatenate([cell.ids.view() for cell in self.members])
+        sketches = np.concatenate([cell.sketches.view() for cell in self.members])
+        points = sketches[rng.choice(len(sketches), min(sample, len(sketches)), replace=False)]
+        centroids = points[rng.choice(len(points), self.cells, replace=False)]
+        for _ in range(iterations):
+            nearest = self._nearest(points, centroids, 1)[:, 0]
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, points)
+            counts = np.bincount(nearest, minlength=self.cells)[:, None]
+            centroids = np.where(counts > 0, sums / np.maximum(counts, 1), centroids)
+        self.centroids = centroids.astype(np.float32)
+        self.members = [Cell(self.dimensions) for _ in range(self.cells)]
+        for start in range(0, len(sketches), CHUNK):
+            stop = min(start + CHUNK, len(sketches))
+            self._file(ids[start:stop], sketches[start:stop])
+
+    @staticmethod
+    def _nearest(points, centroids, count):
+        distances = (
+            (centroids**2).sum(axis=1)[None, :] - 2 * points @ centroids.T
+        )
+        if count >= centroids.shape[0]:
+            return np.argsort(distances, axis=1)
+        nearest = np.argpartition(distances, count, axis=1)[:, :count]
+        order = np.take_along_axis(distances, nearest, axis=1).argsort(axis=1)
+        return np.take_along_axis(nearest, order, axis=1)
+
+    def _file(self, ids, sketches):
+        if self.centroids is None:
+            self.members[0].add(ids, sketches)
+            return
+        cells = self._nearest(sketches, self.centroids, 1)[:, 0]
+        order = np.argsort(cells, kind="stable")
+        cells, ids, sketches = cells[order], ids[order], sketches[order]
+        bounds = np.flatnonzero(np.diff(cells)) + 1
+        for start, stop in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(ids)]])):
+            self.members[cells[start]].add(ids[start:stop], sketches[start:stop])
+
+    def _candidates(self, query_sketch):
+        """Ids and sketch distances (up to a constant) of the windows in the probed cells."""
+        cells = self.members
+        if self.centroids is not None:
+            cells = [cells[c] for c in self._nearest(query_sketch[None, :], self.centroids, self.probes)[0]]
+        cells = [cell for cell in cells if len(cell)]
+        if not cells:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        ids = np.concatenate([cell.ids.view() for cell in cells])
+        distances = np.concatenate(
+            [cell.norms.view() - 2 * (cell.sketches.view() @ query_sketch) for cell in cells]
+        )
+        return ids, distances
+
+    def _windows(self, ids):
+        """Full z-normalized windows of the given window ids, flattened."""
+        owners = self.owners.view()[ids]
+        positions = self.positions.view()[ids]
+        out = np.empty((len(ids), self.window, len(CHANNELS)))
+        for owner in np.unique(owners):
+            mask = owners == owner
+            views = np.lib.stride_tricks.sliding_window_view(
+                self.values[owner].view(), self.window, axis=0
+            ).swapaxes(1, 2)
+            out[mask] = views[positions[mask] - self.window + 1]
+        return znormalize(out).reshape(len(ids), -1)
+
+    @locked
+    def query(self, values, k=10, exclude=None, rerank=256):
+        """
+        The `k` windows most like `values` (window x CHANNELS), closest
+        first and not overlapping each other. `exclude` is a (symbol, time)
+        whose own window and its neighbours are skipped.
+        """
+        values = np.asarray(values, dtype=np.float64)[-self.window :]
+        normalized = znormalize(values[None])
+        query_sketch = sketch(normalized, self.segments)[0]
+        query = normalized.reshape(-1)
+
+        ids, sketch_distances = self._candidates(query_sketch)
+        # room for the excluded neighbours of the query itself
+        keep = min(len(ids), max(rerank, 8 * k) + (2 * self.window if exclude else 0))
+        if keep < len(ids):
+            ids = ids[np.argpartition(sketch_distances, keep - 1)[:keep]]
+        if exclude is not None and exclude[0] in self.index:
+            owner = self.index[exclude[0]]
+            position = int(np.searchsorted(self.times[owner].view(), exclude[1]))
+            near = (self.owners.view()[ids] == owner) & (
+                np.abs(self.positions.view()[ids] - position) < self.window
+            )
+            ids = ids[~near]
+        if len(ids) == 0:
+            return []
+        distances = np.sqrt(((self._windows(ids) - query) ** 2).sum(axis=1))
+
+        matches = []
+        taken = []
+        for j in np.argsort(distances):
+            owner, position = int(self.owners.view()[ids[j]]), int(self.positions.view()[ids[j]])
+            if any(owner == o and abs(position - p) < self.window for o, p in taken):
+                continue
+            taken.append((owner, position))
+            matches.append(self._match(owner, position, float(distances[j])))
+            if len(matches) == k:
+                break
+        return matches
+
+    @locked
+    def query_latest(self, symbol, k=10, **kwargs):
+        """Matches for the last `window` closed candles of `symbol`, its own recent history excluded."""
+        i = self.index[symbol]
+        values = self.values[i].view()
+        # the last window has to lie within the last run
+        if len(values) - self.runs[i][-1] < self.window:
+            return []
+        return self.query(values[-self.window :], k, exclude=(symbol, self.last_time(symbol)), **kwargs)
+
+    def _match(self, owner, position, distance):
+        series = self.values[owner].view()
+        close = series[position, 0]
+        later = position + self.horizon
+        runs = self.runs[owner]
+        run_end = runs[np.searchsorted(runs, position, side="right") :][:1]
+        # not known yet, or past a break in the candles
+        known = later < len(series) and not (len(run_end) and later >= run_end[0])
+        forward = float(series[later, 0] / close - 1) if known else float("nan")
+        return Match(self.symbols[owner], int(self.times[owner].view()[position]), distance, forward)
+
+
+def stored_symbols(interval, store_dir=STORE_DIR):
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(
+        symbol
+        for symbol in os.listdir(store_dir)
+        if os.path.isdir(os.path.join(store_dir, symbol, interval))
+    )
+
+
+def build(interval, symbols=None, store_dir=STORE_DIR, **kwargs):
+    """An index over the whole stored history of `symbols` (every stored one by default)."""
+    store = CandleStore(store_dir)
+    kwargs.setdefault("interval_ms", resampling.INTERVAL_MS[interval])
+    index = SimilarityIndex(**kwargs)
+    for symbol in symbols or stored_symbols(interval, store_dir):
+        frame = store.load(symbol, interval, columns=["Open Time", "High", "Low", "Close"])
+        if len(frame) < index.window:
+            continue
+        values = channels(
+            frame["High"].to_numpy(np.float64),
+            frame["Low"].to_numpy(np.float64),
+            frame["Close"].to_numpy(np.float64),
+        )
+        index.extend(symbol, frame["Open Time"].to_numpy(np.int64), values)
+    if index.centroids is None and len(index) >= index.cells:
+        index.train()
+    logging.info("Similarity index for %s: %s windows of %s symbols.", interval, len(index), len(index.symbols))
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the stored windows shaped most like a symbol's last candles.")
+    parser.add_argument("symbol")
+    parser.add_argument("--interval", default="1h")
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = build(args.interval, store_dir=args.store)
+    print(f"{len(index)} windows indexed in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    matches = index.query_latest(args.symbol, args.k)
+    print(f"query took {(time.perf_counter() - started) * 1000:.1f} ms")
+    for match in matches:
+        print(
+            f"{match.symbol} {resampling.output_time(match.time)} distance {match.distance:.3f} "
+            f"next {index.horizon}: {match.forward_return:+.2%}"
+        )
@@ -0,0 +1,280 @@
+import argparse
+import itertools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import indicators
+from candle_store import STORE_DIR, CandleStore
+
+# the thresholds the live rules hardcode, and what to try instead
+DEFAULT_GRID = {
+    "window_sizes": [(15, 30), (10, 20), (20, 40)],
+    "order": [7, 9, 12],
+    "std_dev_threshold": [0.002, 0.003, 0.004],
+    "divergence_rsi": [(70, 30), (75, 25)],
+    "extreme_rsi": [(85, 15), (80, 20)],
+    "stop_atr": [1.5, 1.8, 2.2],
+    "target_atr": [1.5, 2.0],
+}
+
+CONSOLIDATION_WINDOW = 12
+# positions that are still open after this many candles are closed at market
+MAX_HOLD = 48
+# rsi-extreme signals are skipped for these, like the rsi-extreme rules in rules.DEFAULT_RULES
+RSI_SKIP = ("BTCUSDT", "WBTCUSDT")
+
+
+def expand_grid(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+class SymbolCache:
+    """
+    Everything the rules derive from one symbol's history, computed once and
+    shared by every grid point: indicators, swing points per extrema order,
+    rolling slopes per window and the consolidation ratio.
+    """
+
+    def __init__(self, symbol, frame):
+        self.symbol = symbol
+        self.close = frame["Close"].to_numpy(np.float64)
+        self.high = frame["High"].to_numpy(np.float64)
+        self.low = frame["Low"].to_numpy(np.float64)
+        self.rsi = indicators.rsi(self.close)
+        self.atr = indicators.atr(self.high, self.low, self.close)
+        self._swings = {}
+        self._slopes = {}
+        self._ratio = None
+        self._exits = {}
+
+    def swings(self, order):
+        """
+        Swing highs/lows of the previous candle as the live loop sees them:
+        the candle before the forming one, with only one candle to its right.
+        """
+        if order not in self._swings:
+            close = self.close
+            n = len(close)
+            high = np.zeros(n, dtype=bool)
+            low = np.zeros(n, dtype=bool)
+            if n > order + 1:
+                left = np.lib.stride_tricks.sliding_window_view(close[:-2], order)
+                previous = close[order:-1]
+                following = close[order + 1 :]
+                high[order + 1 :] = (previous > left.max(axis=1)) & (previous > following)
+                low[order + 1 :] = (previous < left.min(axis=1)) & (previous < following)
+            self._swings[order] = high, low
+        return self._swings[order]
+
+    def slopes(self, window):
+        if window not in self._slopes:
+            self._slopes[window] = (
+                indicators.rolling_slope(self.close, window),
+                indicators.rolling_slope(self.rsi, window),
+            )
+        return self._slopes[window]
+
+    def consolidation_ratio(self):
+        if self._ratio is None:
+            windows = np.lib.stride_tricks.sliding_window_view(
+                self.close, CONSOLIDATION_WINDOW
+            )
+            ratio = np.full(len(self.close), np.inf)
+            ratio[CONSOLIDATION_WINDOW - 1 :] = windows.std(axis=1, ddof=1) / windows.mean(
+                axis=1
+            )
+            self._ratio = ratio
+        return self._ratio
+
+    def divergence(self, order, window_sizes):
+        """Bullish/bearish divergence on the previous candle, per candle."""
+        swing_high, swing_low = self.swings(order)
+        bearish = np.zeros(len(self.close), dtype=bool)
+        bullish = np.zeros(len(self.close), dtype=bool)
+        for window in window_sizes:
+            price_slope, rsi_slope = self.slopes(window)
+            # slopes of the window ending at the previous candle
+            price_slope = np.concatenate([[0.0], price_slope[:-1]])
+            rsi_slope = np.concatenate([[0.0], rsi_slope[:-1]])
+            bearish |= swing_high & (price_slope > 0) & (rsi_slope < 0)
+            bullish |= swing_low & (price_slope < 0) & (rsi_slope > 0)
+        return bullish, bearish
+
+    def flags(self, std_dev_threshold):
+        """Bull/bear flag per candle, judged only on candles up to that one."""
+        n = len(self.close)
+        qualifying = np.flatnonzero(self.consolidation_ratio() <= std_dev_threshold)
+        bull = np.zeros(n, dtype=bool)
+        bear = np.zeros(n, dtype=bool)
+        if len(qualifying) == 0:
+            return bull, bear
+        # windows ending at e mark e-11..e+1, overlapping marks form one run
+        new_run = np.diff(qualifying, prepend=-np.inf) > CONSOLIDATION_WINDOW + 1
+        run_first = qualifying[new_run][np.cumsum(new_run) - 1]
+
+        t = np.arange(n)
+        last = np.searchsorted(qualifying, t, side="right") - 1
+        valid = last >= 0
+        last_end = np.where(valid, qualifying[np.maximum(last, 0)], -10)
+        covered = valid & (t <= last_end + 1)
+        run_start = np.maximum(run_first[np.maximum(last, 0)] - CONSOLIDATION_WINDOW + 1, 0)
+        reference = run_start - 1
+        covered &= (reference >= 0) & (t >= 1)
+        reference_close = self.close[np.clip(reference, 0, n - 1)]
+        previous_close = np.concatenate([[np.nan], self.close[:-1]])
+        bull = covered & (previous_close > reference_close)
+        bear = covered & (previous_close < reference_close)
+        return bull, bear
+
+    def exits(self, side, stop_atr, target_atr):
+        """
+        Return of a trade opened at every candle's close, exiting at the first
+        touch of stop or target (stop first when both are touched) or after
+        MAX_HOLD candles.
+        """
+        key = (side, stop_atr, target_atr)
+        if key not in self._exits:
+            n = len(self.close)
+            returns = np.full(n, np.nan)
+            hold = np.full(n, MAX_HOLD)
+            if n > MAX_HOLD + 1:
+                entry = self.close[: n - MAX_HOLD]
+                atr = self.atr[: n - MAX_HOLD]
+                highs = np.lib.stride_tricks.sliding_window_view(self.high[1:], MAX_HOLD)
+                lows = np.lib.stride_tricks.sliding_window_view(self.low[1:], MAX_HOLD)
+                highs = highs[: len(entry)]
+                lows = lows[: len(entry)]
+                stop = entry - side * stop_atr * atr
+                target = entry + side * target_atr * atr
+                if side > 0:
+                    stop_hit = lows <= stop[:, None]
+                    target_hit = highs >= target[:, None]
+                else:
+                    stop_hit = highs >= stop[:, None]
+                    target_hit = lows <= target[:, None]
+                never = MAX_HOLD
+                first_stop = np.where(stop_hit.any(axis=1), stop_hit.argmax(axis=1), never)
+                first_target = np.where(
+                    target_hit.any(axis=1), target_hit.argmax(axis=1), never
+                )
+                time_exit = self.close[MAX_HOLD : MAX_HOLD + len(entry)]
+                exit_price = np.where(
+                    first_stop <= first_target,
+                    np.where(first_stop < never, stop, time_exit),
+                    target,
+                )
+                returns[: len(entry)] = side * (exit_price - entry) / entry
+                hold[: len(entry)] = np.minimum(first_stop, first_target)
+            self._exits[key] = returns, hold
+        return self._exits[key]
+
+    def signals(self, params):
+        """Long/short entry masks for one grid point, mirroring the live rules."""
+        bullish, bearish = self.divergence(params["order"], params["window_sizes"])
+        high_rsi, low_rsi = params["divergence_rsi"]
+        # already refers to the candle before the one being traded, like before_last_row
+        previous_divergence = bullish | bearish
+        short = previous_divergence & (self.rsi > high_rsi)
+        long = previous_divergence & (self.rsi < low_rsi)
+
+        if self.symbol not in RSI_SKIP:
+            extreme_high, extreme_low = params["extreme_rsi"]
+            short |= self.rsi > extreme_high
+            long |= self.rsi < extreme_low
+
+        bull_flag, bear_flag = self.flags(params["std_dev_threshold"])
+        long |= bull_flag
+        short |= bear_flag
+        return long, short
+
+    def backtest(self, params):
+        long, short = self.signals(params)
+        trades = []
+        for side, mask in ((1, long), (-1, short)):
+            returns, hold = self.exits(side, params["stop_atr"], params["target_atr"])
+            busy_until = -1
+            # one position per side at a time, like long_status/check_margin_short_position
+            for t in np.flatnonzero(mask & ~np.isnan(returns)):
+                if t <= busy_until:
+                    continue
+                trades.append(returns[t])
+                busy_until = t + int(hold[t]) + 1
+        return np.array(trades)
+
+
+def summarize(returns):
+    if len(returns) == 0:
+        return {"trades": 0, "total": 0.0, "mean": 0.0, "win_rate": 0.0, "sharpe": 0.0}
+    std = returns.std()
+    return {
+        "trades": int(len(returns)),
+        "total": float(returns.sum()),
+        "mean": float(returns.mean()),
+        "win_rate": float((returns > 0).mean()),
+        "sharpe": float(returns.mean() / std * np.sqrt(len(returns))) if std > 0 else 0.0,
+    }
+
+
+def sweep_symbol(symbol, interval, grid_points, store_dir=STORE_DIR):
+    frame = CandleStore(store_dir).load(symbol, interval, columns=["High", "Low", "Close"])
+    if len(frame) < MAX_HOLD + CONSOLIDATION_WINDOW:
+        logging.info("Not enough history for %s %s, skipped.", symbol, interval)
+        return [np.array([]) for _ in grid_points]
+    cache = SymbolCache(symbol, frame)
+    return [cache.backtest(params) for params in grid_points]
+
+
+def grid_slices(points, symbols, workers):
+    """
+    Contiguous slices of the grid, enough that symbols x slices keeps every
+    worker busy, a single slice when the symbols alone do. Neighbouring
+    points share their extrema order and windows, so a slice still reuses
+    most of its SymbolCache.
+    """
+    parts = max(1, min(points, -(-workers // max(symbols, 1))))
+    bounds = np.linspace(0, points, parts + 1).astype(int)
+    return [slice(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def run_sweep(symbols, interval, grid=None, store_dir=STORE_DIR, workers=None, rank_by="total"):
+    grid_points = expand_grid(grid or DEFAULT_GRID)
+    trades = [[] for _ in grid_points]
+    workers = workers or os.cpu_count() or 1
+    # split per symbol and, when there are fewer symbols than workers, over the grid too
+    slices = grid_slices(len(grid_points), len(symbols), workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            (part, executor.submit(sweep_symbol, symbol, interval, grid_points[part], store_dir))
+            for symbol in symbols
+            for part in slices
+        ]
+        for part, future in futures:
+            for i, returns in enumerate(future.result(), part.start):
+                trades[i].append(returns)
+    results = [
+        dict(params=params, **summarize(np.concatenate(returns)))
+        for params, returns in zip(grid_points, trades)
+    ]
+    return sorted(results, key=lambda result: result[rank_by], reverse=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest grids of signal thresholds.")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--interval", default="1h")
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rank-by", default="total", choices=["total", "mean", "win_rate", "sharpe"])
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    ranked = run_sweep(args.symbols, args.interval, store_dir=args.store, workers=args.workers, rank_by=args.rank_by)
+    for result in ranked[: args.top]:
+        print(
+            f"{result[args.rank_by]:.4f} trades: {result['trades']}, win rate: {result['win_rate']:.2%}, "
+            f"total: {result['total']:.4f}, params: {result['params']}"
+        )
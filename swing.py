@@ -0,0 +1,182 @@
+import math
+from collections import deque
+
+import pandas as pd
+
+import extrema
+
+# the orders mark_extrema, mark_medium_extrema and mark_big_extrema use
+EXTREMA_ORDERS = (5, 30, 50)
+
+
+class SwingIndex:
+    """
+    Ordered swing highs/lows per extrema order and the consolidation runs of
+    one symbol/interval, kept up to date one closed candle at a time.
+
+    Positions are counted from the first candle fed. Everything that the
+    batch marking could still change (the last `order` candles, the window
+    of the still-forming candle) is resolved at query time from a short tail,
+    so queries never scan the history.
+    """
+
+    def __init__(
+        self,
+        orders=EXTREMA_ORDERS,
+        consolidation_window=12,
+        std_dev_threshold=0.003,
+        max_points=500,
+    ):
+        self.orders = tuple(orders)
+        self.consolidation_window = consolidation_window
+        self.std_dev_threshold = std_dev_threshold
+        self.closes = deque(maxlen=2 * max(self.orders) + consolidation_window + 1)
+        self.count = 0
+        self.last_time = None
+        self.highs = {order: deque(maxlen=max_points) for order in self.orders}
+        self.lows = {order: deque(maxlen=max_points) for order in self.orders}
+        # consolidated ranges as [start, end, close before start]
+        self.runs = deque(maxlen=max_points)
+
+    def close_at(self, position):
+        offset = position - (self.count - len(self.closes))
+        if position < 0 or offset < 0:
+            return None
+        return self.closes[offset]
+
+    def update(self, time, close):
+        position = self.count
+        self.closes.append(float(close))
+        self.count += 1
+        self.last_time = time
+
+        mark = self._consolidation_mark(list(self.closes), position)
+        if mark is not None:
+            self._merge_run(*mark)
+
+        tail = list(self.closes)
+        for order in self.orders:
+            candidate = len(tail) - 1 - order
+            if candidate < 1 or position - order < 1:
+                continue
+            if extrema.is_maximum(tail, candidate, order):
+                self.highs[order].append((position - order, tail[candidate]))
+            elif extrema.is_minimum(tail, candidate, order):
+                self.lows[order].append((position - order, tail[candidate]))
+
+    def apply(self, data):
+        """Feed the closed candles of `data` (all rows but the last) not seen yet."""
+        closed = data.iloc[:-1]
+        times = pd.to_datetime(closed["Open Time"])
+        if self.last_time is not None:
+            is_new = times > self.last_time
+            closed, times = closed[is_new], times[is_new]
+        for time, close in zip(times, closed["Close"]):
+            self.update(time, close)
+        return self
+
+    def last_high(self, order=5, forming_close=None):
+        return self._last_swing(order, forming_close, extrema.is_maximum, self.highs)
+
+    def last_low(self, order=5, forming_close=None):
+        return self._last_swing(order, forming_close, extrema.is_minimum, self.lows)
+
+    def structure(self, order=5):
+        """Higher/lower high and low from the last two confirmed swings."""
+        highs, lows = self.highs[order], self.lows[order]
+        high = low = None
+        if len(highs) > 1:
+            high = "higher_high" if highs[-1][1] > highs[-2][1] else "lower_high"
+        if len(lows) > 1:
+            low = "higher_low" if lows[-1][1] > lows[-2][1] else "lower_low"
+        return high, low
+
+    def is_consolidated(self, forming_close=None):
+        position = self.count if forming_close is not None else self.count - 1
+        if self.runs and self.runs[-1][0] <= position <= self.runs[-1][1]:
+            return True
+        if forming_close is None:
+            return False
+        return self._consolidation_mark(self._with(forming_close), position) is not None
+
+    def last_non_consolidated_close(self, forming_close=None):
+        position = self.count if forming_close is not None else self.count - 1
+        last_close = forming_close if forming_close is not None else self.close_at(position)
+        run = self.runs[-1] if self.runs else None
+        if forming_close is not None:
+            mark = self._consolidation_mark(self._with(forming_close), position)
+            if mark is not None:
+                run = self._merged(run, *mark)
+        if run is None or not run[0] <= position <= run[1]:
+            return last_close
+        return run[2]
+
+    def trend(self, previous_close, forming_close=None, order=5):
+        # same ladder find_trend always used, 0 when no swing was seen yet
+        high = self.last_high(order, forming_close)
+        low = self.last_low(order, forming_close)
+        prev_high_value = high[1] if high else 0
+        prev_low_value = low[1] if low else 0
+        trend = None
+        if previous_close > prev_high_value:
+            trend = "uptrend"
+        elif previous_close < prev_high_value and previous_close > prev_low_value:
+            trend = "equilibrium?"
+
+        if previous_close < prev_low_value:
+            trend = "downtrend"
+        elif previous_close > prev_low_value and previous_close < prev_high_value:
+            trend = "equilibrium?"
+        return trend, prev_high_value, prev_low_value
+
+    def flag(self, previous_close, forming_close=None):
+        if not self.is_consolidated(forming_close):
+            return None
+        reference = self.last_non_consolidated_close(forming_close)
+        if reference is None:
+            return None
+        if previous_close > reference:
+            return "bull_flag"
+        if previous_close < reference:
+            return "bear_flag"
+        return None
+
+    def _with(self, forming_close):
+        return list(self.closes) + [float(forming_close)]
+
+    def _consolidation_mark(self, closes, position):
+        """Range detect_consolidation marks for the window ending at `position`, if any."""
+        window = closes[-self.consolidation_window :]
+        if len(window) < 2:
+            return None
+        mean_price = sum(window) / len(window)
+        std_dev = math.sqrt(
+            sum((price - mean_price) ** 2 for price in window) / (len(window) - 1)
+        )
+        if std_dev / mean_price > self.std_dev_threshold:
+            return None
+        # data.loc[start:end] is inclusive, so the next candle is marked as well
+        return max(position - self.consolidation_window + 1, 0), position + 1
+
+    def _merged(self, run, start, end):
+        if run is not None and start <= run[1] + 1:
+            return [run[0], max(run[1], end), run[2]]
+        return [start, end, self.close_at(start - 1)]
+
+    def _merge_run(self, start, end):
+        run = self.runs[-1] if self.runs else None
+        merged = self._merged(run, start, end)
+        if run is not None and merged[0] == run[0]:
+            self.runs[-1] = merged
+        else:
+            self.runs.append(merged)
+
+    def _last_swing(self, order, forming_close, is_swing, confirmed):
+        # swings inside the last `order` candles are not confirmed yet
+        closes = self._with(forming_close) if forming_close is not None else list(self.closes)
+        n = len(closes)
+        offset = self.count - len(self.closes)
+        for i in range(n - 2, max(0, n - 2 - order), -1):
+            if offset + i >= 1 and is_swing(closes, i, order):
+                return offset + i, closes[i]
+        return confirmed[order][-1] if confirmed[order] else None
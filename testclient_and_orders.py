@@ -1,42 +1,83 @@
 import math
-from binance.client import Client
-from binance.enums import *
 import logging
 import os
 import datetime
-from dotenv import load_dotenv
+
+import trade_logging
 
 
 def setup_logging():
-    orders_dir = "orders"
-    if not os.path.exists(orders_dir):
-        os.makedirs(orders_dir)
-    logging.basicConfig(
-        filename=os.path.join(orders_dir, "order_logs.log"),
-        level=logging.INFO,
-        format="%(asctime)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+    return trade_logging.setup_logging()
+
+
+_client = None
+
+
+def get_client():
+    """Builds the testnet client on first use so importing this module stays offline."""
+    global _client
+    if _client is None:
+        from binance.client import Client
+        from dotenv import load_dotenv
+
+        import governor
+
+        load_dotenv("keyz.env")
+
+        api_key = os.getenv("BINANCE_TEST_API_KEY")
+        secret_key = os.getenv("BINANCE_TEST_SECRET_KEY")
+
+        client = Client(api_key, secret_key, testnet=True, ping=False)
+        client.API_URL = "https://testnet.binance.vision/api"
+        _client = governor.wrap_client(client)
+    return _client
+
+
+_order_book = None
+
+
+def get_order_book():
+    """Local book of the margin orders and OCO lists this process placed."""
+    global _order_book
+    if _order_book is None:
+        import order_book
 
-setup_logging()
-logging.basicConfig()
+        _order_book = order_book.OpenOrderBook(get_client(), margin=True)
+    return _order_book
 
 
-load_dotenv("keyz.env") 
+# exits.ExitEngine position id -> (orderId, orderListId) of the exit orders holding it
+exit_orders = {}
 
-api_key = os.getenv("BINANCE_TEST_API_KEY")
-secret_key = os.getenv("BINANCE_TEST_SECRET_KEY")
 
-client = Client(api_key, secret_key, testnet=True)
-client.API_URL = "https://testnet.binance.vision/api"
+def track_exit(position, response):
+    """Remember the order or OCO list placed for a position's stop and target."""
+    if response is not None:
+        exit_orders[position] = (response.get("orderId"), response.get("orderListId"))
+
+
+def flatten(symbol, sync=False):
+    """Cancel every open margin order and OCO list on `symbol`."""
+    book = get_order_book()
+    if sync:
+        book.sync(symbol)
+    return book.flatten(symbol)
+
+
+def __getattr__(name):
+    # keeps `testclient_and_orders.client` working for existing callers
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def check_margin_availability(client, asset):
     try:
         margin_details = client.get_max_margin_loan(asset=asset)
-        print(f"My Margin details for {asset}: {margin_details}")
+        logging.info("My Margin details for %s: %s", asset, margin_details)
         return margin_details
     except Exception as e:
-        logging.error(f"Error retrieving margin details for {asset}: {e}")
+        logging.error("Error retrieving margin details for %s: %s", asset, e)
         return None
 
 
@@ -60,13 +101,13 @@ def place_margin_short_with_oco(
         asset = symbol[:-4]
         # Step 1: Borrow the asset
         borrow_response = client.create_margin_loan(asset=asset, amount=str(quantity))
-        logging.info(f"Asset borrowed for shorting: {borrow_response}")
+        logging.info("Asset borrowed for shorting: %s", borrow_response)
 
         # Step 2: Place a market sell to open the short position
         market_sell_response = client.create_margin_order(
             symbol=symbol, side="SELL", type="MARKET", quantity=quantity
         )
-        logging.info(f"Market sell order placed for short: {market_sell_response}")
+        logging.info("Market sell order placed for short: %s", market_sell_response)
 
         # Step 3: Place the OCO order for taking profit and limiting loss
         oco_response = client.create_margin_oco_order(
@@ -78,13 +119,18 @@ def place_margin_short_with_oco(
             stopLimitPrice=adjusted_stop_loss_price,
             stopLimitTimeInForce="GTC",
         )
-        logging.info(
-            f"OCO order placed with target: {target_profit_price}, stop: {stop_loss_price}. Full response: {oco_response}"
+        trade_logging.log_event(
+            "OCO order placed",
+            symbol=symbol,
+            target=target_profit_price,
+            stop=stop_loss_price,
+            response=oco_response,
         )
+        get_order_book().record(oco_response)
 
         return oco_response
     except Exception as e:
-        logging.error(f"Failed to place margin short with OCO for {symbol}: {e}")
+        logging.error("Failed to place margin short with OCO for %s: %s", symbol, e)
         return None
 
 
@@ -97,7 +143,7 @@ def check_usdt_balance(client, asset="USDT"):
         btc_price = get_current_price(client, "BTCUSDT")
         total_debt = btc_price * float(account_info["totalLiabilityOfBtc"])
         total_balance = float(account_info["totalCollateralValueInUSDT"])
-        print(f"btc price {btc_price}, total debt: {total_debt}, total balance {total_balance}")
+        logging.info("btc price %s, total debt: %s, total balance %s", btc_price, total_debt, total_balance)
 
         for balance in balances:
             curr_asset = balance["asset"]
@@ -105,15 +151,15 @@ def check_usdt_balance(client, asset="USDT"):
             if curr_asset == asset:
                 asset_balance = total_balance - total_debt
                 if asset_balance > 0:
-                    print(f"Balance for {asset}: {asset_balance}")
+                    logging.info("Balance for %s: %s", asset, asset_balance)
         if asset_balance > 0:
-            print(f"Balance for {asset}: {asset_balance}")
+            logging.info("Balance for %s: %s", asset, asset_balance)
         else:
-            print(f"No balance available for {asset}.")
+            logging.info("No balance available for %s.", asset)
         return asset_balance
 
     except Exception as e:
-        print(f"Error retrieving balances: {e}")
+        logging.error("Error retrieving balances: %s", e)
         return 0
 
 
@@ -124,21 +170,21 @@ def place_long_with_stop_loss(
     stop_loss_price
 ):
     try:
-        print(f"Placing long oco order for {quantity} of {symbol}.")
+        logging.info("Placing long oco order for %s of %s.", quantity, symbol)
         borrow_response = client.create_margin_loan(
             asset="USDT", amount=str(quantity)
         )
         logging.info(
-            f"USDT borrowed for long amount: {quantity}, response: {borrow_response}"
+            "USDT borrowed for long amount: %s, response: %s", quantity, borrow_response
         )
 
         market_buy_response = client.create_margin_order(
             symbol=symbol, side="BUY", type="MARKET", quantity=quantity
         )
-        logging.info(f"Market buy order placed for long: {market_buy_response}")
+        logging.info("Market buy order placed for long: %s", market_buy_response)
 
-        print(
-            f"Placing stop-loss order for {quantity} of {symbol} at {stop_loss_price}"
+        logging.info(
+            "Placing stop-loss order for %s of %s at %s", quantity, symbol, stop_loss_price
         )
 
         # Ensure to adjust the price to meet the precision requirement
@@ -154,12 +200,16 @@ def place_long_with_stop_loss(
             timeInForce="GTC",
         )
 
-        logging.info(
-            f"Stop-loss order placed: {stop_loss_response}")
-        print(f"OCO Order placed.")
+        trade_logging.log_event(
+            "Stop-loss order placed", symbol=symbol, response=stop_loss_response
+        )
+        get_order_book().record(stop_loss_response)
+        logging.info("OCO Order placed.")
+        return stop_loss_response
 
     except Exception as e:
-        print(f"Failed to place order: {e}")
+        logging.error("Failed to place order: %s", e)
+        return None
 
 
 def check_margin_level_and_allow_trading(client, threshold=1.7):
@@ -178,42 +228,40 @@ def check_margin_level_and_allow_trading(client, threshold=1.7):
         )
 
         if margin_level > threshold:
-            logging.info(f"Margin level is healthy: {margin_level}. Trading is allowed.")
+            logging.info("Margin level is healthy: %s. Trading is allowed.", margin_level)
             return True
         else:
-            logging.info(f"Margin level is low: {margin_level}. Trading is restricted.")
+            logging.info("Margin level is low: %s. Trading is restricted.", margin_level)
             return False
 
     except Exception as e:
-        logging.info(f"Failed to retrieve or calculate margin level: {e}")
+        logging.info("Failed to retrieve or calculate margin level: %s", e)
         return False
 
 
 
 def cancel_orders(client, symbol):
+    import order_book
+
     try:
-        open_orders = client.get_open_orders(symbol=symbol)
-        for order in open_orders:
-            canceled_order = client.cancel_order(
-                symbol=symbol, orderId=order["orderId"]
-            )
-            print(f"Canceled order ID: {canceled_order['orderId']}")
+        book = order_book.OpenOrderBook(client, margin=False).sync(symbol)
+        for canceled_order in book.flatten(symbol, bulk=False):
+            logging.info("Canceled order ID: %s", canceled_order['orderId'])
     except Exception as e:
-        print(f"Failed to cancel orders: {e}")
+        logging.error("Failed to cancel orders: %s", e)
 
 
 def close_order(symbol, order_type, quantity):
     try:
-        print(f"Closing {order_type} order for {quantity} of {symbol}.")
-        order = client.order_market(
+        logging.info("Closing %s order for %s of %s.", order_type, quantity, symbol)
+        order = get_client().order_market(
             symbol=symbol,
-            side=SIDE_SELL if order_type == "long" else SIDE_BUY,
+            side="SELL" if order_type == "long" else "BUY",
             quantity=quantity,
         )
-        print(f"Order closed: {order}")
-        logging.info(f"Order closed: {order}")
+        logging.info("Order closed: %s", order)
     except Exception as e:
-        print(f"Failed to close order: {e}")
+        logging.error("Failed to close order: %s", e)
 
 
 def get_current_price(client, symbol):
@@ -223,8 +271,7 @@ def get_current_price(client, symbol):
         current_price = float(ticker["price"])
         return current_price
     except Exception as e:
-        print(f"Error retrieving current price: {e}")
-        logging.info(f"Error retrieving current price: {e}")
+        logging.error("Error retrieving current price: %s", e)
         return None
 
 
@@ -253,10 +300,66 @@ def adjust_price_to_filter(client, symbol, price):
 
         return price
     except Exception as e:
-        logging.error("Failed to adjust price: " + str(e))
+        logging.error("Failed to adjust price: %s", e)
         return None  # Or handle error appropriately
 
 
+# symbol -> PRICE_FILTER tick size, exchangeInfo is static and weighs 20
+tick_sizes = {}
+
+
+def get_tick_size(client, symbol):
+    if symbol not in tick_sizes:
+        info = client.get_symbol_info(symbol)
+        tick_sizes[symbol] = float(
+            next(
+                item["tickSize"]
+                for item in info["filters"]
+                if item["filterType"] == "PRICE_FILTER"
+            )
+        )
+    return tick_sizes[symbol]
+
+
+def send_exit_order(client, order):
+    """
+    Put an exits.ExitOrder on the exchange: the position's own exit orders
+    are cancelled and, unless the position is closed, one OCO with the new
+    stop and target takes their place. Other positions on the same symbol
+    keep theirs.
+    """
+    placed = exit_orders.pop(order.position, None)
+    if placed is not None:
+        get_order_book().cancel(order.symbol, *placed)
+    if order.kind == "close":
+        close_order(order.symbol, order.side, order.quantity)
+        return None
+    try:
+        oco_response = client.create_margin_oco_order(
+            symbol=order.symbol,
+            side="SELL" if order.side == "long" else "BUY",
+            quantity=order.quantity,
+            price=order.target,
+            stopPrice=order.stop,
+            stopLimitPrice=order.stop,
+            stopLimitTimeInForce="GTC",
+        )
+        trade_logging.log_event(
+            "Exit OCO placed",
+            symbol=order.symbol,
+            kind=order.kind,
+            target=order.target,
+            stop=order.stop,
+            response=oco_response,
+        )
+        get_order_book().record(oco_response)
+        track_exit(order.position, oco_response)
+        return oco_response
+    except Exception as e:
+        logging.error("Failed to place the exit OCO for %s: %s", order.symbol, e)
+        return None
+
+
 def adjust_quantity_to_minimum(client, symbol, quantity):
     try:
         info = client.get_symbol_info(symbol)
@@ -272,7 +375,7 @@ def adjust_quantity_to_minimum(client, symbol, quantity):
 
         return quantity
     except Exception as e:
-        print(f"Error adjusting quantity: {e}")
+        logging.error("Error adjusting quantity: %s", e)
         return None
 
 
@@ -291,11 +394,12 @@ def long_status(client, symbol):
             borrowed = float(asset_balance["borrowed"])
             net_balance = free_balance + locked_balance - borrowed
 
-            print(
-                f"Margin Balance for {asset}: Net: {net_balance}, Free: {free_balance}, Locked: {locked_balance}, Borrowed: {borrowed}"
+            logging.info(
+                "Margin Balance for %s: Net: %s, Free: %s, Locked: %s, Borrowed: %s",
+                asset, net_balance, free_balance, locked_balance, borrowed,
             )
         else:
-            print(f"No balance information found for {asset}.")
+            logging.info("No balance information found for %s.", asset)
             net_balance = 0
 
         # Check for open margin orders
@@ -308,10 +412,10 @@ def long_status(client, symbol):
         # Determine if in a long position by checking net balance and pending sells
         is_long = net_balance > 0 and has_pending_sell
 
-        print(f"Is long: {is_long}, Pending sell orders: {has_pending_sell}")
+        logging.info("Is long: %s, Pending sell orders: %s", is_long, has_pending_sell)
         return is_long
     except Exception as e:
-        print(f"Failed to check margin long status for {symbol}: {e}")
+        logging.error("Failed to check margin long status for %s: %s", symbol, e)
         return False
 
 
@@ -327,17 +431,14 @@ def get_total_asset_balance(client, asset):
         total_balance = free_balance + locked_balance
 
         logging.info(
-            f"Asset: {asset}, Free: {free_balance}, Locked: {locked_balance}, Total: {total_balance}"
-        )
-        print(
-            f"Asset: {asset}, Free: {free_balance}, Locked: {locked_balance}, Total: {total_balance}"
+            "Asset: %s, Free: %s, Locked: %s, Total: %s",
+            asset, free_balance, locked_balance, total_balance,
         )
 
         return total_balance
 
     except Exception as e:
-        logging.error(f"Failed to fetch balance for {asset}: {e}")
-        print(f"Failed to fetch balance for {asset}: {e}")
+        logging.error("Failed to fetch balance for %s: %s", asset, e)
         return 0.0
 
 
@@ -352,13 +453,13 @@ def check_margin_short_position(client, symbol):
                 free = float(asset_detail["free"])
                 if borrowed > 0:
                     # Assuming a short if there's a borrowed amount not yet repaid
-                    logging.info(f"Borrowed amount for {asset}: {borrowed}")
+                    logging.info("Borrowed amount for %s: %s", asset, borrowed)
                     return True, borrowed
                 break
-        logging.info(f"No borrowed amount for {asset}. No active short position.")
+        logging.info("No borrowed amount for %s. No active short position.", asset)
         return False, 0.0
     except Exception as e:
-        logging.error(f"Failed to check short position for {symbol}: {e}")
+        logging.error("Failed to check short position for %s: %s", symbol, e)
         return False, 0.0
 
 
@@ -382,66 +483,43 @@ def log_trade_action(symbol, action, quantity, price, reason):
         file.write(entry)
 
     logging.info(
-        f"Logged {action} for {symbol}: {quantity} at {price} Reason: {reason} "
+        "Logged %s for %s: %s at %s Reason: %s", action, symbol, quantity, price, reason
     )
 
 
 def cancel_all_orders(client, symbol):
+    import order_book
+
     try:
-        open_orders = client.get_open_orders(symbol=symbol)
-        print(f"Found {len(open_orders)} open orders for {symbol}.")
-
-        for order in open_orders:
-            if "orderListId" in order:  # This indicates an OCO order
-                # OCO orders have a list of orders within them
-                for oco_order in order["orders"]:
-                    orderId = oco_order["orderId"]
-                    print(f"Oco order id: {orderId}")
-                    canceled_order = client.cancel_order(
-                        symbol=symbol, orderId=orderId
-                    )
-                    print(f"Canceled OCO sub-order: {canceled_order['orderId']}")
-
-            else:
-                orderId = order["orderId"]
-                canceled_order = client.cancel_order(symbol=symbol, orderId=orderId)
-                print(f"Canceled regular order: {canceled_order['orderId']}")
-                logging.info(f"Canceled regular order: {canceled_order['orderId']}")
+        book = order_book.OpenOrderBook(client, margin=False).sync(symbol)
+        logging.info(
+            "Found %s open orders (%s OCO lists) for %s.",
+            len(book.open_orders(symbol)), len(book.oco_lists(symbol)), symbol,
+        )
+        canceled = book.flatten(symbol)
+        logging.info("Canceled %s orders and OCO lists on %s.", len(canceled), symbol)
 
     except Exception as e:
-        print(f"Failed to cancel orders: {e}")
-        logging.error(f"Failed to cancel orders: {e}")
+        logging.error("Failed to cancel orders: %s", e)
 
 
 def cancel_all_oco_orders(client, symbol):
+    import order_book
+
     try:
-        open_orders = client.get_open_orders(symbol=symbol)
-        print(f"Total open orders fetched: {len(open_orders)}")
-
-        oco_orders = [order for order in open_orders if "orderListId" in order]
-
-        print(f"Found {len(oco_orders)} OCO orders for {symbol}.")
-
-        for order in oco_orders:
-            try:
-                # Assuming 'orders' key contains sub-orders directly with 'orderId'
-                for sub_order in order["orders"]:
-                    print(f"sub order within oco_orders: {sub_order}")
-                    orderId = sub_order["orderId"]
-                    canceled_order = client.cancel_order(
-                        symbol=symbol, orderId=orderId
-                    )
-                    print(f"Canceled OCO sub-order ID: {canceled_order['orderId']}")
-            except KeyError as e:
-                print(
-                    f"Failed to cancel a sub-order in OCO order {order['orderListId']} due to missing key: {e}"
-                )
-            except Exception as e:
-                print(f"Error while cancelling sub-order: {e}")
+        book = order_book.OpenOrderBook(client, margin=False).sync(symbol)
+        oco_lists = book.oco_lists(symbol)
+        logging.info("Found %s OCO orders for %s.", len(oco_lists), symbol)
+
+        # plain orders (orderListId -1) are left alone
+        for order in book.open_orders(symbol):
+            if order.get("orderListId", order_book.NO_LIST) not in oco_lists:
+                book.forget(order_id=order["orderId"])
+        for canceled_order in book.flatten(symbol, bulk=False):
+            logging.info("Canceled OCO order: %s", canceled_order)
 
     except Exception as e:
-        print(f"Failed to fetch or cancel OCO orders: {e}")
-        logging.error(f"Failed to fetch or cancel OCO orders: {e}")
+        logging.error("Failed to fetch or cancel OCO orders: %s", e)
 
 ### needs real api key ###
 # check_usdt_balance(client)
@@ -517,9 +595,9 @@ symbols = [
     "EGLDUSDT",
 ]
 for symbol in symbols:
-    current_price = get_current_price(client, symbol) 
+    current_price = get_current_price(get_client(), symbol) 
     asset = symbol[:-4]
-    amount = get_total_asset_balance(client, asset)
+    amount = get_total_asset_balance(get_client(), asset)
     print("amount: ", amount)"""
 # cancel_all_oco_orders(client, symbol)
 #   get_total_asset_balance(client, asset)
@@ -0,0 +1,143 @@
+import atexit
+import datetime
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+LOG_DIR = "orders"
+LOG_FILE = "order_logs.log"
+FORMAT = "%(asctime)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listener = None
+_lock = threading.Lock()
+
+# safe to format later on the writer thread, nothing can change them meanwhile
+IMMUTABLE_TYPES = (str, bytes, int, float, complex, type(None), datetime.date, datetime.time, datetime.timedelta)
+
+
+def _immutable(value):
+    if isinstance(value, tuple):
+        return all(_immutable(item) for item in value)
+    # numpy scalars, not arrays
+    return isinstance(value, IMMUTABLE_TYPES) or (
+        hasattr(value, "dtype") and not hasattr(value, "__setitem__")
+    )
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts the record on the queue as it is. The stock QueueHandler formats
+    the message in the calling thread, this leaves msg % args and the
+    fields to the writer thread.
+
+    Only immutable values are left for later: a message with a mutable
+    argument (a dict, a frame) is formatted here, and a mutable field is
+    replaced by its text, so the caller changing it afterwards does not
+    change what is written.
+    """
+
+    def prepare(self, record):
+        if record.args and not _immutable(record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        fields = getattr(record, "fields", None)
+        if fields and not all(_immutable(value) for value in fields.values()):
+            record.fields = {
+                key: value if _immutable(value) else str(value) for key, value in fields.items()
+            }
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through one in `sample_every` records of a call site, for messages
+    logged with extra={"sample_every": n}, counted apart per `sample_key`
+    when one is given. The kept record gets `sampled` set to n. Everything
+    else passes untouched.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        every = getattr(record, "sample_every", None)
+        if not every or every <= 1:
+            return True
+        key = (record.pathname, record.lineno, getattr(record, "sample_key", None))
+        with self.lock:
+            count = self.counts.get(key, 0)
+            self.counts[key] = count + 1
+        if count % every:
+            return False
+        record.sampled = every
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    The usual "time - message" line followed by the record's structured
+    fields (extra={"fields": {...}}) as key=value pairs.
+    """
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " | " + " ".join(f"{key}={value}" for key, value in fields.items())
+        sampled = getattr(record, "sampled", None)
+        if sampled:
+            line += f" (1 in {sampled})"
+        return line
+
+
+def setup_logging(log_dir=LOG_DIR, filename=LOG_FILE, level=logging.INFO, console=False):
+    """
+    Route the root logger through an in-memory queue to a background thread
+    that formats and writes the records, so logging never blocks on file or
+    console I/O. Calling it again is a no-op.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return _listener
+        os.makedirs(log_dir, exist_ok=True)
+        formatter = StructuredFormatter(FORMAT, datefmt=DATE_FORMAT)
+        handlers = [logging.FileHandler(os.path.join(log_dir, filename))]
+        if console:
+            handlers.append(logging.StreamHandler())
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter())
+        root = logging.getLogger()
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # flush what is still queued on exit
+        atexit.register(_listener.stop)
+        return _listener
+
+
+def log_event(event, level=logging.INFO, sample_every=None, sample_key=None, **fields):
+    """
+    One structured record: a short event name plus its fields, formatted
+    off-thread. With `sample_every`, one in that many records of the call
+    site is kept, counted apart per `sample_key`.
+    """
+    logger = logging.getLogger()
+    if not logger.isEnabledFor(level):
+        return
+    extra = {"fields": fields}
+    if sample_every:
+        extra["sample_every"] = sample_every
+        extra["sample_key"] = sample_key
+    logger.log(level, event, extra=extra, stacklevel=2)
@@ -0,0 +1,236 @@
+import argparse
+import bisect
+import hashlib
+import importlib
+import logging
+import multiprocessing
+import time
+
+import governor
+import market_data
+
+DEFAULT_SYMBOLS = [
+    "BTCUSDT",
+    "ETHUSDT",
+    "BNBUSDT",
+    "SOLUSDT",
+    "XRPUSDT",
+    "DOGEUSDT",
+    "ADAUSDT",
+    "SHIBUSDT",
+    "AVAXUSDT",
+    "WBTCUSDT",
+    "TRXUSDT",
+    "LINKUSDT",
+]
+EXCHANGE_INFO_URL = market_data.BASE_URL + "/api/v3/exchangeInfo"
+# /api/v3/exchangeInfo request weight
+EXCHANGE_INFO_WEIGHT = 20
+# seconds between runs of each job, like start_scheduler
+SCHEDULE = {"5m": 5 * 60, "1h": 31 * 60}
+
+
+def load_symbols(source=None, quote="USDT"):
+    """
+    The symbols to follow: the default list, every trading `quote` pair on
+    the exchange ("exchange") or one symbol per line from a file.
+    """
+    if source is None:
+        return list(DEFAULT_SYMBOLS)
+    if source == "exchange":
+        response = governor.get_governor().get(EXCHANGE_INFO_URL, weight=EXCHANGE_INFO_WEIGHT)
+        response.raise_for_status()
+        return sorted(
+            item["symbol"]
+            for item in response.json()["symbols"]
+            if item["quoteAsset"] == quote and item["status"] == "TRADING"
+        )
+    with open(source) as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of symbols onto workers. Every worker sits on the ring
+    `replicas` times, so a joining or leaving worker only moves about
+    1/len(workers) of the symbols and shards stay even.
+    """
+
+    def __init__(self, workers=(), replicas=100):
+        self.replicas = replicas
+        self.points = []
+        self.owners = {}
+        for worker in workers:
+            self.add(worker)
+
+    @property
+    def workers(self):
+        return sorted(set(self.owners.values()))
+
+    def add(self, worker):
+        for i in range(self.replicas):
+            point = _hash(f"{worker}#{i}")
+            if point not in self.owners:
+                bisect.insort(self.points, point)
+                self.owners[point] = worker
+
+    def remove(self, worker):
+        for i in range(self.replicas):
+            point = _hash(f"{worker}#{i}")
+            if self.owners.get(point) == worker:
+                del self.owners[point]
+                self.points.remove(point)
+
+    def owner(self, symbol):
+        if not self.points:
+            raise LookupError("No workers on the ring.")
+        i = bisect.bisect(self.points, _hash(symbol)) % len(self.points)
+        return self.owners[self.points[i]]
+
+
+class Universe:
+    """The symbol set and its assignment to workers."""
+
+    def __init__(self, symbols, workers=(), replicas=100):
+        self.symbols = list(symbols)
+        self.ring = HashRing(workers, replicas)
+
+    def shards(self):
+        shards = {worker: [] for worker in self.ring.workers}
+        for symbol in self.symbols:
+            shards[self.ring.owner(symbol)].append(symbol)
+        return shards
+
+    def shard(self, worker):
+        return [symbol for symbol in self.symbols if self.ring.owner(symbol) == worker]
+
+    def join(self, worker):
+        """Add a worker, returns {symbol: (old worker, new worker)} for what moved."""
+        return self._rebalance(lambda: self.ring.add(worker))
+
+    def leave(self, worker):
+        return self._rebalance(lambda: self.ring.remove(worker))
+
+    def set_symbols(self, symbols):
+        self.symbols = list(symbols)
+
+    def _rebalance(self, change):
+        before = {symbol: self.ring.owner(symbol) for symbol in self.symbols} if self.ring.points else {}
+        change()
+        after = {symbol: self.ring.owner(symbol) for symbol in self.symbols} if self.ring.points else {}
+        return {
+            symbol: (before.get(symbol), after.get(symbol))
+            for symbol in self.symbols
+            if before.get(symbol) != after.get(symbol)
+        }
+
+
+def run_worker(name, shards, stop, schedule=SCHEDULE):
+    """
+    One worker process: the scheduled jobs of 4hchart for the symbols its
+    entry in `shards` currently names, re-read before every run.
+    """
+    import trade_logging
+
+    trade_logging.setup_logging(filename=f"order_logs_{name}.log")
+    chart = importlib.import_module("4hchart")
+    next_run = {interval: time.time() for interval in schedule}
+    while not stop.is_set():
+        interval = min(next_run, key=next_run.get)
+        if stop.wait(max(next_run[interval] - time.time(), 0)):
+            break
+        next_run[interval] += schedule[interval]
+        symbols = list(shards.get(name, []))
+        logging.info("Worker %s runs %s for %s symbols.", name, interval, len(symbols))
+        if symbols:
+            chart.scheduled_fetch(interval, symbols=symbols)
+
+
+class LocalCluster:
+    """Worker processes on this machine, shards handed out through a shared dict."""
+
+    def __init__(self, universe, schedule=SCHEDULE):
+        self.universe = universe
+        self.schedule = schedule
+        self.manager = multiprocessing.Manager()
+        self.shards = self.manager.dict()
+        self.stop_event = self.manager.Event()
+        self.processes = {}
+        self.names = (f"worker-{i}" for i in range(1_000_000))
+
+    def add_worker(self):
+        name = next(self.names)
+        moved = self.universe.join(name)
+        self._publish(moved)
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(name, self.shards, self.stop_event, self.schedule),
+            name=name,
+            daemon=True,
+        )
+        process.start()
+        self.processes[name] = process
+        return name
+
+    def remove_worker(self, name):
+        process = self.processes.pop(name)
+        moved = self.universe.leave(name)
+        self.shards.pop(name, None)
+        self._publish(moved)
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+    def check(self):
+        """Take dead workers off the ring so their symbols move to the live ones."""
+        for name, process in list(self.processes.items()):
+            if not process.is_alive():
+                logging.warning("Worker %s exited with %s, rebalancing.", name, process.exitcode)
+                self.remove_worker(name)
+
+    def update_symbols(self, symbols):
+        self.universe.set_symbols(symbols)
+        self._publish()
+
+    def _publish(self, moved=None):
+        for worker, shard in self.universe.shards().items():
+            self.shards[worker] = shard
+        if moved:
+            logging.info("Rebalanced %s symbols: %s", len(moved), moved)
+
+    def stop(self):
+        self.stop_event.set()
+        for process in self.processes.values():
+            process.join(timeout=30)
+        self.manager.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the live loop sharded over local worker processes.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--source", default=None, help='"exchange", a file with one symbol per line, or the default list')
+    parser.add_argument("--restart", action="store_true", help="start a new worker for every one that dies")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    universe = Universe(load_symbols(args.source))
+    cluster = LocalCluster(universe)
+    for _ in range(args.workers):
+        cluster.add_worker()
+    for worker, shard in universe.shards().items():
+        print(f"{worker}: {len(shard)} symbols")
+    try:
+        while True:
+            time.sleep(5)
+            cluster.check()
+            if args.restart:
+                for _ in range(args.workers - len(cluster.processes)):
+                    cluster.add_worker()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()